@@ -1,21 +1,54 @@
 import pygame
+import numpy
+import os
+import sys
+import time
+import collections
+import shared
+import timing
 
 
-# An array of named animation frames
-frame_data = {}
-whitemasked_frame_data = {}
+# The source image of each animation and the size of its frames
+# Animations with no frame size are a single static image
+ANIMATIONS = {
+    'player_run': ('./res/gfx/player_run.png', (32, 32), True),
+    'player_jump': ('./res/gfx/player_jump.png', (32, 32), True),
+    'player_hurt': ('./res/gfx/player_hurt.png', None, True),
+    'player_liftoff': ('./res/gfx/player_liftoff.png', (32, 32), True),
+    'bullet': ('./res/gfx/bullet.png', None, True),
+    'carrot_run': ('./res/gfx/carrot.png', (32, 32), True),
+    'onion_run': ('./res/gfx/onion_run.png', (32, 32), True),
+    'onion_attack': ('./res/gfx/onion_attack.png', (32, 32), True),
+    'onion_death': ('./res/gfx/onion_death.png', (64, 64), True),
+    'tomato_idle': ('./res/gfx/tomato_idle.png', (32, 32), True),
+    'tomato_attack': ('./res/gfx/tomato_attack.png', (32, 32), True),
+    'tomato_projectile': ('./res/gfx/tomato_projectile.png', None, True),
+    'level': ('./res/gfx/map.png', None, False)
+}
+ANIMATIONS_TO_WHITEMASK = ['player_hurt', 'onion_run', 'onion_attack', 'tomato_idle', 'tomato_attack']
 
+# Generated tint variants are saved here, keyed by the hash of their source image
+TINT_CACHE_DIR = './cache/gfx/'
 
-# Loads an animation from a given path
-def load(path, frame_size, has_alpha=True):
-    # load animation source sheet
-    sprite_sheet = pygame.image.load(path)
+# Frames whose pixels are all either fully opaque or fully transparent are drawn with this color as their transparent color key instead of per-pixel alpha
+COLORKEY = (255, 0, 255)
+
+
+# Converts a decoded sprite sheet to the display format and splits it into frames. Animations with no frame size are a single frame
+# Must be called on the main thread, after the display mode is set
+def load_frames(sprite_sheet, frame_size, has_alpha=True):
     if has_alpha:
-        sprite_sheet.convert_alpha()
+        sprite_sheet = sprite_sheet.convert_alpha()
     else:
-        sprite_sheet.convert()
+        sprite_sheet = sprite_sheet.convert()
+
+    if frame_size is None:
+        return [sprite_sheet]
+    return split_frames(sprite_sheet, frame_size)
+
 
-    # split source sheet into an array of individual frames
+# Splits a sprite sheet into an array of individual frames
+def split_frames(sprite_sheet, frame_size):
     frames = []
     frame_count = (sprite_sheet.get_width() / frame_size[0]) * (sprite_sheet.get_height() / frame_size[1])
     frame_x = 0
@@ -31,14 +64,15 @@ def load(path, frame_size, has_alpha=True):
     return frames
 
 
-def load_static(path, has_alpha=True):
-    sprite = pygame.image.load(path)
-    if has_alpha:
-        sprite.convert_alpha()
-    else:
-        sprite.convert()
+# Returns a copy of a surface where every pixel that isn't fully transparent is set to the given color
+# The surface is converted to a bitmask and back, so the work happens in pygame's C code instead of per pixel in python
+def tint_surface(surface, color):
+    return pygame.mask.from_surface(surface, 0).to_surface(setcolor=color, unsetcolor=(0, 0, 0, 0))
 
-    return [sprite]
+
+# Returns a tinted copy of an animation
+def generate_tint(source_animation, color):
+    return [tint_surface(frame, color) for frame in source_animation]
 
 
 # Returns a copy of an animation but each pixel is white
@@ -46,47 +80,239 @@ def load_static(path, has_alpha=True):
 # Normally you would probably use shaders for this, but pygame doesn't give us a nice way to implement those,
 # and I figured pre-generating copies of the animations upfront would be kinder on the game's FPS than trying to do per-pixel software rendering in real time
 def generate_whitemask(source_animation):
-    whitemask = []
-    for frame in source_animation:
-        whitemasked_frame = pygame.Surface(frame.get_size(), pygame.SRCALPHA, 32)
-        for x in range(0, frame.get_width()):
-            for y in range(0, frame.get_height()):
-                if frame.get_at((x, y)).a != 0:
-                    whitemasked_frame.set_at((x, y), pygame.Color(255, 255, 255, 255))
-        whitemask.append(whitemasked_frame)
-
-    return whitemask
-
-
-# Loads all the animations
-# This is placed here so that it can be called explicitly after pygame has initialized, otherwise some of the image loading functions will fail
-def load_all():
-    global frame_data, whitemasked_frame_data
-
-    frame_data = {
-        'player_run': load('./res/gfx/player_run.png', (32, 32), True),
-        'player_jump': load('./res/gfx/player_jump.png', (32, 32), True),
-        'player_hurt': load_static('./res/gfx/player_hurt.png', True),
-        'player_liftoff': load('./res/gfx/player_liftoff.png', (32, 32), True),
-        'bullet': load_static('./res/gfx/bullet.png', True),
-        'carrot_run': load('./res/gfx/carrot.png', (32, 32), True),
-        'onion_run': load('./res/gfx/onion_run.png', (32, 32), True),
-        'onion_attack': load('./res/gfx/onion_attack.png', (32, 32), True),
-        'onion_death': load('./res/gfx/onion_death.png', (64, 64), True),
-        'tomato_idle': load('./res/gfx/tomato_idle.png', (32, 32), True),
-        'tomato_attack': load('./res/gfx/tomato_attack.png', (32, 32), True),
-        'tomato_projectile': load_static('./res/gfx/tomato_projectile.png', True),
-        'level': load_static('./res/gfx/map.png', False)
-    }
-
-    animations_to_whitemask = ['player_hurt', 'onion_run', 'onion_attack', 'tomato_idle', 'tomato_attack']
-    for anim_name in animations_to_whitemask:
-        whitemasked_frame_data[anim_name] = generate_whitemask(frame_data[anim_name])
+    return generate_tint(source_animation, shared.Color.WHITE)
+
+
+def get_tint_cache_path(path, color, source_hash):
+    color_name = ''.join(['{:02x}'.format(value) for value in color])
+    return TINT_CACHE_DIR + os.path.splitext(os.path.basename(path))[0] + '_' + color_name + '_' + source_hash + '.png'
+
+
+# Returns a tinted copy of the sprite sheet at the given path
+# The tinted sprite sheet is generated once and cached on disk, and is only regenerated when the source image changes
+# Doesn't need the display, so it can run on a loader thread
+def decode_tint(path, color):
+    cache_path = get_tint_cache_path(path, color, shared.hash_file(path).hex())
+    if os.path.exists(cache_path):
+        sprite_sheet = pygame.image.load(cache_path)
+    else:
+        sprite_sheet = tint_surface(pygame.image.load(path), color)
+
+        # Remove the variants generated from older versions of the source image before caching the new one
+        os.makedirs(TINT_CACHE_DIR, exist_ok=True)
+        stale_prefix = os.path.basename(cache_path)[:-len('.png') - 40]
+        for filename in os.listdir(TINT_CACHE_DIR):
+            if filename.startswith(stale_prefix):
+                os.remove(TINT_CACHE_DIR + filename)
+        pygame.image.save(sprite_sheet, cache_path)
+    return sprite_sheet
+
+
+# Returns a copy of an animation with each frame mirrored horizontally
+def generate_flipped(source_animation):
+    return [pygame.transform.flip(frame, True, False) for frame in source_animation]
+
+
+# Returns whether a surface can be drawn with COLORKEY as its transparent color without changing how it looks
+def can_use_colorkey(surface):
+    alpha = pygame.surfarray.array_alpha(surface)
+    if not numpy.isin(alpha, (0, 255)).all():
+        return False
+    is_key_colored = (pygame.surfarray.array3d(surface) == COLORKEY).all(axis=2)
+    return not (is_key_colored & (alpha == 255)).any()
+
+
+# Returns a standalone copy of a frame in the display's pixel format, set up for the fastest blits the frame allows
+# Frames with all-or-nothing alpha become RLE colorkeyed surfaces, frames with partial alpha keep per-pixel alpha but are RLE encoded too,
+# and opaque frames are plain display-format surfaces
+# Frames are copied rather than kept as subsurfaces of their sprite sheet because SDL only RLE encodes whole surfaces
+def prepare_surface(surface, has_alpha):
+    if not has_alpha:
+        return surface.convert()
+    if can_use_colorkey(surface):
+        prepared = pygame.Surface(surface.get_size()).convert()
+        prepared.fill(COLORKEY)
+        prepared.blit(surface, (0, 0))
+        prepared.set_colorkey(COLORKEY, pygame.RLEACCEL)
+        return prepared
+    prepared = surface.convert_alpha()
+    prepared.set_alpha(255, pygame.RLEACCEL)
+    return prepared
+
+
+# Checks that a prepared surface can be blitted to the display without a per-pixel format conversion
+def verify_surface(name, surface):
+    display_surface = pygame.display.get_surface()
+    assert surface.get_bitsize() == display_surface.get_bitsize() and surface.get_masks()[:3] == display_surface.get_masks()[:3], 'Animation ' + name + ' is not in the display format'
+    assert surface.get_parent() is None, 'Animation ' + name + ' is still a subsurface of its sprite sheet'
+
+
+# The variants every animation can be loaded with
+# Every animation also has a horizontally flipped copy of its frames so that getting a left-facing frame doesn't allocate a new surface
+FRAMES = 'frames'
+FLIPPED = 'flipped'
+WHITEMASKED = 'whitemasked'
+FLIPPED_WHITEMASKED = 'flipped_whitemasked'
+
+
+# Reads and decodes the images of an animation. Doesn't need the display, so it can run on a loader thread
+# Returns the name, the decoded sprite sheet and the decoded whitemask sheet, or None if the animation has no whitemask
+def decode_asset(anim_name):
+    path, frame_size, has_alpha = ANIMATIONS[anim_name]
+    whitemask_sheet = None
+    if anim_name in ANIMATIONS_TO_WHITEMASK:
+        whitemask_sheet = decode_tint(path, shared.Color.WHITE)
+    return anim_name, pygame.image.load(path), whitemask_sheet
+
+
+# Turns the decoded images of an animation into its variants, returning a dict of variant name to prepared frames
+# Must be called on the main thread, after the display mode is set
+def finalize_asset(decoded):
+    anim_name, sprite_sheet, whitemask_sheet = decoded
+    path, frame_size, has_alpha = ANIMATIONS[anim_name]
+    frames = load_frames(sprite_sheet, frame_size, has_alpha)
+
+    variants = {FRAMES: frames}
+    # The level background is never drawn flipped, so skip making a copy of the largest image we have
+    if anim_name != 'level':
+        variants[FLIPPED] = generate_flipped(frames)
+    if whitemask_sheet is not None:
+        variants[WHITEMASKED] = load_frames(whitemask_sheet, frame_size)
+        variants[FLIPPED_WHITEMASKED] = generate_flipped(variants[WHITEMASKED])
+
+    # Every other variant is generated from the loaded frames, so the frames are only prepared for drawing once all of them exist
+    for variant_name in variants.keys():
+        variants[variant_name] = [prepare_surface(frame, has_alpha) for frame in variants[variant_name]]
+        for frame in variants[variant_name]:
+            verify_surface(anim_name, frame)
+    return variants
+
+
+def load_asset(anim_name):
+    return finalize_asset(decode_asset(anim_name))
+
+
+def get_surface_bytes(surface):
+    return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+
+# Keeps the animations that have been used loaded, loading each one the first time it's needed
+# Tracks how many bytes of pixels each animation takes, and evicts the least recently used animations while over the memory budget
+# The most recently used animation is never evicted, so a budget that's too small makes animations reload instead of failing
+class AssetRegistry:
+    MEMORY_BUDGET = 64 * 1024 * 1024
+
+    def __init__(self, budget=MEMORY_BUDGET):
+        self.budget = budget
+        self.assets = collections.OrderedDict()
+        self.asset_bytes = {}
+        self.loaded_bytes = 0
+        self.loads = 0
+        self.evictions = 0
+        self.queued = set()
+
+    # Returns the variants of an animation, loading it if needed, and marks it as the most recently used
+    def get(self, anim_name):
+        variants = self.assets.get(anim_name)
+        if variants is None:
+            return self.load(anim_name)
+        self.assets.move_to_end(anim_name)
+        return variants
+
+    def load(self, anim_name):
+        start_time = time.perf_counter()
+        variants = self.add(anim_name, load_asset(anim_name))
+        print('loaded animation ' + anim_name + ' in ' + '{:.1f}'.format((time.perf_counter() - start_time) * 1000) + 'ms', file=sys.stderr)
+        return variants
+
+    def add(self, anim_name, variants):
+        self.assets[anim_name] = variants
+        self.asset_bytes[anim_name] = sum([get_surface_bytes(frame) for frames in variants.values() for frame in frames])
+        self.loaded_bytes += self.asset_bytes[anim_name]
+        self.loads += 1
+        self.evict()
+        return variants
+
+    def is_loaded(self, anim_name):
+        return anim_name in self.assets
+
+    # Loads every animation in the list that isn't loaded yet, e.g. the animations the next level uses, so that they don't load in the middle of play
+    def prefetch(self, anim_names):
+        for anim_name in anim_names:
+            self.get(anim_name)
+
+    # Queues every animation in the list that isn't loaded or queued yet on a background loader
+    # Each is decoded on a worker thread and added to the registry when the loader finalizes it on the main thread
+    def queue_prefetch(self, asset_loader, anim_names):
+        for anim_name in anim_names:
+            if anim_name not in self.assets and anim_name not in self.queued:
+                self.queued.add(anim_name)
+                asset_loader.add(decode_asset, self.finish_prefetch, anim_name)
+
+    def finish_prefetch(self, decoded):
+        anim_name = decoded[0]
+        self.queued.discard(anim_name)
+        if anim_name not in self.assets:
+            self.add(anim_name, finalize_asset(decoded))
+
+    def evict(self):
+        while self.loaded_bytes > self.budget and len(self.assets) > 1:
+            anim_name, variants = self.assets.popitem(last=False)
+            self.loaded_bytes -= self.asset_bytes.pop(anim_name)
+            self.evictions += 1
+
+    def set_budget(self, budget):
+        self.budget = budget
+        self.evict()
+
+    def clear(self):
+        self.assets.clear()
+        self.asset_bytes.clear()
+        self.loaded_bytes = 0
+
+    def __str__(self):
+        return '{} loaded {:.1f}/{:.1f}MB loads {} evictions {}'.format(len(self.assets), self.loaded_bytes / (1024 * 1024), self.budget / (1024 * 1024), self.loads, self.evictions)
+
+
+# Looks up one variant of the animations in the registry by name, loading the animation if needed
+class AnimationTable:
+    def __init__(self, variant_name):
+        self.variant_name = variant_name
+
+    def __getitem__(self, anim_name):
+        return registry.get(anim_name)[self.variant_name]
+
+
+registry = AssetRegistry()
+frame_data = AnimationTable(FRAMES)
+flipped_frame_data = AnimationTable(FLIPPED)
+whitemasked_frame_data = AnimationTable(WHITEMASKED)
+flipped_whitemasked_frame_data = AnimationTable(FLIPPED_WHITEMASKED)
+
+
+# Sets up the asset registry with the given memory budget in bytes. Animations are loaded the first time they're used, or when prefetched
+# This is placed here so that it can be called explicitly after pygame has initialized and the display mode is set, otherwise some of the image loading functions will fail
+def init(budget=AssetRegistry.MEMORY_BUDGET):
+    registry.clear()
+    registry.set_budget(budget)
+    timing.frame_timer.set_counter('asset_registry', registry)
+
+
+def prefetch(anim_names):
+    registry.prefetch(anim_names)
+
+
+def queue_prefetch(asset_loader, anim_names):
+    registry.queue_prefetch(asset_loader, anim_names)
 
 
 #  An instance of an animation. Refers to the frames of an animation without actually storing duplicate loaded images
 class Animation:
     def __init__(self, name, fps):
+        self.restart(name, fps)
+
+    # Puts the animation back into the state it was created in, so that pooled animations can be reused for a different animation
+    def restart(self, name, fps):
         self.name = name
         self.set_fps(fps)
         self.reset()
@@ -111,17 +337,14 @@ class Animation:
                 self.finished = True
 
     def get_frame(self):
-        frame = None
-        if self.whitemask:
-            frame = whitemasked_frame_data[self.name][self.frame]
-        else:
-            frame = frame_data[self.name][self.frame]
-        return pygame.transform.flip(frame, self.flip_h, False)
+        return self.get_frame_at(self.frame)
 
+    # Frames are looked up in the pre-generated tables, so no surfaces are created here
     def get_frame_at(self, index):
-        frame = None
         if self.whitemask:
-            frame = whitemasked_frame_data[self.name][index]
-        else:
-            frame = frame_data[self.name][index]
-        return pygame.transform.flip(frame, self.flip_h, False)
+            if self.flip_h:
+                return flipped_whitemasked_frame_data[self.name][index]
+            return whitemasked_frame_data[self.name][index]
+        if self.flip_h:
+            return flipped_frame_data[self.name][index]
+        return frame_data[self.name][index]
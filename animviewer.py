@@ -18,12 +18,18 @@ class AnimViewer:
 
         self.font = pygame.font.Font('./res/hack.ttf', 10)
 
+        # While the animation plays, frames where only the animation frame changed just redraw the rect around it
+        self.redraw = True
+        self.drawn_frame = None
+        self.drawn_frame_rect = None
+
     def on_resume(self):
         pass
 
     def handle_input(self, event):
         if event.type == pygame.KEYDOWN:
             self.handle_keydown(event)
+            self.redraw = True
 
     def get_key_as_number(event_key):
         if event_key >= pygame.K_0 and event_key <= pygame.K_9:
@@ -102,6 +108,25 @@ class AnimViewer:
         self.anim.set_fps(self.anim_fps)
         self.typing_fps = False
 
+    # Returns the rect the given animation frame is drawn at, centered on the display at the current scale
+    def get_frame_rect(self, anim_frame):
+        target_width = int(anim_frame.get_width() * self.scale)
+        target_height = int(anim_frame.get_height() * self.scale)
+        return pygame.Rect((shared.DISPLAY_WIDTH / 2) - (target_width / 2), (shared.DISPLAY_HEIGHT / 2) - (target_height / 2), target_width, target_height)
+
+    # Returns the rects that changed since the last call, or None if everything has to be redrawn
+    def get_dirty_rects(self):
+        if self.redraw:
+            self.redraw = False
+            return None
+        anim_frame = self.anim.get_frame()
+        if anim_frame is self.drawn_frame:
+            return []
+        return [self.drawn_frame_rect, self.get_frame_rect(anim_frame)]
+
+    def set_interpolation(self, alpha):
+        pass
+
     def update(self, delta):
         if self.playing and not self.typing_fps:
             self.anim.update(delta)
@@ -113,6 +138,8 @@ class AnimViewer:
         target_width = int(anim_frame.get_width() * self.scale)
         target_height = int(anim_frame.get_height() * self.scale)
         rendered_frame = pygame.transform.scale(anim_frame, (target_width, target_height))
+        self.drawn_frame = anim_frame
+        self.drawn_frame_rect = self.get_frame_rect(anim_frame)
 
         rendered_frame_position = (display_center[0] - (target_width / 2), display_center[1] - (target_height / 2))
         hitbox_position = None
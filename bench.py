@@ -0,0 +1,486 @@
+import pygame
+import os
+import sys
+import time
+import json
+import csv
+import random
+import shared
+import input
+import animation
+import level
+import mapfile
+import stream
+import projectile
+import present
+import replay
+
+
+# Headless benchmark harness
+# Runs Level.update and Level.render for a fixed number of frames with a fixed delta and scripted input,
+# across every combination of the requested enemy counts, bullet counts and map widths
+# Usage: main.py --bench [--frames N] [--enemies K,...] [--bullets M,...] [--map-widths W,...] [--format json|csv] [--out path]
+#
+# With --bench-present, the per-frame cost of each presentation backend is measured instead, for every requested window size
+# Usage: main.py --bench --bench-present [--frames N] [--backends name,...] [--windows WxH,...] [--format json|csv] [--out path]
+#
+# With --bench-blit, the blit throughput of each animation's frames as loaded by the asset registry is compared against
+# frames cut straight out of the unconverted PNGs, which is how animations used to be drawn
+# Usage: main.py --bench --bench-blit [--frames N] [--format json|csv] [--out path]
+#
+# With --bench-alloc, the number of shared.Vector objects and pygame surfaces created per frame is counted instead of timing anything
+# Usage: main.py --bench --bench-alloc [--frames N] [--enemies K,...] [--bullets M,...] [--format json|csv] [--out path]
+#
+# With --bench-replay, the level is stepped through each given input recording (made with main.py --record) as fast as possible,
+# and the state it ends in is checked against the state the recording ended in
+# Usage: main.py --bench --bench-replay path,... [--format json|csv] [--out path]
+#
+# With --bench-walk, the player holds right from its spawn on each given map, and the distance it covers is checked
+# Catches maps where the player spawns stuck in the floor or a wall
+# Usage: main.py --bench --bench-walk path,... [--frames N] [--format json|csv] [--out path]
+
+DEFAULT_FRAMES = 600
+BENCH_MAP = 'map/map.bin'
+WALK_FRAMES = 120
+
+# The pygame functions that create surfaces, which the allocation benchmark wraps to count surfaces where they're made,
+# whichever module makes them. Surface methods like copy() and subsurface() belong to a built-in type and can't be wrapped
+SURFACE_FACTORIES = [(pygame, 'Surface')] + \
+    [(pygame.transform, name) for name in ['flip', 'scale', 'scale_by', 'smoothscale', 'smoothscale_by', 'rotate', 'rotozoom', 'scale2x', 'chop', 'laplacian', 'grayscale']] + \
+    [(pygame.image, name) for name in ['load', 'frombytes', 'fromstring', 'frombuffer']]
+DELTA = 1.0
+SEED = 0
+
+
+# Must be called before pygame.init() so that the benchmark never opens a window or an audio device
+def use_headless_drivers():
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    os.environ['SDL_AUDIODRIVER'] = 'dummy'
+
+
+def parse_int_list(value):
+    return [int(num) for num in value.split(',')]
+
+
+def read_args(args):
+    options = {
+        'frames': DEFAULT_FRAMES,
+        'enemies': [0],
+        'bullets': [0],
+        'map_widths': [0],
+        'backends': present.BACKENDS,
+        'windows': [(1280, 720)],
+        'format': 'json',
+        'out': None,
+        'replays': [],
+        'walk_maps': []
+    }
+    for i in range(0, len(args)):
+        if args[i] == '--frames':
+            options['frames'] = int(args[i + 1])
+        elif args[i] == '--enemies':
+            options['enemies'] = parse_int_list(args[i + 1])
+        elif args[i] == '--bullets':
+            options['bullets'] = parse_int_list(args[i + 1])
+        elif args[i] == '--map-widths':
+            options['map_widths'] = parse_int_list(args[i + 1])
+        elif args[i] == '--backends':
+            options['backends'] = args[i + 1].split(',')
+        elif args[i] == '--windows':
+            options['windows'] = [tuple([int(num) for num in window.split('x')]) for window in args[i + 1].split(',')]
+        elif args[i] == '--format':
+            options['format'] = args[i + 1]
+        elif args[i] == '--out':
+            options['out'] = args[i + 1]
+        elif args[i] == '--bench-replay':
+            options['replays'] = args[i + 1].split(',')
+        elif args[i] == '--bench-walk':
+            options['walk_maps'] = args[i + 1].split(',')
+    return options
+
+
+# Widens the loaded level to the given width by repeating its platforms and background side by side
+# The widened map is written to a chunk file and streamed from disk like a real level
+# A width of 0 keeps the level as it is
+def widen_level(level_state, map_width):
+    if map_width == 0:
+        return
+
+    tile_size, tile_platforms, tile_spawns = level.read_mapfile(BENCH_MAP)
+    image_path = mapfile.get_image_path(BENCH_MAP)
+    size = (map_width, tile_size[1])
+    platforms = []
+    for tile_x in range(0, map_width, tile_size[0]):
+        for platform in tile_platforms:
+            if platform[0] + tile_x < map_width:
+                platforms.append((platform[0] + tile_x, platform[1], min(platform[2], map_width - platform[0] - tile_x), platform[3]))
+
+    chunks_path = stream.CHUNKS_DIR + 'bench_' + str(map_width) + '.chunks'
+    source_hash = stream.hash_map(size, platforms, [], image_path)
+    if stream.read_chunks_hash(chunks_path) != source_hash:
+        tile_background = pygame.image.load(image_path)
+
+        def make_background(index, rect):
+            background = pygame.Surface(rect[2:])
+            for tile_x in range(rect[0] - (rect[0] % tile_size[0]), rect[0] + rect[2], tile_size[0]):
+                background.blit(tile_background, (tile_x - rect[0], 0))
+            return background
+        stream.write_chunks(chunks_path, source_hash, size, stream.add_walls(size, platforms), [], make_background)
+    level_state.set_source(stream.ChunkFile(chunks_path))
+
+
+# Replaces the level's spawn table with enemies scattered across the level, alternating between onions and tomatoes
+# Like the enemies of a real map, they are only created once the camera comes near them
+def spawn_enemies(level_state, enemy_count, rng):
+    spawns = []
+    for i in range(0, enemy_count):
+        kind = 'onion' if i % 2 == 0 else 'tomato'
+        spawns.append((kind, rng.uniform(64, level_state.width - 64), rng.uniform(32, 200)))
+    level_state.set_spawns(spawns)
+
+
+# Keeps the requested number of bullets alive by spawning new ones around the player
+def refill_bullets(level_state, bullet_count, rng):
+    projectiles = level_state.projectiles
+    missing_bullets = bullet_count - int(projectiles.kind_counts[projectile.BULLET])
+    for i in range(0, missing_bullets):
+        position = (level_state.player.position.x + rng.uniform(-shared.DISPLAY_WIDTH / 2, shared.DISPLAY_WIDTH / 2), rng.uniform(16, level_state.height - 16))
+        velocity = (rng.choice([-1, 1]) * projectile.Bullet.SPEED, 0)
+        projectiles.spawn(projectile.BULLET, position, velocity)
+
+
+def press(key):
+    input.handle(pygame.event.Event(pygame.KEYDOWN, key=key))
+
+
+def release(key):
+    input.handle(pygame.event.Event(pygame.KEYUP, key=key))
+
+
+# Feeds the same key presses on the same frames every run: run back and forth, jump and keep shooting
+def apply_scripted_input(frame):
+    if frame % 480 == 0:
+        release(pygame.K_a)
+        press(pygame.K_d)
+    elif frame % 480 == 240:
+        release(pygame.K_d)
+        press(pygame.K_a)
+    if frame % 45 == 0:
+        press(pygame.K_SPACE)
+    elif frame % 45 == 5:
+        release(pygame.K_SPACE)
+    if frame % 8 == 0:
+        press(pygame.K_l)
+    elif frame % 8 == 1:
+        release(pygame.K_l)
+
+
+def run_scenario(game, frames, enemy_count, bullet_count, map_width):
+    rng = random.Random(SEED)
+    input.reset_to_defaults()
+    input.reset_all()
+
+    level_state = level.Level()
+    level_state.load_file(BENCH_MAP)
+    widen_level(level_state, map_width)
+    spawn_enemies(level_state, enemy_count, rng)
+    # Room for every requested bullet, so that none of them are dropped by the pool
+    level_state.projectiles = projectile.ProjectileSystem([max(bullet_count, projectile.Bullet.POOL_LIMIT), projectile.TomatoHead.POOL_LIMIT])
+
+    update_time = 0
+    render_time = 0
+    total_time = 0
+    awake_enemies = 0
+    pairs = 0
+    drawn_sprites = 0
+    culled_sprites = 0
+    for frame in range(0, frames):
+        apply_scripted_input(frame)
+        refill_bullets(level_state, bullet_count, rng)
+
+        frame_start = time.perf_counter()
+        level_state.update(DELTA)
+        update_end = time.perf_counter()
+        game.render_clear()
+        level_state.render(game.display)
+        render_end = time.perf_counter()
+        game.render_flip()
+        frame_end = time.perf_counter()
+
+        update_time += update_end - frame_start
+        render_time += render_end - update_end
+        total_time += frame_end - frame_start
+        awake_enemies += len(level_state.enemies)
+        pairs += level_state.broadphase.get_total_pairs()
+        drawn_sprites += level_state.render_queue.stats.drawn
+        culled_sprites += level_state.render_queue.stats.culled
+
+    return {
+        'frames': frames,
+        'enemies': enemy_count,
+        'awake_enemies': awake_enemies / frames,
+        'bullets': bullet_count,
+        'pairs': pairs / frames,
+        'drawn_sprites': drawn_sprites / frames,
+        'culled_sprites': culled_sprites / frames,
+        'map_width': level_state.width,
+        'platforms': level_state.chunks.source.platform_count,
+        'peak_chunks': level_state.chunks.stats.peak_resident,
+        'update_ms': 1000 * update_time / frames,
+        'render_ms': 1000 * render_time / frames,
+        'total_ms': 1000 * total_time / frames,
+        'update_fps': frames / update_time,
+        'render_fps': frames / render_time,
+        'total_fps': frames / total_time
+    }
+
+
+# Renders one level frame and then times presenting it over and over with each backend
+def run_present_benchmark(game, frames, backend, window_size):
+    game.window_size = window_size
+    game.set_presenter(backend)
+
+    level_state = level.Level()
+    level_state.load_file(BENCH_MAP)
+    game.render_clear()
+    level_state.render(game.display)
+
+    scale_time = 0
+    flip_time = 0
+    for frame in range(0, frames):
+        frame_start = time.perf_counter()
+        game.presenter.scale()
+        scale_end = time.perf_counter()
+        game.presenter.flip()
+        frame_end = time.perf_counter()
+
+        scale_time += scale_end - frame_start
+        flip_time += frame_end - scale_end
+
+    return {
+        'frames': frames,
+        'backend': backend,
+        'actual_backend': game.presenter.name,
+        'window': str(window_size[0]) + 'x' + str(window_size[1]),
+        'scale_ms': 1000 * scale_time / frames,
+        'flip_ms': 1000 * flip_time / frames,
+        'total_ms': 1000 * (scale_time + flip_time) / frames
+    }
+
+
+# Returns the frames of an animation cut out of its sprite sheet exactly as it was loaded from disk
+def load_unprepared_frames(path, frame_size):
+    sprite_sheet = pygame.image.load(path)
+    if frame_size is None:
+        return [sprite_sheet]
+    return animation.split_frames(sprite_sheet, frame_size)
+
+
+# Blits every frame of a list over and over across the display and returns how many blits were done per second
+def measure_blits(display, frames, repeats):
+    positions = [((i * 37) % (shared.DISPLAY_WIDTH - 32), (i * 23) % (shared.DISPLAY_HEIGHT - 32)) for i in range(0, repeats)]
+    start_time = time.perf_counter()
+    for frame in frames:
+        for position in positions:
+            display.blit(frame, position)
+    return (len(frames) * repeats) / (time.perf_counter() - start_time)
+
+
+def run_blit_benchmark(game, frames):
+    results = []
+    for anim_name, (path, frame_size, has_alpha) in animation.ANIMATIONS.items():
+        unprepared_rate = measure_blits(game.display, load_unprepared_frames(path, frame_size), frames)
+        prepared_rate = measure_blits(game.display, animation.frame_data[anim_name], frames)
+        results.append({
+            'animation': anim_name,
+            'frame_size': 'x'.join([str(value) for value in animation.frame_data[anim_name][0].get_size()]),
+            'unprepared_blits_per_sec': unprepared_rate,
+            'prepared_blits_per_sec': prepared_rate,
+            'speedup': prepared_rate / unprepared_rate
+        })
+    return results
+
+
+# Runs the same scripted frames as run_scenario, counting every shared.Vector created while updating and rendering
+def run_allocation_benchmark(game, frames, enemy_count, bullet_count):
+    rng = random.Random(SEED)
+    input.reset_to_defaults()
+    input.reset_all()
+
+    level_state = level.Level()
+    level_state.load_file(BENCH_MAP)
+    spawn_enemies(level_state, enemy_count, rng)
+    level_state.projectiles = projectile.ProjectileSystem([max(bullet_count, projectile.Bullet.POOL_LIMIT), projectile.TomatoHead.POOL_LIMIT])
+
+    vector_count = [0]
+    original_init = shared.Vector.__init__
+
+    def counting_init(vector, x, y):
+        vector_count[0] += 1
+        original_init(vector, x, y)
+
+    surface_count = [0]
+    original_factories = [getattr(module, name) for module, name in SURFACE_FACTORIES]
+
+    def counting_factory(factory):
+        def create(*args, **kwargs):
+            surface_count[0] += 1
+            return factory(*args, **kwargs)
+        return create
+
+    update_vectors = 0
+    render_vectors = 0
+    update_surfaces = 0
+    render_surfaces = 0
+    shared.Vector.__init__ = counting_init
+    for (module, name), factory in zip(SURFACE_FACTORIES, original_factories):
+        setattr(module, name, counting_factory(factory))
+    try:
+        for frame in range(0, frames):
+            apply_scripted_input(frame)
+            refill_bullets(level_state, bullet_count, rng)
+
+            vector_count[0] = 0
+            surface_count[0] = 0
+            level_state.update(DELTA)
+            update_vectors += vector_count[0]
+            update_surfaces += surface_count[0]
+            vector_count[0] = 0
+            surface_count[0] = 0
+            game.render_clear()
+            level_state.render(game.display)
+            render_vectors += vector_count[0]
+            render_surfaces += surface_count[0]
+    finally:
+        shared.Vector.__init__ = original_init
+        for (module, name), factory in zip(SURFACE_FACTORIES, original_factories):
+            setattr(module, name, factory)
+
+    return {
+        'frames': frames,
+        'enemies': enemy_count,
+        'bullets': bullet_count,
+        'update_vectors_per_frame': update_vectors / frames,
+        'render_vectors_per_frame': render_vectors / frames,
+        'vectors_per_frame': (update_vectors + render_vectors) / frames,
+        'update_surfaces_per_frame': update_surfaces / frames,
+        'render_surfaces_per_frame': render_surfaces / frames
+    }
+
+
+# Steps a fresh level through a recording with the recording's fixed delta, rendering after every step
+def run_replay_benchmark(game, path):
+    recording = replay.Replay(path)
+    delta = (game.SECOND / recording.tick_rate) / game.UPDATE_TIME
+    input.reset_to_defaults()
+    input.reset_all()
+
+    level_state = level.Level()
+    level_state.load_file(recording.map_path)
+
+    update_time = 0
+    render_time = 0
+    input.tick_hook = recording
+    try:
+        while not recording.is_finished():
+            frame_start = time.perf_counter()
+            level_state.update(delta)
+            update_end = time.perf_counter()
+            game.render_clear()
+            level_state.render(game.display)
+            render_end = time.perf_counter()
+
+            update_time += update_end - frame_start
+            render_time += render_end - update_end
+    finally:
+        input.tick_hook = None
+
+    ticks = max(recording.tick, 1)
+    state_hash = level_state.hash_state()
+    return {
+        'replay': path,
+        'map': recording.map_path,
+        'ticks': recording.tick,
+        'update_ms': 1000 * update_time / ticks,
+        'render_ms': 1000 * render_time / ticks,
+        'total_ms': 1000 * (update_time + render_time) / ticks,
+        'state_hash': state_hash.hex(),
+        'matches_recording': recording.state_hash == state_hash if recording.has_state_hash() else None
+    }
+
+
+# Holds right for the given number of frames once the player has landed from its spawn, and reports how far it got
+# The player can walk if it covered at least half the distance it would on open ground
+def run_walk_check(path, frames=WALK_FRAMES):
+    input.reset_to_defaults()
+    input.reset_all()
+
+    level_state = level.Level()
+    level_state.load_file(path)
+    level_state.set_spawns([])
+    for frame in range(0, WALK_FRAMES):
+        if level_state.player.grounded:
+            break
+        level_state.update(DELTA)
+    start = level_state.player.position.as_tuple()
+
+    press(pygame.K_d)
+    for frame in range(0, frames):
+        level_state.update(DELTA)
+    release(pygame.K_d)
+
+    walked = level_state.player.position.x - start[0]
+    return {
+        'map': path,
+        'frames': frames,
+        'start': start,
+        'walked': walked,
+        'can_walk': walked >= frames * DELTA * level_state.player.SPEED / 2
+    }
+
+
+def write_results(results, output_format, outfile):
+    if output_format == 'csv':
+        writer = csv.DictWriter(outfile, fieldnames=list(results[0].keys()))
+        writer.writeheader()
+        writer.writerows(results)
+    else:
+        json.dump(results, outfile, indent=4)
+        outfile.write('\n')
+
+
+def run(game, args):
+    options = read_args(args)
+
+    results = []
+    if '--bench-present' in args:
+        original_window_size = game.window_size
+        original_backend = game.presenter.name
+        for window_size in options['windows']:
+            for backend in options['backends']:
+                results.append(run_present_benchmark(game, options['frames'], backend, window_size))
+        game.window_size = original_window_size
+        game.set_presenter(original_backend)
+    elif '--bench-blit' in args:
+        results = run_blit_benchmark(game, options['frames'])
+    elif '--bench-replay' in args:
+        results = [run_replay_benchmark(game, path) for path in options['replays']]
+    elif '--bench-walk' in args:
+        frames = WALK_FRAMES if '--frames' not in args else options['frames']
+        results = [run_walk_check(path, frames) for path in options['walk_maps']]
+    elif '--bench-alloc' in args:
+        for enemy_count in options['enemies']:
+            for bullet_count in options['bullets']:
+                results.append(run_allocation_benchmark(game, options['frames'], enemy_count, bullet_count))
+    else:
+        for map_width in options['map_widths']:
+            for enemy_count in options['enemies']:
+                for bullet_count in options['bullets']:
+                    results.append(run_scenario(game, options['frames'], enemy_count, bullet_count, map_width))
+
+    if options['out'] is None:
+        write_results(results, options['format'], sys.stdout)
+    else:
+        outfile = open(options['out'], 'w', newline='')
+        write_results(results, options['format'], outfile)
+        outfile.close()
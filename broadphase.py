@@ -0,0 +1,109 @@
+import numpy
+
+
+# Every kind of dynamic pair the level asks the broadphase for, in the order the pair counts are shown in the debug overlay
+PAIR_TYPES = ['player_enemy', 'enemy_enemy', 'bullet_enemy', 'bullet_projectile', 'projectile_player']
+
+
+def empty_pairs():
+    return numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int)
+
+
+# Returns the pairs of the given candidate index arrays whose rects actually overlap
+def filter_overlapping(rects_a, rects_b, a_indices, b_indices):
+    a = rects_a[a_indices]
+    b = rects_b[b_indices]
+    overlapping = ~((a[:, 0] + a[:, 2] <= b[:, 0]) | (b[:, 0] + b[:, 2] <= a[:, 0]) | (a[:, 1] + a[:, 3] <= b[:, 1]) | (b[:, 1] + b[:, 3] <= a[:, 1]))
+    return a_indices[overlapping], b_indices[overlapping]
+
+
+# Expands each run of candidates [starts[i], ends[i]) of a sorted order into flat (i, sorted position) index arrays
+def expand_runs(starts, ends):
+    counts = numpy.maximum(ends - starts, 0)
+    total = int(counts.sum())
+    run_indices = numpy.repeat(numpy.arange(len(starts)), counts)
+    run_offsets = numpy.arange(total) - numpy.repeat(numpy.cumsum(counts) - counts, counts)
+    return run_indices, numpy.repeat(starts, counts) + run_offsets
+
+
+# Sort-and-sweep broadphase for the things that move
+# Rects are sorted by their left edge, and each rect is only tested against the rects whose x intervals overlap its own,
+# so a dense fight costs about as many tests as there are rects actually near each other instead of every rect against every other rect
+# All rects are (N, 4) arrays of (x, y, width, height) rows. Pairs are returned as two index arrays sorted by the first index, then the second
+# The level resets the broadphase once per step, and the number of overlapping pairs found of each type is kept as a metric
+class Broadphase:
+    def __init__(self):
+        self.pair_counts = {}
+        self.reset()
+
+    def reset(self):
+        for pair_type in PAIR_TYPES:
+            self.pair_counts[pair_type] = 0
+
+    # Returns every overlapping pair between two different sets of rects
+    def find_pairs(self, pair_type, rects_a, rects_b):
+        if len(rects_a) == 0 or len(rects_b) == 0:
+            return empty_pairs()
+
+        # No rect of b can reach further left than its own width from its left edge, which bounds where the sweep of each rect of a starts
+        order = numpy.argsort(rects_b[:, 0], kind='stable')
+        sorted_lefts = rects_b[order, 0]
+        starts = numpy.searchsorted(sorted_lefts, rects_a[:, 0] - rects_b[:, 2].max(), 'right')
+        ends = numpy.searchsorted(sorted_lefts, rects_a[:, 0] + rects_a[:, 2], 'left')
+        a_indices, sorted_positions = expand_runs(starts, ends)
+        a_indices, b_indices = filter_overlapping(rects_a, rects_b, a_indices, order[sorted_positions])
+
+        sorted_pairs = numpy.lexsort((b_indices, a_indices))
+        self.pair_counts[pair_type] += len(sorted_pairs)
+        return a_indices[sorted_pairs], b_indices[sorted_pairs]
+
+    # Returns every overlapping pair within one set of rects, each pair once with the lower index first
+    def find_self_pairs(self, pair_type, rects):
+        if len(rects) < 2:
+            return empty_pairs()
+
+        # Sweeping left to right, each rect only needs testing against the rects after it that start before it ends
+        order = numpy.argsort(rects[:, 0], kind='stable')
+        sorted_lefts = rects[order, 0]
+        starts = numpy.arange(1, len(rects) + 1)
+        ends = numpy.searchsorted(sorted_lefts, sorted_lefts + rects[order, 2], 'left')
+        sorted_indices, sorted_positions = expand_runs(starts, ends)
+        a_indices, b_indices = filter_overlapping(rects, rects, order[sorted_indices], order[sorted_positions])
+
+        low_indices = numpy.minimum(a_indices, b_indices)
+        high_indices = numpy.maximum(a_indices, b_indices)
+        sorted_pairs = numpy.lexsort((high_indices, low_indices))
+        self.pair_counts[pair_type] += len(sorted_pairs)
+        return low_indices[sorted_pairs], high_indices[sorted_pairs]
+
+    # Returns a list holding, for each rect, the sorted indices of every other rect it overlaps
+    def find_neighbors(self, pair_type, rects):
+        neighbors = [[] for i in range(0, len(rects))]
+        for a_index, b_index in zip(*self.find_self_pairs(pair_type, rects)):
+            neighbors[a_index].append(b_index)
+            neighbors[b_index].append(a_index)
+        for neighbor_list in neighbors:
+            neighbor_list.sort()
+        return neighbors
+
+    # Returns, for each rect of a, the index of the lowest indexed rect of b it overlaps, or -1 if it overlaps none
+    def find_first_hits(self, pair_type, rects_a, rects_b):
+        first_hits = numpy.full(len(rects_a), -1)
+        a_indices, b_indices = self.find_pairs(pair_type, rects_a, rects_b)
+        if len(a_indices) != 0:
+            # Pairs are sorted, so the first pair of each rect of a holds its lowest indexed hit
+            hit_indices, first_pairs = numpy.unique(a_indices, return_index=True)
+            first_hits[hit_indices] = b_indices[first_pairs]
+        return first_hits
+
+    def get_total_pairs(self):
+        return sum(self.pair_counts.values())
+
+
+# Grows each (x, y, width, height) rect by a margin on every side. The margin is either one number for every rect or an array with one per rect
+def pad_rects(rects, margins):
+    return rects + (numpy.asarray(margins, dtype=float)[..., numpy.newaxis] * numpy.array([-1, -1, 2, 2]))
+
+
+def to_rect_array(rects):
+    return numpy.array(rects, dtype=float).reshape(-1, 4)
@@ -0,0 +1,89 @@
+import math
+import shared
+
+
+# A static collision world which buckets rects into a uniform grid (spatial hash)
+# Queries only look at the cells an AABB overlaps, so the cost of a collision check depends on how crowded the area around an entity is instead of on the size of the whole map
+class CollisionWorld:
+    CELL_SIZE = 64
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self.clear()
+
+    # Rects are kept by id, and queries return them sorted by id
+    # Rects added without an id get the next one after the highest id used so far, i.e. they're sorted in the order they were added
+    def clear(self):
+        self.rects = {}
+        self.cells = {}
+        self.next_id = 0
+
+    def get_cell_range(self, rect):
+        # Rects are half-open, so a rect ending exactly on a cell border doesn't belong to the next cell
+        # Entity hitboxes have fractional edges, so the last cell comes from the real end of the rect rather than its last whole pixel
+        min_x = int(rect[0] // self.cell_size)
+        min_y = int(rect[1] // self.cell_size)
+        max_x = max(min_x, math.ceil((rect[0] + rect[2]) / self.cell_size) - 1)
+        max_y = max(min_y, math.ceil((rect[1] + rect[3]) / self.cell_size) - 1)
+        return min_x, min_y, max_x, max_y
+
+    def add(self, rect, rect_id=None):
+        if rect_id is None:
+            rect_id = self.next_id
+        assert rect_id not in self.rects, 'Collision rect id ' + str(rect_id) + ' is already in use'
+        self.next_id = max(self.next_id, rect_id + 1)
+        self.rects[rect_id] = rect
+        min_x, min_y, max_x, max_y = self.get_cell_range(rect)
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                cell = self.cells.get((cell_x, cell_y))
+                if cell is None:
+                    self.cells[(cell_x, cell_y)] = [rect_id]
+                else:
+                    cell.append(rect_id)
+
+    def remove(self, rect_id):
+        min_x, min_y, max_x, max_y = self.get_cell_range(self.rects.pop(rect_id))
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                cell = self.cells[(cell_x, cell_y)]
+                cell.remove(rect_id)
+                if len(cell) == 0:
+                    del self.cells[(cell_x, cell_y)]
+
+    def add_all(self, rects):
+        for rect in rects:
+            self.add(rect)
+
+    # Returns every rect overlapping the given AABB, sorted by id
+    def query(self, rect):
+        min_x, min_y, max_x, max_y = self.get_cell_range(rect)
+        candidates = set()
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                cell = self.cells.get((cell_x, cell_y))
+                if cell is not None:
+                    candidates.update(cell)
+
+        return [self.rects[index] for index in sorted(candidates) if shared.is_rect_collision(rect, self.rects[index])]
+
+    # Returns True if any rect overlaps the given AABB, stopping at the first hit
+    def collides(self, rect):
+        min_x, min_y, max_x, max_y = self.get_cell_range(rect)
+        for cell_x in range(min_x, max_x + 1):
+            for cell_y in range(min_y, max_y + 1):
+                cell = self.cells.get((cell_x, cell_y))
+                if cell is None:
+                    continue
+                for index in cell:
+                    if shared.is_rect_collision(rect, self.rects[index]):
+                        return True
+        return False
+
+
+# Returns the AABB covering a rect both before and after it moved by the given movement
+# Used by entities to query the collision world for everything they may have touched during a step
+def swept_rect(rect, movement):
+    min_x = min(rect[0], rect[0] - movement.x)
+    min_y = min(rect[1], rect[1] - movement.y)
+    return (min_x, min_y, rect[2] + abs(movement.x), rect[3] + abs(movement.y))
@@ -1,25 +1,27 @@
 import pygame
+import sys
 import shared
 import enemy
 import level
 
 
 # The level editor state class
+# Level geometry is streamed from compiled chunk files, which the editor has no way to write back to, so editing platforms and saving maps aren't supported.
+# Maps are edited as images or Tiled maps and compiled instead. The editor can still look around a level and move the player and enemies
 class Editor:
-    VALID_OBJECTS = ['object_floor', 'object_platform']
-
-    def __init__(self, screen_size):
+    def __init__(self):
         self.level = level.Level()
-        self.screen_scale = (screen_size[0] / shared.DISPLAY_WIDTH, screen_size[1] / shared.DISPLAY_HEIGHT)
         self.input_string = ''
         self.held_object = None
         self.render_gridlines = True
         self.grid_size = 16
 
         self.font = pygame.font.Font('./res/hack.ttf', 10)
+        self.redraw = True
 
-    def scale_to_screen(self, pos):
-        return (int(pos[0] / self.screen_scale[0]), int(pos[1] / self.screen_scale[1]))
+    # Mouse positions arrive already converted to display pixels, but may be fractional
+    def to_pixel(self, pos):
+        return (int(pos[0]), int(pos[1]))
 
     def snap_to_grid(self, pos):
         return (int(pos[0] / self.grid_size) * self.grid_size, int(pos[1] / self.grid_size) * self.grid_size)
@@ -27,7 +29,10 @@ class Editor:
     def on_resume(self):
         pass
 
+    # The editor only changes in response to input, so it's redrawn after keys and clicks, and after mouse movement that moves something
     def handle_input(self, event):
+        if event.type == pygame.KEYDOWN or event.type == pygame.MOUSEBUTTONDOWN:
+            self.redraw = True
         if event.type == pygame.MOUSEMOTION:
             self.handle_mousemovement(event)
         elif event.type == pygame.KEYDOWN:
@@ -38,10 +43,7 @@ class Editor:
     def handle_keydown(self, event):
         if self.held_object is not None:
             if event.key == pygame.K_d:
-                if self.held_object in self.level.platforms:
-                    self.level.platforms.remove(self.held_object)
-                    self.held_object = None
-                elif self.held_object in self.level.enemies:
+                if self.held_object in self.level.enemies:
                     self.level.enemies.remove(self.held_object)
                     self.held_object = None
             return
@@ -57,20 +59,20 @@ class Editor:
 
     def handle_mousemovement(self, event):
         if pygame.mouse.get_pressed()[2]:
-            camera_movement = shared.Vector.from_tuple(self.scale_to_screen(event.rel))
+            camera_movement = shared.Vector.from_tuple(self.to_pixel(event.rel))
             self.level.camera_offset = self.level.camera_offset.minus(camera_movement)
+            if self.level.chunks is not None:
+                self.level.update_chunks()
+            self.redraw = True
         elif self.held_object is not None:
-            self.held_object.position = shared.Vector.from_tuple(self.snap_to_grid(self.scale_to_screen(event.pos))).sum_with(self.level.camera_offset)
+            self.held_object.position = shared.Vector.from_tuple(self.snap_to_grid(self.to_pixel(event.pos))).sum_with(self.level.camera_offset)
+            self.redraw = True
 
     def handle_mousedown(self, event):
         if self.held_object is not None:
             self.held_object = None
         elif self.input_string == '':
-            mouse_pos = shared.Vector.from_tuple(self.scale_to_screen(event.pos)).sum_with(self.level.camera_offset).as_tuple()
-            for platform in self.level.platforms:
-                if shared.point_in_rect(mouse_pos, platform.get_hitbox()):
-                    self.held_object = platform
-                    return
+            mouse_pos = shared.Vector.from_tuple(self.to_pixel(event.pos)).sum_with(self.level.camera_offset).as_tuple()
             for enemy_obj in self.level.enemies:
                 if shared.point_in_rect(mouse_pos, enemy_obj.get_hitbox()):
                     self.held_object = enemy_obj
@@ -81,10 +83,7 @@ class Editor:
     def handle_command(self, command):
         command_parts = command.split(' ')
         if command_parts[0] == 'place' and len(command_parts) == 2:
-            if command_parts[1] in Editor.VALID_OBJECTS:
-                self.held_object = level.Platform(command_parts[1], 0, 0)
-                self.level.platforms.append(self.held_object)
-            elif command_parts[1] == 'onion':
+            if command_parts[1] == 'onion':
                 self.held_object = enemy.Onion()
                 self.level.enemies.append(self.held_object)
         elif command_parts[0] == 'grid':
@@ -97,12 +96,21 @@ class Editor:
             elif len(command_parts) == 3 and command_parts[1] == 'size' and command_parts[2].isnumeric():
                 self.grid_size = int(command_parts[2])
         elif command_parts[0] == 'save':
-            if len(command_parts) == 2:
-                self.level.save_as(command_parts[1])
+            print('saving maps from the editor is not supported', file=sys.stderr)
         elif command_parts[0] == 'load':
             if len(command_parts) == 2:
                 self.level.load_file(command_parts[1])
 
+    # Returns None if the editor has to be redrawn, or an empty list if nothing changed since the last call
+    def get_dirty_rects(self):
+        if self.redraw:
+            self.redraw = False
+            return None
+        return []
+
+    def set_interpolation(self, alpha):
+        pass
+
     def update(self, delta):
         pass
 
@@ -1,5 +1,7 @@
 import shared
 import animation
+import collision
+import projectile
 
 
 class Enemy:
@@ -19,6 +21,7 @@ class Enemy:
         self.position = shared.Vector.ZERO()
         self.velocity = shared.Vector.ZERO()
         self.movement = shared.Vector.ZERO()
+        self.previous_position = None
 
         self.attack_animation.finished = True
 
@@ -29,6 +32,17 @@ class Enemy:
         self.health = self.MAX_HEALTH
         self.has_projectile = False
 
+    # Called by the level before each step so that rendering can interpolate between steps
+    def store_previous_position(self):
+        if self.previous_position is None:
+            self.previous_position = shared.Vector(self.position.x, self.position.y)
+        else:
+            self.previous_position.set_to(self.position)
+
+    # Returns everything about the enemy that carries over from one step to the next, for comparing runs
+    def get_state(self):
+        return (type(self).__name__,) + self.position.as_tuple() + self.velocity.as_tuple() + (self.direction, self.grounded, self.invuln_timer, self.health, self.attack_animation.frame, self.attack_animation.timer, self.attack_animation.finished)
+
     def get_hitbox(self):
         return (self.position.x + self.hitbox[0], self.position.y + self.hitbox[1], self.hitbox[2], self.hitbox[3])
 
@@ -41,11 +55,17 @@ class Enemy:
     def is_hurtbox_enabled(self):
         return False
 
-    def get_projectile(self, player_center):
-        return None
+    # Enemies only ever fall, so this is the furthest an enemy can move along either axis in one step of delta 1
+    def get_max_step_speed(self):
+        return max(self.SPEED, Enemy.MAX_FALL_SPEED)
 
-    def get_death_particle(self):
-        return None
+    # Enemies that fire projectiles spawn them into the given projectile system when has_projectile is set
+    def spawn_projectile(self, projectiles, player_center):
+        pass
+
+    # Enemies that leave something behind when they die spawn it into the given particle system
+    def spawn_death_particle(self, particles):
+        pass
 
     def set_direction(self, player_center):
         self.direction = 0
@@ -55,7 +75,7 @@ class Enemy:
             else:
                 self.direction = -1
 
-    def update(self, delta, player_center, player_rect, platforms):
+    def update(self, delta, player_center, player_rect, collision_world, colliders):
         self.set_direction(player_center)
 
         self.velocity.x = self.direction * self.SPEED
@@ -63,10 +83,10 @@ class Enemy:
         if self.velocity.y > Enemy.MAX_FALL_SPEED:
             self.velocity.y = Enemy.MAX_FALL_SPEED
 
-        self.movement = self.velocity.multiply_by(delta)
-        self.position = self.position.sum_with(self.movement)
+        self.movement.set_to(self.velocity).iscale(delta)
+        self.position.iadd(self.movement)
 
-        self.check_collisions(platforms)
+        self.check_collisions(collision_world, colliders)
 
         self.invuln_timer -= delta
         if self.invuln_timer < 0:
@@ -89,11 +109,13 @@ class Enemy:
         else:
             self.run_animation.update(delta)
 
-    def check_collisions(self, colliders):
+    # Collides against the static rects of the collision world near the enemy's movement, followed by any dynamic colliders
+    def check_collisions(self, collision_world, colliders):
         self.grounded = False
+        colliders = collision_world.query(collision.swept_rect(self.get_hitbox(), self.movement)) + colliders
         for collider in colliders:
             if shared.is_rect_collision(self.get_hitbox(), collider):
-                self.position = self.position.minus(self.movement)
+                self.position.isub(self.movement)
                 x_caused = False
                 y_caused = False
 
@@ -132,6 +154,8 @@ class Enemy:
 
 
 class Onion(Enemy):
+    ANIMATIONS = ['onion_run', 'onion_attack', 'onion_death']
+
     def __init__(self):
         self.SPEED = 1
         self.SEARCH_RADIUS = 200
@@ -142,21 +166,21 @@ class Onion(Enemy):
         self.hurtbox = (-5, 0, 10, 23)
         super().__init__()
 
-    def update(self, delta, player_center, player_rect, platforms):
-        super().update(delta, player_center, player_rect, platforms)
+    def update(self, delta, player_center, player_rect, collision_world, colliders):
+        super().update(delta, player_center, player_rect, collision_world, colliders)
         if self.attack_animation.finished and shared.is_rect_collision(self.get_hurtbox(), player_rect):
             self.attack_animation.finished = False
 
     def is_hurtbox_enabled(self):
         return not self.attack_animation.finished and self.attack_animation.frame == 5
 
-    def get_death_particle(self):
-        death_particle = (animation.Animation('onion_death', 10), self.position.minus(shared.Vector(18, 32)).as_tuple())
-        death_particle.flip_h = self.run_animation.flip_h
-        return death_particle
+    def spawn_death_particle(self, particles):
+        particles.spawn('onion_death', 10, (self.position.x - 18, self.position.y - 32), self.run_animation.flip_h)
 
 
 class Tomato(Enemy):
+    ANIMATIONS = ['tomato_idle', 'tomato_attack', 'tomato_projectile']
+
     def __init__(self):
         self.SPEED = 0
         self.SEARCH_RADIUS = 200
@@ -177,62 +201,42 @@ class Tomato(Enemy):
             else:
                 self.direction = -1
 
-    def update(self, delta, player_center, player_rect, platforms):
+    def update(self, delta, player_center, player_rect, collision_world, colliders):
         if self.attack_animation.finished and self.position.distance_from(player_center) <= self.SEARCH_RADIUS:
             self.attack_animation.finished = False
             self.projectile_primed = True
         elif not self.attack_animation.finished and self.attack_animation.frame == 4 and self.projectile_primed:
             self.has_projectile = True
             self.projectile_primed = False
-        super().update(delta, player_center, player_rect, platforms)
+        super().update(delta, player_center, player_rect, collision_world, colliders)
 
-    def get_projectile(self, player_center):
+    # Lobs a tomato head in an arc that lands on the player's center
+    def spawn_projectile(self, projectiles, player_center):
         self.has_projectile = False
         x_offset = 32
         if self.run_animation.flip_h:
             x_offset = -13
         x_offset = 0
-        return TomatoHead(self.position.sum_with(shared.Vector(x_offset, 0)), player_center, self.run_animation.flip_h)
+        position = self.position.offset_tuple(x_offset, 0)
+        flip_h = self.run_animation.flip_h
 
-
-class TomatoHead():
-    SPEED = 2
-
-    def __init__(self, position, target, flip_h):
-        self.position = position
-        self.animation = animation.Animation('tomato_projectile', 1)
-        self.animation.flip_h = flip_h
-        self.hitbox = (0, 0, 13, 17)
-
-        self.velocity = shared.Vector.ZERO()
-        self.velocity.x = TomatoHead.SPEED
+        velocity_x = projectile.TomatoHead.SPEED
         if flip_h:
-            self.velocity.x *= -1
+            velocity_x *= -1
+        t = (player_center.x - position[0]) / velocity_x
+        velocity_y = (player_center.y - position[1] - (0.5 * projectile.TomatoHead.GRAVITY * t * t)) / t
 
-        t = (target.x - self.position.x) / self.velocity.x
-        self.velocity.y = (target.y - self.position.y - (0.5 * Enemy.GRAVITY * t * t)) / t
+        projectiles.spawn(projectile.TOMATO_HEAD, position, (velocity_x, velocity_y), flip_h)
 
-        self.delete_me = False
 
-    def update(self, delta, platforms):
-        self.velocity.y += Enemy.GRAVITY * delta
+# The enemy class created for each kind of spawn in a mapfile
+SPAWN_CLASSES = {
+    'onion': Onion,
+    'tomato': Tomato
+}
 
-        self.movement = self.velocity.multiply_by(delta)
-        self.position = self.position.sum_with(self.movement)
 
-        for platform in platforms:
-            if shared.is_rect_collision(self.get_hitbox(), platform):
-                self.delete_me = True
-                break
-
-    def get_hitbox(self):
-        return (self.position.x + self.hitbox[0], self.position.y + self.hitbox[1], self.hitbox[2], self.hitbox[3])
-
-    def get_frame(self):
-        return self.animation.get_frame()
-
-    def get_frame_rect(self):
-        return self.position.as_tuple() + self.get_frame().get_size()
-
-    def take_damage(self):
-        self.delete_me = True
+def create(kind, x, y):
+    new_enemy = SPAWN_CLASSES[kind]()
+    new_enemy.position = shared.Vector(x, y)
+    return new_enemy
@@ -12,6 +12,9 @@ is_just_released = [False] * 4
 current_joystick = -1
 keymapping = {}
 
+# A recorder or replay that sees the action states at the start of every level step, if one is set
+tick_hook = None
+
 pygame.joystick.init()
 joysticks = [pygame.joystick.Joystick(i) for i in range(0, pygame.joystick.get_count())]
 
@@ -35,6 +38,12 @@ def reset_all():
     flush_events()
 
 
+# Called by the level at the start of every step
+def begin_tick():
+    if tick_hook is not None:
+        tick_hook.begin_tick()
+
+
 def flush_events():
     global is_just_pressed, is_just_released
 
@@ -1,86 +1,290 @@
 import pygame
 import os
+import hashlib
+import bisect
 import shared
 import input
 import animation
 import player
 import enemy
+import collision
+import broadphase
+import mapfile
+import tmx
+import projectile
+import particle
+import staticlayer
+import renderqueue
+import stream
+import timing
+
+
+# Reads a mapfile, returning the map size, platforms and spawns
+# Compiled .bin mapfiles are rebuilt automatically whenever their sources change, and so are the compiled caches of .tmx maps
+# Any other extension is read as the text format, which is only generated if it doesn't exist yet
+# Doesn't need the display, so it can run on a loader thread
+def read_mapfile(path):
+    if path.endswith('.tmx'):
+        return tmx.load(path)
+    if path.endswith('.bin'):
+        return mapfile.load_binary(path)
+    if not os.path.exists(path):
+        gen_mapfile(path)
+    return mapfile.read_text(path)
+
+
+# Compiles the map image and spawns file belonging to a mapfile path and writes them in the format matching the path's extension
+# Tiled maps have only the one way of compiling them, so the mode is ignored for them
+def gen_mapfile(path, mode='hull'):
+    if path.endswith('.tmx'):
+        tmx.compile_file(path)
+        return
+    size, platforms = mapfile.compile_image(mapfile.get_image_path(path), mode)
+    spawns = mapfile.read_spawns(path)
+    if path.endswith('.bin'):
+        mapfile.write_binary(path, mapfile.hash_sources(path), mode, size, platforms, spawns)
+    else:
+        mapfile.write_text(path, size, platforms, spawns)
+
+
+# The spawn kind marking where the player starts, and where the player starts in maps without one
+PLAYER_SPAWN = 'player'
+DEFAULT_PLAYER_START = (32, 232)
+BACKGROUND_COLOR = (141, 141, 141)
+
+
+# Returns every animation a level with the given spawns draws, so that they can be prefetched before it starts
+def get_asset_names(spawns):
+    asset_names = [projectile.Bullet.ANIMATION] + player.Player.ANIMATIONS
+    for kind in sorted(set([spawn[0] for spawn in spawns if spawn[0] != PLAYER_SPAWN])):
+        asset_names += enemy.SPAWN_CLASSES[kind].ANIMATIONS
+    return asset_names
+
+
+# Returns the image a map's background is made from, or None for maps that don't have one, like Tiled maps
+def get_background_path(path):
+    if path.endswith('.tmx'):
+        return None
+    image_path = mapfile.get_image_path(path)
+    if not os.path.exists(image_path):
+        return None
+    return image_path
+
+
+# Returns a function that makes the background slice of each chunk of a map, for stream.write_chunks()
+# The slices are cut from the map image if it is the size of the map, which is the case for every map compiled from it.
+# The image is loaded whole, as pygame can't decode part of one
+# Other maps don't come with a background, so each slice is drawn from the platforms overlapping it in the colors of the map images
+# Doesn't need the display, so it can run on a loader thread
+def make_background(size, platforms, image_path, chunk_width=stream.CHUNK_WIDTH):
+    if image_path is not None:
+        image = pygame.image.load(image_path)
+        if image.get_size() == tuple(size):
+            return lambda index, rect: image.subsurface(rect)
+
+    chunk_platforms = stream.split_platforms(platforms, size, chunk_width)
+
+    def draw_background(index, rect):
+        background = pygame.Surface(rect[2:])
+        background.fill(BACKGROUND_COLOR)
+        for platform_id, platform in chunk_platforms[index]:
+            # Surface.fill() doesn't clip rects that start left of the surface, so platforms are clipped to the slice first
+            background.fill(shared.Color.BLACK, pygame.Rect(platform).clip(rect).move(-rect[0], -rect[1]))
+        return background
+    return draw_background
+
+
+# Hashes everything the chunk file of a map is split from, without reading the map itself
+# Binary and Tiled maps are keyed on the same source hash their compiled mapfile is checked against, with the mode binary maps were compiled in.
+# Text maps are keyed on the mapfile and the image their background is made from
+def hash_sources(path):
+    if path.endswith('.tmx'):
+        return tmx.hash_sources(path)
+    if path.endswith('.bin'):
+        header = mapfile.read_binary_header(path)
+        mode = 'hull' if header is None else header[0]
+        return hashlib.sha1(mapfile.hash_sources(path) + mode.encode()).digest()
+    if not os.path.exists(path):
+        gen_mapfile(path)
+    source_hash = hashlib.sha1(shared.hash_file(path))
+    image_path = get_background_path(path)
+    if image_path is not None:
+        source_hash.update(shared.hash_file(image_path))
+    return source_hash.digest()
+
+
+# Opens a map for streaming
+# The chunk file is checked against the hash of the map's sources, so opening an up to date map doesn't read any of its platforms.
+# The mapfile is only read in full when the chunk file is missing or out of date and the map has to be split again
+# Doesn't need the display, so it can run on a loader thread
+def open_level(path):
+    source_hash = hash_sources(path)
+    chunks_path = stream.get_chunks_path(path)
+    if stream.read_chunks_hash(chunks_path) != source_hash:
+        size, platforms, spawns = read_mapfile(path)
+        background = make_background(size, platforms, get_background_path(path))
+        stream.write_chunks(chunks_path, source_hash, size, stream.add_walls(size, platforms), spawns, background)
+    return stream.ChunkFile(chunks_path)
 
 
 # The level state class
 class Level:
+    # Enemies are only created or woken up once they come this many pixels from the edge of the screen,
+    # and are put back to sleep once they are further away than the sleep margin
+    # The gap between the two keeps enemies near the edge from waking up and falling asleep every other step
+    ACTIVATION_MARGIN = 96
+    SLEEP_MARGIN = 256
+
     def __init__(self):
         self.player = player.Player()
+        # Reused every step for the point enemies aim at
+        self.player_center = shared.Vector.ZERO()
 
         self.width = 0
         self.height = 0
-        self.background = None
         self.camera_offset = shared.Vector.ZERO()
 
-        self.platforms = []
-
+        # Rendering happens between simulation steps, so positions are drawn interpolated between the previous step and the current one
+        self.interpolation = 1.0
+        self.previous_camera_offset = None
+        self.render_offset = shared.Vector.ZERO()
+
+        # The level geometry is streamed in chunks around the camera, so only the platforms of loaded chunks are in the collision world
+        # self.platforms maps the id of each of those platforms to its rect, and platform_refs to how many loaded chunks it overlaps
+        self.chunks = None
+        self.platforms = {}
+        self.platform_refs = {}
+        self.collision_world = collision.CollisionWorld()
+        self.static_layer = staticlayer.StaticLayer()
+        self.render_queue = renderqueue.RenderQueue()
+
+        # self.enemies only holds awake enemies. Spawns that haven't been created yet and enemies that are asleep are kept dormant,
+        # sorted by x position so that the ones near the camera can be found with a binary search instead of a scan of the whole level
         self.enemies = []
-        self.enemy_projectiles = []
-        self.particles = []
-        self.bullets = []
+        self.dormant_xs = []
+        self.dormant_entries = []
+        self.activation_margin = Level.ACTIVATION_MARGIN
+        self.sleep_margin = Level.SLEEP_MARGIN
+
+        self.particles = particle.ParticleSystem()
+        self.projectiles = projectile.ProjectileSystem()
+        self.broadphase = broadphase.Broadphase()
 
     def on_resume(self):
         input.reset_all()
 
+    # Something in the level moves on nearly every step, so it's always redrawn whole
+    def get_dirty_rects(self):
+        return None
+
+    def set_interpolation(self, alpha):
+        self.interpolation = alpha
+
+    # Returns a position blended between its value at the previous step and its current value by the interpolation factor, as a tuple
+    def interpolate(self, previous, current):
+        if previous is None:
+            return current.as_tuple()
+        return previous.lerp_tuple(current, self.interpolation)
+
+    # Remembers where everything was before this step so that rendering can interpolate from there
+    def store_previous_positions(self):
+        if self.previous_camera_offset is None:
+            self.previous_camera_offset = shared.Vector(self.camera_offset.x, self.camera_offset.y)
+        else:
+            self.previous_camera_offset.set_to(self.camera_offset)
+        self.player.store_previous_position()
+        for enemy_obj in self.enemies:
+            enemy_obj.store_previous_position()
+
     def handle_input(self, event):
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_F2:
+            self.static_layer.set_show_platforms(not self.static_layer.show_platforms)
         input.handle(event)
 
     def update(self, delta):
+        input.begin_tick()
+        self.store_previous_positions()
+        self.broadphase.reset()
+
+        timing.frame_timer.begin('player')
         self.update_player_direction()
         self.update_player_jump()
         self.update_player_shoot()
-        self.player.update(delta, self.platforms + [enemy_obj.get_hitbox() for enemy_obj in self.enemies], [enemy_obj.get_hurtbox() for enemy_obj in self.enemies if enemy_obj.is_hurtbox_enabled()] + [projectile.get_hitbox() for projectile in self.enemy_projectiles])
+        self.player.update(delta, self.collision_world, self.get_player_colliders(delta), self.particles)
         self.update_camera()
-        self.particles += self.player.get_particles()
         self.update_player_shoot()
+        timing.frame_timer.end('player')
+
+        timing.frame_timer.begin('chunks')
+        self.update_chunks()
+        timing.frame_timer.end('chunks')
+
+        timing.frame_timer.begin('enemies')
+        self.update_activation()
+        timing.frame_timer.end('enemies')
 
         player_hitbox = self.player.get_hitbox()
-        player_center = self.player.position.sum_with(shared.Vector(self.player.hitbox_size[0] / 2, self.player.hitbox_size[1] / 2))
+        player_center = self.player_center.set(self.player.position.x + (self.player.hitbox_size[0] / 2), self.player.position.y + (self.player.hitbox_size[1] / 2))
 
-        for enemy_obj in self.enemies:
-            enemy_obj.update(delta, player_center, player_hitbox, self.platforms + [other_enemy.get_hitbox() for other_enemy in self.enemies if other_enemy is not enemy_obj])
+        timing.frame_timer.begin('enemies')
+        enemy_neighbors = self.get_enemy_neighbors(delta)
+        for enemy_obj, neighbors in zip(self.enemies, enemy_neighbors):
+            enemy_obj.update(delta, player_center, player_hitbox, self.collision_world, [self.enemies[index].get_hitbox() for index in neighbors])
             if enemy_obj.is_hurtbox_enabled():
                 enemy_hurtbox = enemy_obj.get_hurtbox()
                 if shared.is_rect_collision(player_hitbox, enemy_hurtbox):
                     self.player.take_damage(enemy_hurtbox, 0)
             if enemy_obj.has_projectile:
-                self.enemy_projectiles.append(enemy_obj.get_projectile(player_center))
+                enemy_obj.spawn_projectile(self.projectiles, player_center)
+        timing.frame_timer.end('enemies')
 
-        for bullet in self.bullets:
-            bullet.update(delta)
-            attackable = bullet.check_collisions(self.platforms, self.enemies + self.enemy_projectiles)
-            if attackable is not None:
-                attackable.take_damage()
+        self.projectiles.update(delta, self.collision_world, self.enemies, self.player, self.broadphase)
 
+        timing.frame_timer.begin('enemies')
         dead_enemies = [enemy_obj for enemy_obj in self.enemies if not enemy_obj.is_alive()]
         for dead_enemy in dead_enemies:
-            death_particle = dead_enemy.get_death_particle()
-            if death_particle is not None:
-                self.particles.append(death_particle)
+            dead_enemy.spawn_death_particle(self.particles)
             self.enemies.remove(dead_enemy)
+        timing.frame_timer.end('enemies')
 
-        self.bullets = [bullet for bullet in self.bullets if not bullet.delete_me]
+        timing.frame_timer.begin('particles')
+        self.particles.update(delta)
+        timing.frame_timer.end('particles')
 
-        for projectile in self.enemy_projectiles:
-            projectile.update(delta, self.platforms)
-            projectile_hitbox = projectile.get_hitbox()
-            if not projectile.delete_me and shared.is_rect_collision(projectile_hitbox, player_hitbox):
-                projectile.delete_me = True
-                self.player.take_damage(projectile_hitbox, 0)
-
-        self.enemy_projectiles = [projectile for projectile in self.enemy_projectiles if not projectile.delete_me]
-
-        for particle in self.particles:
-            particle[0].update(delta)
-        self.particles = [particle for particle in self.particles if not particle[0].finished]
+        for pair_type in broadphase.PAIR_TYPES:
+            timing.frame_timer.set_counter(pair_type + '_pairs', self.broadphase.pair_counts[pair_type])
+        for kind in range(0, len(projectile.KINDS)):
+            timing.frame_timer.set_counter(projectile.KINDS[kind].POOL_NAME + '_pool', self.projectiles.stats[kind])
+        timing.frame_timer.set_counter('particle_pool', self.particles.pool.stats)
 
         input.flush_events()
 
+    # Hashes everything the simulation carries from one step to the next, so that two runs can be checked for having ended the same way
+    def hash_state(self):
+        state_hash = hashlib.sha1()
+        state_hash.update(repr(self.camera_offset.as_tuple() + self.player.get_state()).encode())
+        for enemy_obj in self.enemies:
+            state_hash.update(repr(enemy_obj.get_state()).encode())
+        for entry in self.dormant_entries:
+            state_hash.update(repr(entry if isinstance(entry, tuple) else entry.get_state()).encode())
+        state_hash.update(self.projectiles.get_state())
+        return state_hash.digest()
+
+    # Returns the hitboxes of the enemies the player could run into this step
+    # Enemies haven't moved yet, so only the player's hitbox needs growing by how far the player can move in one step
+    def get_player_colliders(self, delta):
+        enemy_hitboxes = [enemy_obj.get_hitbox() for enemy_obj in self.enemies]
+        player_rect = broadphase.pad_rects(broadphase.to_rect_array([self.player.get_hitbox()]), player.Player.MAX_STEP_SPEED * delta)
+        enemy_indices = self.broadphase.find_pairs('player_enemy', player_rect, broadphase.to_rect_array(enemy_hitboxes))[1]
+        return [enemy_hitboxes[index] for index in enemy_indices]
+
+    # Returns, for each enemy, the indices of the other enemies it could run into this step
+    # Each hitbox is grown by how far its enemy can move in one step, so that any two enemies that can end up overlapping are paired
+    def get_enemy_neighbors(self, delta):
+        enemy_rects = broadphase.to_rect_array([enemy_obj.get_hitbox() for enemy_obj in self.enemies])
+        step_speeds = [enemy_obj.get_max_step_speed() * delta for enemy_obj in self.enemies]
+        return self.broadphase.find_neighbors('enemy_enemy', broadphase.pad_rects(enemy_rects, step_speeds))
+
     def update_player_direction(self):
         if input.is_just_pressed[input.PLAYER_LEFT]:
             self.player.set_direction(-1)
@@ -103,9 +307,7 @@ class Level:
 
     def update_player_shoot(self):
         if input.is_just_pressed[input.PLAYER_SHOOT]:
-            new_bullet = self.player.shoot()
-            if new_bullet is not None:
-                self.bullets.append(new_bullet)
+            self.player.shoot(self.projectiles)
 
     def update_camera(self):
         if self.player.position.x - self.camera_offset.x < shared.DISPLAY_WIDTH * 0.4:
@@ -113,121 +315,127 @@ class Level:
         elif self.player.position.x - self.camera_offset.x > shared.DISPLAY_WIDTH * 0.6:
             self.camera_offset.x = self.player.position.x - (shared.DISPLAY_WIDTH * 0.6)
 
-        if self.camera_offset.x < 0:
-            self.camera_offset.x = 0
-        elif self.camera_offset.x > 2560 - shared.DISPLAY_WIDTH:
-            self.camera_offset.x = 2560 - shared.DISPLAY_WIDTH
-
-    def is_on_screen(self, rect):
-        return shared.is_rect_collision(rect, self.camera_offset.as_tuple() + (shared.DISPLAY_WIDTH, shared.DISPLAY_HEIGHT))
-
-    def camera_offset_rect(self, rect):
-        return (rect[0] - self.camera_offset.x, rect[1] - self.camera_offset.y, rect[2], rect[3])
-
+        self.camera_offset.x = max(0, min(self.camera_offset.x, self.width - shared.DISPLAY_WIDTH))
+
+        # Levels taller than the screen scroll vertically too, keeping the player in the middle third of the screen
+        if self.player.position.y - self.camera_offset.y < shared.DISPLAY_HEIGHT / 3:
+            self.camera_offset.y = self.player.position.y - (shared.DISPLAY_HEIGHT / 3)
+        elif self.player.position.y - self.camera_offset.y > shared.DISPLAY_HEIGHT * 2 / 3:
+            self.camera_offset.y = self.player.position.y - (shared.DISPLAY_HEIGHT * 2 / 3)
+        self.camera_offset.y = max(0, min(self.camera_offset.y, self.height - shared.DISPLAY_HEIGHT))
+
+    # A dormant entry is either a (kind, x, y) spawn that hasn't been created yet or an enemy that was put to sleep
+    def add_dormant(self, x, entry):
+        index = bisect.bisect_right(self.dormant_xs, x)
+        self.dormant_xs.insert(index, x)
+        self.dormant_entries.insert(index, entry)
+
+    def add_spawn(self, kind, x, y):
+        self.add_dormant(x, (kind, x, y))
+
+    # Creates or wakes up every dormant enemy within the activation margin of the camera, and puts awake enemies beyond the sleep margin to sleep
+    # Asleep enemies aren't updated, collided or rendered at all, so the cost of a step only grows with the enemies near the camera
+    def update_activation(self):
+        sleep_min_x = self.camera_offset.x - self.sleep_margin
+        sleep_max_x = self.camera_offset.x + shared.DISPLAY_WIDTH + self.sleep_margin
+        sleeping_enemies = [enemy_obj for enemy_obj in self.enemies if enemy_obj.position.x < sleep_min_x or enemy_obj.position.x > sleep_max_x]
+        for enemy_obj in sleeping_enemies:
+            self.enemies.remove(enemy_obj)
+            self.add_dormant(enemy_obj.position.x, enemy_obj)
+
+        start = bisect.bisect_left(self.dormant_xs, self.camera_offset.x - self.activation_margin)
+        end = bisect.bisect_right(self.dormant_xs, self.camera_offset.x + shared.DISPLAY_WIDTH + self.activation_margin)
+        if start == end:
+            return
+        for entry in self.dormant_entries[start:end]:
+            if isinstance(entry, tuple):
+                entry = enemy.create(*entry)
+            entry.store_previous_position()
+            self.enemies.append(entry)
+        del self.dormant_xs[start:end]
+        del self.dormant_entries[start:end]
+
+    # Uses the interpolated camera offset of the frame being rendered
     def camera_offset_pos(self, pos):
-        return (pos[0] - self.camera_offset.x, pos[1] - self.camera_offset.y)
+        return (pos[0] - self.render_offset.x, pos[1] - self.render_offset.y)
 
+    # Everything is submitted to the render queue, which leaves culling what's off screen to the single flush at the end
     def render(self, display):
-        display.blit(animation.frame_data['level'][0], shared.Vector.ZERO().minus(self.camera_offset).as_tuple())
-        for platform in self.platforms:
-            platform_rect = shared.Vector(platform[0], platform[1]).minus(self.camera_offset).as_tuple() + platform[2:]
-            pygame.draw.rect(display, shared.Color.RED, platform_rect, False)
-        display.blit(self.player.get_frame(), self.player.position.minus(self.camera_offset).as_tuple())
+        self.render_offset.set(*self.interpolate(self.previous_camera_offset, self.camera_offset))
+        self.static_layer.submit(self.render_queue, self.render_offset)
+        player_position = self.interpolate(self.player.previous_position, self.player.position)
+        self.render_queue.submit(renderqueue.PLAYER, self.player.get_frame(), self.camera_offset_pos(player_position))
 
         for enemy_obj in self.enemies:
-            if self.is_on_screen(enemy_obj.get_frame_rect()):
-                display.blit(enemy_obj.get_frame(), enemy_obj.position.minus(self.camera_offset).as_tuple())
+            enemy_position = self.interpolate(enemy_obj.previous_position, enemy_obj.position)
+            self.render_queue.submit(renderqueue.ENEMIES, enemy_obj.get_frame(), self.camera_offset_pos(enemy_position))
 
-        for bullet in self.bullets:
-            if self.is_on_screen(bullet.get_frame_rect()):
-                display.blit(bullet.get_frame(), bullet.position.minus(self.camera_offset).as_tuple())
+        self.projectiles.submit(self.render_queue, self.render_offset.as_tuple(), self.interpolation)
 
-        for projectile in self.enemy_projectiles:
-            if self.is_on_screen(projectile.get_frame_rect()):
-                display.blit(projectile.get_frame(), projectile.position.minus(self.camera_offset).as_tuple())
+        for live_particle in self.particles:
+            self.render_queue.submit(renderqueue.PARTICLES, live_particle.get_frame(), self.camera_offset_pos(live_particle.position))
 
-        for particle in self.particles:
-            if self.is_on_screen(particle[1] + particle[0].get_frame().get_size()):
-                display.blit(particle[0].get_frame(), self.camera_offset_pos(particle[1]))
+        self.render_queue.flush(display)
+        timing.frame_timer.set_counter('render_queue', self.render_queue.stats)
 
     def load_file(self, path):
-        if not os.path.exists(path):
-            self.gen_mapfile(path)
-
-        self.player.position = shared.Vector(32, 232)
-        self.enemies = [enemy.Tomato()]
-        self.enemies[0].position = shared.Vector(128, 232)
-        self.platforms = []
-
-        mapfile = open(path, 'r')
-        for line in mapfile.readlines():
-            command, value = line.split('=')
-            if command == 'size':
-                self.width, self.height = [int(num) for num in value.split(',')]
-            elif command == 'platform':
-                self.platforms.append(tuple([int(num) for num in value.split(',')]))
-        mapfile.close()
-
-        self.platforms.append((0, 0, 1, self.height))
-        self.platforms.append((self.width - 1, 0, 1, self.height))
-        self.platforms.append((0, 0, self.width, 1))
-        self.platforms.append((0, self.height - 1, self.width, 1))
-
-    def gen_mapfile(self, path):
-        map_image_path = 'res/gfx/' + path[path.index('/') + 1:path.index('.')] + '.png'
-        print(map_image_path)
-        map_frame = pygame.image.load(map_image_path)
-        map_frame.convert()
-
-        tiles = []
-        for x in range(0, map_frame.get_width()):
-            tiles.append([])
-            for y in range(0, map_frame.get_height()):
-                color = map_frame.get_at((x, y))
-                tiles[x].append(color.r == 0 and color.g == 0 and color.b == 0)
-
-        breathing_tiles = []
-        for x in range(0, map_frame.get_width()):
-            breathing_tiles.append([])
-            for y in range(0, map_frame.get_height()):
-                if not tiles[x][y]:
-                    breathing_tiles[x].append(False)
-                    continue
-                is_breathing = False
-                adjacents = [(x - 1, y), (x + 1, y), (x, y - 1), (x, y + 1)]
-                for adjacent in adjacents:
-                    if adjacent[0] < 0 or adjacent[0] >= map_frame.get_width() or adjacent[1] < 0 or adjacent[1] >= map_frame.get_height():
-                        continue
-                    if not tiles[adjacent[0]][adjacent[1]]:
-                        is_breathing = True
-                        break
-                breathing_tiles[x].append(is_breathing)
-
-        platforms = []
-        for x in range(0, map_frame.get_width()):
-            for y in range(0, map_frame.get_height()):
-                if breathing_tiles[x][y]:
-                    new_x = x
-                    curr_x = x
-                    while breathing_tiles[curr_x][y]:
-                        breathing_tiles[curr_x][y] = False
-                        curr_x += 1
-                    new_width = curr_x - new_x
-                    platforms.append((new_x, y, new_width, 1))
-
-        for y in range(0, map_frame.get_height()):
-            for x in range(0, map_frame.get_width()):
-                if breathing_tiles[x][y]:
-                    new_y = y
-                    curr_y = y
-                    while breathing_tiles[x][curr_y]:
-                        breathing_tiles[x][curr_y] = False
-                        curr_y += 1
-                    new_height = curr_y - new_y
-                    platforms.append((x, new_y, 1, new_height))
-
-        outfile = open(path, 'w')
-        outfile.write('size=' + str(map_frame.get_width()) + ',' + str(map_frame.get_height()) + '\n')
-        for platform in platforms:
-            outfile.write('platform=' + ','.join([str(value) for value in platform]) + '\n')
-        outfile.close()
+        self.load_level(open_level(path))
+
+    # Sets up the level from an opened chunk file, or anything else streaming chunks the same way
+    def load_level(self, source):
+        animation.prefetch(get_asset_names(source.spawns))
+        player_starts = [spawn[1:] for spawn in source.spawns if spawn[0] == PLAYER_SPAWN]
+        self.player.position = shared.Vector(*(player_starts[0] if len(player_starts) != 0 else DEFAULT_PLAYER_START))
+        self.set_source(source)
+        self.set_spawns([spawn for spawn in source.spawns if spawn[0] != PLAYER_SPAWN])
+
+    # Replaces every enemy in the level with the given (kind, x, y) spawns
+    # None of them are created until the camera comes near, except the ones already in view
+    def set_spawns(self, spawns):
+        self.enemies = []
+        self.dormant_xs = []
+        self.dormant_entries = []
+        for spawn in spawns:
+            self.add_spawn(*spawn)
+        self.update_activation()
+
+    # Replaces the level geometry with a map that is already in memory, walling off the edges of the level
+    def set_map(self, size, platforms, background):
+        self.set_source(stream.MemoryChunks(size, stream.add_walls(size, platforms), [], background))
+
+    # Replaces the level geometry with the chunks of the given source, and loads the chunks around the camera
+    def set_source(self, source):
+        if self.chunks is not None:
+            self.chunks.shutdown()
+        self.width, self.height = source.size
+        self.platforms = {}
+        self.platform_refs = {}
+        self.collision_world.clear()
+        self.static_layer.reset(source.size, source.chunk_width)
+        self.chunks = stream.ChunkStreamer(source, self.on_chunk_load, self.on_chunk_unload)
+        self.update_camera()
+        self.update_chunks()
+
+    # Keeps loaded every chunk an awake enemy could be standing in, and reads the chunks a little further out ahead of time
+    def update_chunks(self):
+        self.chunks.update(self.camera_offset.x - self.sleep_margin, self.camera_offset.x + shared.DISPLAY_WIDTH + self.sleep_margin)
+        timing.frame_timer.set_counter('level_chunks', self.chunks.stats)
+
+    # A platform overlapping several chunks is in the collision world as long as any of them is loaded
+    def on_chunk_load(self, index, platforms, background):
+        for platform_id, platform in platforms:
+            refs = self.platform_refs.get(platform_id, 0)
+            if refs == 0:
+                self.platforms[platform_id] = platform
+                self.collision_world.add(platform, platform_id)
+            self.platform_refs[platform_id] = refs + 1
+        self.static_layer.add_chunk(index, background, [platform for platform_id, platform in platforms])
+
+    def on_chunk_unload(self, index, platforms):
+        for platform_id, platform in platforms:
+            self.platform_refs[platform_id] -= 1
+            if self.platform_refs[platform_id] == 0:
+                del self.platform_refs[platform_id]
+                del self.platforms[platform_id]
+                self.collision_world.remove(platform_id)
+        self.static_layer.remove_chunk(index)
@@ -0,0 +1,50 @@
+import concurrent.futures
+import time
+
+
+# Loads assets in the background on a pool of worker threads
+# Each job is split in two: a decode function run on a worker, for the slow file reading and decoding that doesn't need the display,
+# and a finalize function run on the main thread with the decoded result, for the work that does, like converting surfaces to the display format
+# Finalize functions may add more jobs, e.g. once a map is read the animations it uses can be queued
+class AssetLoader:
+    WORKERS = 4
+    # How long poll() may spend finalizing jobs each call, so that the loading screen keeps drawing while assets finish
+    FINALIZE_BUDGET = 0.008
+
+    def __init__(self, workers=WORKERS):
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        self.jobs = []
+        self.total_jobs = 0
+        self.finished_jobs = 0
+
+    def add(self, decode, finalize, *args):
+        self.jobs.append((self.executor.submit(decode, *args), finalize))
+        self.total_jobs += 1
+
+    # Finalizes jobs whose decoding is done, in the order they were added, until the time budget runs out
+    def poll(self, budget=FINALIZE_BUDGET):
+        start_time = time.perf_counter()
+        while len(self.jobs) != 0 and self.jobs[0][0].done():
+            future, finalize = self.jobs.pop(0)
+            finalize(future.result())
+            self.finished_jobs += 1
+            if time.perf_counter() - start_time >= budget:
+                return
+
+    # Blocks until every job, including any added while waiting, has been decoded and finalized
+    def wait(self):
+        while len(self.jobs) != 0:
+            future, finalize = self.jobs.pop(0)
+            finalize(future.result())
+            self.finished_jobs += 1
+
+    def is_done(self):
+        return len(self.jobs) == 0
+
+    def get_progress(self):
+        if self.total_jobs == 0:
+            return 1.0
+        return self.finished_jobs / self.total_jobs
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
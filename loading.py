@@ -0,0 +1,47 @@
+import pygame
+import shared
+
+
+# The loading screen state class
+# Shows the progress of a background loader, and finalizes the loader's jobs on the main thread a little at a time each update
+# Once everything is loaded, the on_done callback is called once, which is expected to replace this state
+class Loading:
+    BAR_SIZE = (240, 8)
+
+    def __init__(self, asset_loader, on_done):
+        self.asset_loader = asset_loader
+        self.on_done = on_done
+        self.finished = False
+
+        self.bar_pos = ((shared.DISPLAY_WIDTH - Loading.BAR_SIZE[0]) / 2, (shared.DISPLAY_HEIGHT - Loading.BAR_SIZE[1]) / 2)
+        font = pygame.font.Font('./res/hack.ttf', 12)
+        self.title_text = font.render('Loading', False, shared.Color.WHITE)
+        self.title_pos = ((shared.DISPLAY_WIDTH - self.title_text.get_width()) / 2, self.bar_pos[1] - self.title_text.get_height() - 6)
+
+    def on_resume(self):
+        pass
+
+    def handle_input(self, event):
+        pass
+
+    # The progress bar can move on any update
+    def get_dirty_rects(self):
+        return None
+
+    def set_interpolation(self, alpha):
+        pass
+
+    def update(self, delta):
+        if self.finished:
+            return
+        self.asset_loader.poll()
+        if self.asset_loader.is_done():
+            self.finished = True
+            self.on_done()
+
+    def render(self, display):
+        display.blit(self.title_text, self.title_pos)
+        pygame.draw.rect(display, shared.Color.WHITE, self.bar_pos + Loading.BAR_SIZE, True)
+        fill_width = int(Loading.BAR_SIZE[0] * self.asset_loader.get_progress())
+        if fill_width != 0:
+            pygame.draw.rect(display, shared.Color.WHITE, self.bar_pos + (fill_width, Loading.BAR_SIZE[1]), False)
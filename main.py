@@ -1,6 +1,8 @@
 import pygame
 import os
 import sys
+import math
+import time
 import shared
 import input
 import animation
@@ -8,7 +10,13 @@ import level
 import animviewer
 import editor
 import pause
+import loading
+import loader
 import sound
+import bench
+import timing
+import present
+import replay
 
 
 # Class for the main game. Contains game loop and rendering code
@@ -18,121 +26,428 @@ class Game:
     SCREEN_HEIGHT = 720
 
     # Timekeeping constants
+    # The simulation runs in fixed steps of 1 / TICK_RATE seconds, independently of how often frames are rendered
+    # Update deltas stay in units of 1/60th of a second, so at a tick rate of 120 each step is given a delta of 0.5
     TARGET_FPS = 60
+    TICK_RATE = 60
+    MAX_CATCH_UP_STEPS = 5
     SECOND = 1000
     UPDATE_TIME = SECOND / 60.0
 
+    # With --late-input, how many milliseconds the game will wait for the next step to come due so that it can poll input right before it
+    LATE_INPUT_WINDOW = 4
+
+    # Once the state has reported nothing changed for IDLE_FRAMES frames in a row, the loop only runs IDLE_FPS times a second,
+    # sleeping IDLE_POLL_TIME ms at a time in between so that it still wakes up as soon as an event arrives
+    IDLE_FRAMES = 30
+    IDLE_FPS = 10
+    IDLE_POLL_TIME = 5
+
+    # Window events after which the window contents may have been lost, so that the whole frame has to be presented again
+    EXPOSE_EVENT_TYPES = (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED, pygame.WINDOWRESTORED, pygame.WINDOWSIZECHANGED)
+
+    # The events stamped for measuring input latency. Mouse motion is left out, since it arrives in floods and rarely changes anything
+    LATENCY_EVENT_TYPES = (pygame.KEYDOWN, pygame.KEYUP, pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP)
+
     def __init__(self):
+        # Startup metrics are measured from here
+        self.start_time = time.perf_counter()
+        self.first_frame_time = None
+        self.interactive_time = None
+
         # Init pygame window
         os.environ['SDL_VIDEO_CENTERED'] = '1'
+        self.read_display_args()
+        sound.pre_init(self.audio_buffer)
         pygame.init()
-        self.screen = pygame.display.set_mode((Game.SCREEN_WIDTH, Game.SCREEN_HEIGHT), 0, 32)
-        self.display = pygame.Surface((shared.DISPLAY_WIDTH, shared.DISPLAY_HEIGHT))
+        self.set_presenter(self.presenter_name)
         self.clock = pygame.time.Clock()
 
         # Init timekeeping variables
+        self.target_fps = Game.TARGET_FPS
+        self.tick_rate = Game.TICK_RATE
         self.frames = 0
         self.fps = 0
-        self.delta = 0
+        self.accumulator = 0
         self.after_time = 0
         self.before_time = 0
         self.before_sec = 0
+        self.late_input = False
+        self.idle_frames = 0
+        self.full_redraw = True
+        self.drawn_fps = None
+        self.fps_rect = pygame.Rect(0, 0, 0, 0)
 
         # Init fonts
         pygame.font.init()
         self.debug_font = pygame.font.Font('./res/hack.ttf', 10)
+        self.show_timing = False
+        timing.frame_timer.set_counter('input_latency', timing.input_latency)
 
-        pygame.mixer.init()
-        sound.load_all()
+        sound.init(self.audio_buffer)
 
-        # Init animations
-        animation.load_all()
+        # Init animations. They are loaded as they're needed, or in the background while the loading screen is up
+        animation.init(self.asset_budget)
 
         self.read_sys_args()
 
-        self.pause_state = pause.Pause((Game.SCREEN_WIDTH, Game.SCREEN_HEIGHT))
+        self.pause_state = pause.Pause()
         self.running = False
 
+        self.start_loading()
+
+    # Read the system arguments that need to be known before pygame is initialized, the window is created and anything is loaded
+    def read_display_args(self):
+        self.presenter_name = 'software'
+        self.window_size = (Game.SCREEN_WIDTH, Game.SCREEN_HEIGHT)
+        self.vsync = False
+        self.asset_budget = animation.AssetRegistry.MEMORY_BUDGET
+        self.audio_buffer = sound.BUFFER_SIZE
+        for i in range(0, len(sys.argv)):
+            if sys.argv[i] == '--present':
+                self.presenter_name = sys.argv[i + 1]
+            elif sys.argv[i] == '--window':
+                self.window_size = tuple([int(num) for num in sys.argv[i + 1].split('x')])
+            elif sys.argv[i] == '--vsync':
+                self.vsync = True
+            elif sys.argv[i] == '--asset-budget':
+                self.asset_budget = int(float(sys.argv[i + 1]) * 1024 * 1024)
+            elif sys.argv[i] == '--audio-buffer':
+                self.audio_buffer = int(sys.argv[i + 1])
+
+    # (Re)creates the window with the given presentation backend
+    def set_presenter(self, name):
+        self.presenter = present.create(name, self.window_size, self.vsync)
+        self.screen = self.presenter.screen
+        self.display = self.presenter.display
+
     # Read and handle system arguments
+    # The state the game starts in is only created once loading is done
     def read_sys_args(self):
-        self.current_state = None
+        self.start_state = 'level'
+        self.start_map = 'map/map.bin'
+        self.start_map_mode = None
+        self.record_path = None
+        self.replay = None
         for i in range(0, len(sys.argv)):
             if sys.argv[i] == '--animviewer':
-                self.current_state = animviewer.AnimViewer(sys.argv[i + 1])
+                self.start_state = 'animviewer'
+                self.start_anim_name = sys.argv[i + 1]
             elif sys.argv[i] == '--editor':
-                self.current_state = editor.Editor((Game.SCREEN_WIDTH, Game.SCREEN_HEIGHT))
+                self.start_state = 'editor'
             elif sys.argv[i] == '--load':
-                self.current_state = level.Level()
-                self.current_state.load_file(sys.argv[i + 1])
+                self.start_state = 'level'
+                self.start_map = sys.argv[i + 1]
+                self.start_map_mode = None
+            elif sys.argv[i] == '--fps':
+                self.target_fps = int(sys.argv[i + 1])
+            elif sys.argv[i] == '--tick-rate':
+                self.tick_rate = int(sys.argv[i + 1])
+            elif sys.argv[i] == '--late-input':
+                self.late_input = True
+            elif sys.argv[i] == '--timing-csv':
+                timing.frame_timer.open_csv(sys.argv[i + 1])
+            elif sys.argv[i] == '--genmap':
+                self.start_state = 'level'
+                self.start_map = sys.argv[i + 1]
+                self.start_map_mode = sys.argv[i + 2]
+            elif sys.argv[i] == '--record':
+                self.record_path = sys.argv[i + 1]
+            elif sys.argv[i] == '--replay':
+                self.replay = replay.Replay(sys.argv[i + 1])
+                self.start_state = 'level'
+                self.start_map = self.replay.map_path
+                self.start_map_mode = None
 
-    # Runs main game loop
-    def loop(self):
-        if self.current_state is None:
+        # A replay only plays back the same way at the tick rate it was recorded at
+        if self.replay is not None:
+            self.tick_rate = self.replay.tick_rate
+
+    # Starts reading the sounds, the starting map and the animations it uses on background threads, and shows the loading screen meanwhile
+    def start_loading(self):
+        self.asset_loader = loader.AssetLoader()
+        sound.queue_all(self.asset_loader)
+        self.start_map_data = None
+        if self.start_state == 'level':
+            self.asset_loader.add(read_start_map, self.on_start_map_read, self.start_map, self.start_map_mode)
+        self.loading_state = loading.Loading(self.asset_loader, self.finish_loading)
+        self.current_state = self.loading_state
+
+    # Once the map is read, the animations its level uses can be queued too
+    def on_start_map_read(self, map_data):
+        self.start_map_data = map_data
+        animation.queue_prefetch(self.asset_loader, level.get_asset_names(map_data.spawns))
+
+    def finish_loading(self):
+        self.asset_loader.shutdown()
+        if self.start_state == 'animviewer':
+            self.current_state = animviewer.AnimViewer(self.start_anim_name)
+        elif self.start_state == 'editor':
+            self.current_state = editor.Editor()
+        else:
             self.current_state = level.Level()
-            self.current_state.load_file('map/map.txt')
+            self.current_state.load_level(self.start_map_data)
+            self.start_input_hook()
+
+    # Starts recording or replaying the input of the starting level, if asked to with --record or --replay
+    def start_input_hook(self):
+        if self.replay is not None:
+            input.tick_hook = self.replay
+        elif self.record_path is not None:
+            input.tick_hook = replay.Recorder(self.record_path, self.start_map, self.tick_rate)
+
+    # Finishes the recording, or checks that the replay ended in the same state the recording did
+    def stop_input_hook(self):
+        if input.tick_hook is None:
+            return
+        state_hash = self.current_state.hash_state()
+        if input.tick_hook is self.replay:
+            if not self.replay.has_state_hash():
+                result = 'the recording has no state hash to compare with'
+            elif self.replay.state_hash == state_hash:
+                result = 'matches the recording'
+            else:
+                result = 'DIFFERS from the recording ' + self.replay.state_hash.hex()
+            print('replayed ' + str(self.replay.tick) + ' ticks, state hash ' + state_hash.hex() + ' ' + result, file=sys.stderr)
+        else:
+            input.tick_hook.close(state_hash)
+            print('recorded ' + str(input.tick_hook.tick_count) + ' ticks to ' + self.record_path + ', state hash ' + state_hash.hex(), file=sys.stderr)
+        input.tick_hook = None
+
+    # Blocks until loading is done and the starting state is created, for when there's no loading screen to show, e.g. in benchmarks
+    def wait_for_loading(self):
+        self.asset_loader.wait()
+        self.loading_state.update(0)
+
+    # Reports how long after startup something happened, both to stderr and as an overlay counter
+    def record_startup_time(self, name):
+        elapsed_ms = (time.perf_counter() - self.start_time) * 1000
+        print(name + ' ' + '{:.1f}'.format(elapsed_ms) + 'ms', file=sys.stderr)
+        timing.frame_timer.set_counter(name + '_ms', '{:.1f}'.format(elapsed_ms))
+        return elapsed_ms
 
+    # Runs main game loop
+    def loop(self):
         self.running = True
         self.before_time = pygame.time.get_ticks()
         self.before_sec = pygame.time.get_ticks()
 
         while self.running:
+            timing.frame_timer.begin('frame')
+
             # Handle input
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
-                    self.running = False
-                elif not self.pause_state.is_active and event.type == pygame.KEYDOWN and event.key == pygame.K_q:
-                    if not self.pause_state.is_active:
-                        self.pause_state.set_active(self.current_state)
-                else:
-                    if self.pause_state.is_active:
-                        self.pause_state.handle_input(event)
-                        if not self.pause_state.is_active:
-                            self.current_state.on_resume()
-                        if self.pause_state.request_quit:
-                            self.running = False
-                    else:
-                        self.current_state.handle_input(event)
+            timing.frame_timer.begin('input')
+            self.handle_events()
+            timing.frame_timer.end('input')
 
             # Update
-            if self.pause_state.is_active:
-                self.pause_state.update(self.delta)
-            else:
-                self.current_state.update(self.delta)
+            timing.frame_timer.begin('update')
+            if self.step_simulation() > 0:
+                timing.input_latency.on_step()
+            timing.frame_timer.end('update')
+            if self.replay is not None and self.replay.is_finished():
+                self.running = False
 
-            # Render
-            self.render_clear()
-            if self.pause_state.is_active:
-                self.pause_state.render(self.display)
+            # Render, skipping frames where nothing changed and only presenting the parts that did
+            dirty_rects = self.get_dirty_rects()
+            if dirty_rects is None:
+                timing.frame_timer.begin('render')
+                self.render_clear()
+                self.render_state()
+                self.render_fps()
+                if self.show_timing:
+                    self.render_timing()
+                timing.frame_timer.end('render')
+                self.render_flip()
+            elif len(dirty_rects) > 0:
+                self.render_partial(dirty_rects)
             else:
-                self.current_state.render(self.display)
-            self.render_fps()
-            self.render_flip()
+                timing.input_latency.discard()
+            timing.frame_timer.end('frame')
+            timing.frame_timer.end_frame()
 
             # Timekeep
             self.clock_tick()
 
+        self.stop_input_hook()
+        print('input latency ' + timing.input_latency.get_report(), file=sys.stderr)
+        timing.frame_timer.close_csv()
+
+    # Drains the event queue, handing each event to the pause menu or the current state
+    # Events that can change what the state does are stamped, so that the time until their effect is on screen can be measured
+    def handle_events(self):
+        for event in pygame.event.get():
+            event = self.to_display_event(event)
+            if event.type == pygame.QUIT or (event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE):
+                self.running = False
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_F3:
+                self.show_timing = not self.show_timing
+                self.full_redraw = True
+            elif event.type in Game.EXPOSE_EVENT_TYPES:
+                self.full_redraw = True
+            elif not self.pause_state.is_active and event.type == pygame.KEYDOWN and event.key == pygame.K_q:
+                if not self.pause_state.is_active:
+                    self.pause_state.set_active(self.current_state)
+            else:
+                if event.type in Game.LATENCY_EVENT_TYPES:
+                    timing.input_latency.stamp()
+                if self.pause_state.is_active:
+                    self.pause_state.handle_input(event)
+                    if not self.pause_state.is_active:
+                        self.current_state.on_resume()
+                    if self.pause_state.request_quit:
+                        self.running = False
+                else:
+                    self.current_state.handle_input(event)
+
+    # Returns mouse events with their positions converted from window pixels to display buffer pixels
+    def to_display_event(self, event):
+        if event.type == pygame.MOUSEMOTION:
+            rel_start = self.presenter.window_to_display((0, 0))
+            rel_end = self.presenter.window_to_display(event.rel)
+            return pygame.event.Event(event.type, dict(event.dict, pos=self.presenter.window_to_display(event.pos), rel=(rel_end[0] - rel_start[0], rel_end[1] - rel_start[1])))
+        elif event.type == pygame.MOUSEBUTTONDOWN or event.type == pygame.MOUSEBUTTONUP:
+            return pygame.event.Event(event.type, dict(event.dict, pos=self.presenter.window_to_display(event.pos)))
+        return event
+
+    # Runs as many fixed steps as the time accumulated since the last frame allows, then tells the state how far it is between steps
+    # If the game falls too far behind, the remaining backlog is dropped instead of trying to catch up, to avoid a spiral of ever longer frames
+    # Returns how many steps were run
+    def step_simulation(self):
+        if self.late_input:
+            self.poll_late_input()
+
+        active_state = self.current_state
+        if self.pause_state.is_active:
+            active_state = self.pause_state
+
+        step_time = Game.SECOND / self.tick_rate
+        step_delta = step_time / Game.UPDATE_TIME
+        # Idle states don't change when they step, so they only step once per frame, and time they spent idle isn't caught up on
+        max_steps = Game.MAX_CATCH_UP_STEPS
+        if self.is_idle():
+            max_steps = 1
+        steps = 0
+        while self.accumulator >= step_time:
+            # A finished replay must not step any further than the recording did, or the states can't be compared
+            if self.replay is not None and self.replay.is_finished():
+                break
+            if steps == max_steps:
+                self.accumulator %= step_time
+                break
+            active_state.update(step_delta)
+            self.accumulator -= step_time
+            steps += 1
+
+        active_state.set_interpolation(self.accumulator / step_time)
+        return steps
+
+    # Polls input again right before the simulation steps, so that events arriving while the frame started up still make it into this frame's steps
+    # The time spent so far this frame is added to the accumulator first. If that leaves the next step due within LATE_INPUT_WINDOW ms,
+    # the game waits for it instead of skipping stepping this frame, which would leave the events polled now waiting for the next frame
+    def poll_late_input(self):
+        self.add_elapsed_time()
+        wait_time = (Game.SECOND / self.tick_rate) - self.accumulator
+        if 0 < wait_time <= Game.LATE_INPUT_WINDOW:
+            pygame.time.wait(math.ceil(wait_time))
+            self.add_elapsed_time()
+        self.handle_events()
+
+    def is_idle(self):
+        return self.idle_frames >= Game.IDLE_FRAMES
+
+    # Asks the active state what changed since the last frame. Returns None if the whole frame has to be drawn, or the rects that have to be redrawn,
+    # which is empty if nothing changed at all. The FPS counter adds its own rect whenever its number changes
+    def get_dirty_rects(self):
+        if self.pause_state.is_active:
+            dirty_rects = self.pause_state.get_dirty_rects()
+        else:
+            dirty_rects = self.current_state.get_dirty_rects()
+        if dirty_rects is not None and len(dirty_rects) == 0:
+            self.idle_frames += 1
+        else:
+            self.idle_frames = 0
+
+        # The timing overlay changes every frame
+        if dirty_rects is None or self.full_redraw or self.show_timing:
+            self.full_redraw = False
+            return None
+        if self.fps != self.drawn_fps:
+            dirty_rects = dirty_rects + [self.fps_rect.union((0, 0) + self.debug_font.size('FPS: ' + str(self.fps)))]
+        return dirty_rects
+
+    def render_state(self):
+        if self.pause_state.is_active:
+            self.pause_state.render(self.display)
+        else:
+            self.current_state.render(self.display)
+
+    # Redraws and presents only the part of the frame covering the given rects
+    # The state renders as usual, but everything it draws outside of that part is clipped away
+    def render_partial(self, dirty_rects):
+        timing.frame_timer.begin('render')
+        dirty_rect = pygame.Rect(dirty_rects[0]).unionall(dirty_rects[1:]).clip(self.display.get_rect())
+        self.display.set_clip(dirty_rect)
+        self.render_clear()
+        self.render_state()
+        self.render_fps()
+        self.display.set_clip(None)
+        timing.frame_timer.end('render')
+        self.render_flip(dirty_rect)
+
     # Renders text onto the display buffer
     # Will center text if the x or y coordinate on that axis is -1
     # A new font will be loaded if a font of the given size doesn't exist
     def render_fps(self):
         to_render = self.debug_font.render("FPS: " + str(self.fps), False, shared.Color.YELLOW)
-        self.display.blit(to_render, (0, 0))
+        self.fps_rect = self.display.blit(to_render, (0, 0))
+        self.drawn_fps = self.fps
+
+    # Renders the rolling average and 99th percentile time of every phase of the frame
+    def render_timing(self):
+        for i in range(0, len(timing.PHASES)):
+            phase = timing.PHASES[i]
+            line = '{:<12}avg {:6.2f}ms  p99 {:6.2f}ms'.format(phase, timing.frame_timer.get_average(phase), timing.frame_timer.get_percentile(phase, 99))
+            to_render = self.debug_font.render(line, False, shared.Color.YELLOW)
+            self.display.blit(to_render, (0, 12 + (i * 11)))
+        counter_names = sorted(timing.frame_timer.counters.keys())
+        for i in range(0, len(counter_names)):
+            line = '{:<26}{}'.format(counter_names[i], timing.frame_timer.counters[counter_names[i]])
+            to_render = self.debug_font.render(line, False, shared.Color.YELLOW)
+            self.display.blit(to_render, (0, 12 + ((len(timing.PHASES) + i) * 11)))
 
     # Clears the display buffer
     def render_clear(self):
         pygame.draw.rect(self.display, shared.Color.BLACK, (0, 0, shared.DISPLAY_WIDTH, shared.DISPLAY_HEIGHT), False)
 
-    # Renders the display buffer onto the screen
-    def render_flip(self):
-        pygame.transform.scale(self.display, (Game.SCREEN_WIDTH, Game.SCREEN_HEIGHT), self.screen)
-        pygame.display.flip()
+    # Renders the display buffer onto the screen, or only the given rect of it
+    def render_flip(self, rect=None):
+        timing.frame_timer.begin('scale')
+        self.presenter.scale(rect)
+        timing.frame_timer.end('scale')
+        timing.frame_timer.begin('flip')
+        self.presenter.flip(rect)
+        timing.frame_timer.end('flip')
+        timing.input_latency.on_flip()
         self.frames += 1
 
+        # Time to first frame is until anything at all is on screen, time to interactive is until the first frame of the starting state
+        if self.first_frame_time is None:
+            self.first_frame_time = self.record_startup_time('time_to_first_frame')
+        if self.interactive_time is None and self.current_state is not self.loading_state:
+            self.interactive_time = self.record_startup_time('time_to_interactive')
+
+    # Adds the time elapsed since it was last measured to the time waiting to be simulated
+    def add_elapsed_time(self):
+        self.after_time = pygame.time.get_ticks()
+        self.accumulator += self.after_time - self.before_time
+        self.before_time = self.after_time
+
     # Updates timekeep variables and calls pygame to sleep as needed to maintain target FPS
     def clock_tick(self):
-        # Update delta based on the time elapsed
+        # Add the time elapsed to the time waiting to be simulated
         self.after_time = pygame.time.get_ticks()
-        self.delta = (self.after_time - self.before_time) / Game.UPDATE_TIME
+        self.accumulator += self.after_time - self.before_time
 
         # Update the FPS if a second has passed
         if self.after_time - self.before_sec >= Game.SECOND:
@@ -141,13 +456,37 @@ class Game:
             self.before_sec += Game.SECOND
 
         # Reset timer for next frame
-        self.before_time = pygame.time.get_ticks()
+        # Measuring from exactly where this frame's measurement ended means no time is lost from the accumulator between frames
+        self.before_time = self.after_time
 
         # Update pygame clock (will sleep as needed to maintain FPS)
-        self.clock.tick(Game.TARGET_FPS)
+        if self.is_idle():
+            self.wait_idle()
+        else:
+            self.clock.tick(self.target_fps)
+
+    # Sleeps until the next idle frame is due, or until an event arrives
+    def wait_idle(self):
+        wake_time = pygame.time.get_ticks() + (Game.SECOND / Game.IDLE_FPS)
+        while pygame.time.get_ticks() < wake_time and not pygame.event.peek():
+            pygame.time.wait(Game.IDLE_POLL_TIME)
+        self.clock.tick()
+
+
+# Opens the map the game starts on for streaming, compiling it first if a mode was given with --genmap. Runs on a loader thread
+def read_start_map(path, mode):
+    if mode is not None:
+        level.gen_mapfile(path, mode)
+    return level.open_level(path)
 
 
 if __name__ == "__main__":
+    if '--bench' in sys.argv:
+        bench.use_headless_drivers()
     game = Game()
     input.reset_to_defaults()
-    game.loop()
+    if '--bench' in sys.argv:
+        game.wait_for_loading()
+        bench.run(game, sys.argv)
+    else:
+        game.loop()
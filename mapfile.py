@@ -0,0 +1,217 @@
+import pygame
+import numpy
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import shared
+
+
+# Compiled binary mapfile layout:
+# header: magic, format version, compile mode, sha1 of the sources, map width, map height, platform count, spawn count
+# body: one (x, y, width, height) group of little-endian int32s per platform, followed by one (kind, x, y) group per spawn
+BINARY_MAGIC = b'VMAP'
+BINARY_VERSION = 2
+BINARY_HEADER = struct.Struct('<4sI8s20siiII')
+
+# Kinds of things that can be placed in a map: the enemy kinds, and the player, which marks where the player starts
+# Binary mapfiles store a kind as its index in this list, so new kinds must be added at the end
+SPAWN_KINDS = ['onion', 'tomato', 'player']
+
+
+# Returns the image a mapfile is compiled from, e.g. map/map.bin -> res/gfx/map.png
+def get_image_path(path):
+    return 'res/gfx/' + os.path.splitext(os.path.basename(path))[0] + '.png'
+
+
+# Compiles the collision geometry of a map image
+# Black pixels of the image are solid. The mode decides how solid pixels are turned into platform rects:
+# 'strips' reproduces the original output, one 1-pixel-tall strip per horizontal run of edge pixels
+# 'hull' greedily merges the edge pixels of solid regions into as few rects as possible
+# 'fill' greedily merges whole solid regions, which gives the fewest rects but also collides with the inside of the terrain
+# Returns the map size and the list of platform rects
+def compile_image(image_path, mode='hull'):
+    map_frame = pygame.image.load(image_path)
+
+    # surfarray indexes pixels as [x][y], so transpose the mask to get one row per y value
+    pixels = pygame.surfarray.array3d(map_frame)
+    tiles = numpy.ascontiguousarray((pixels == 0).all(axis=2).T)
+
+    # A "breathing" tile is a solid tile that is next to a non-solid tile inside of the image bounds
+    open_neighbor = numpy.zeros(tiles.shape, dtype=bool)
+    open_neighbor[:, 1:] |= ~tiles[:, :-1]
+    open_neighbor[:, :-1] |= ~tiles[:, 1:]
+    open_neighbor[1:, :] |= ~tiles[:-1, :]
+    open_neighbor[:-1, :] |= ~tiles[1:, :]
+    breathing_tiles = tiles & open_neighbor
+
+    strip_platforms = find_row_runs(breathing_tiles)
+    if mode == 'strips':
+        platforms = strip_platforms
+    elif mode == 'hull':
+        platforms = merge_rects(breathing_tiles)
+    elif mode == 'fill':
+        platforms = merge_rects(tiles)
+    else:
+        raise ValueError('Unknown map compile mode ' + mode)
+    print('compiled ' + image_path + ' into ' + str(len(platforms)) + ' platforms in ' + mode + ' mode (strips mode: ' + str(len(strip_platforms)) + ')', file=sys.stderr)
+
+    return map_frame.get_size(), platforms
+
+
+# Returns a 1-pixel-tall rect for every horizontal run of set values in a 2D bool array indexed by [y][x]
+# Rects are ordered by x and then by y, the same order the original per-pixel compiler produced them in
+def find_row_runs(grid):
+    padded = numpy.zeros((grid.shape[0], grid.shape[1] + 2), dtype=numpy.int8)
+    padded[:, 1:-1] = grid
+    edges = numpy.diff(padded, axis=1)
+    start_y, start_x = numpy.nonzero(edges == 1)
+    end_x = numpy.nonzero(edges == -1)[1]
+
+    order = numpy.lexsort((start_y, start_x))
+    return [(int(start_x[i]), int(start_y[i]), int(end_x[i] - start_x[i]), 1) for i in order]
+
+
+# Greedily merges the set values of a 2D bool array indexed by [y][x] into rects
+# Horizontal runs are found first and runs spanning the same columns on consecutive rows are joined into one rect
+# The same is done with columns and rows swapped, and whichever direction produced fewer rects is returned
+def merge_rects(grid):
+    by_rows = merge_runs(grid)
+    by_columns = [(rect[1], rect[0], rect[3], rect[2]) for rect in merge_runs(grid.T)]
+    if len(by_columns) < len(by_rows):
+        return by_columns
+    return by_rows
+
+
+def merge_runs(grid):
+    padded = numpy.zeros((grid.shape[0], grid.shape[1] + 2), dtype=numpy.int8)
+    padded[:, 1:-1] = grid
+    edges = numpy.diff(padded, axis=1)
+    run_y, run_start = numpy.nonzero(edges == 1)
+    run_end = numpy.nonzero(edges == -1)[1]
+
+    # Maps the (start, end) span of each rect that can still grow downwards to its index in rects
+    rects = []
+    open_rects = {}
+    for y, start, end in zip(run_y.tolist(), run_start.tolist(), run_end.tolist()):
+        index = open_rects.get((start, end))
+        if index is not None and rects[index][1] + rects[index][3] == y:
+            rect = rects[index]
+            rects[index] = (rect[0], rect[1], rect[2], rect[3] + 1)
+        else:
+            open_rects[(start, end)] = len(rects)
+            rects.append((start, y, end - start, 1))
+
+    return rects
+
+
+# Returns the spawns file that belongs to a compiled map, e.g. map/map.bin -> map/map.spawns
+def get_spawns_path(path):
+    return os.path.splitext(path)[0] + '.spawns'
+
+
+# Reads the spawn table that belongs to a compiled map
+# The spawns file uses the same spawn=kind,x,y lines as the text format. A map without one has no spawns
+def read_spawns(path):
+    spawns_path = get_spawns_path(path)
+    if not os.path.exists(spawns_path):
+        return []
+    return read_text(spawns_path)[2]
+
+
+# Hashes everything a compiled map is built from, so that editing either the map image or the spawns file triggers a rebuild
+def hash_sources(path):
+    source_hash = hashlib.sha1(shared.hash_file(get_image_path(path)))
+    spawns_path = get_spawns_path(path)
+    if os.path.exists(spawns_path):
+        source_hash.update(shared.hash_file(spawns_path))
+    return source_hash.digest()
+
+
+# The text format is kept as a human-readable import path
+# Returns the map size, the list of platform rects and the list of (kind, x, y) enemy spawns
+def read_text(path):
+    size = (0, 0)
+    platforms = []
+    spawns = []
+
+    mapfile = open(path, 'r')
+    for line in mapfile.readlines():
+        command, value = line.split('=')
+        if command == 'size':
+            size = tuple([int(num) for num in value.split(',')])
+        elif command == 'platform':
+            platforms.append(tuple([int(num) for num in value.split(',')]))
+        elif command == 'spawn':
+            kind, x, y = value.strip().split(',')
+            spawns.append((kind, int(x), int(y)))
+    mapfile.close()
+
+    return size, platforms, spawns
+
+
+def write_text(path, size, platforms, spawns):
+    outfile = open(path, 'w')
+    outfile.write('size=' + str(size[0]) + ',' + str(size[1]) + '\n')
+    for platform in platforms:
+        outfile.write('platform=' + ','.join([str(value) for value in platform]) + '\n')
+    for spawn in spawns:
+        outfile.write('spawn=' + ','.join([str(value) for value in spawn]) + '\n')
+    outfile.close()
+
+
+def write_binary(path, source_hash, mode, size, platforms, spawns):
+    platform_body = numpy.array(platforms, dtype='<i4').reshape(-1)
+    spawn_body = numpy.array([(SPAWN_KINDS.index(spawn[0]), spawn[1], spawn[2]) for spawn in spawns], dtype='<i4').reshape(-1)
+    outfile = open(path, 'wb')
+    outfile.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, mode.encode(), source_hash, size[0], size[1], len(platforms), len(spawns)))
+    outfile.write(platform_body.tobytes())
+    outfile.write(spawn_body.tobytes())
+    outfile.close()
+
+
+# Returns the header fields of a binary mapfile, or None if the file is missing or isn't a mapfile this version can read
+def read_binary_header(path):
+    if not os.path.exists(path) or os.path.getsize(path) < BINARY_HEADER.size:
+        return None
+    infile = open(path, 'rb')
+    magic, version, mode, source_hash, width, height, platform_count, spawn_count = BINARY_HEADER.unpack(infile.read(BINARY_HEADER.size))
+    infile.close()
+    if magic != BINARY_MAGIC or version != BINARY_VERSION:
+        return None
+    return mode.rstrip(b'\0').decode(), source_hash, (width, height), platform_count, spawn_count
+
+
+# Maps the file and reads the platform rects and spawns straight out of the int32 body without any per-line parsing
+def read_binary(path):
+    infile = open(path, 'rb')
+    mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    header = BINARY_HEADER.unpack(view[:BINARY_HEADER.size])
+    size = (header[4], header[5])
+    platforms_end = BINARY_HEADER.size + (header[6] * 16)
+    body = numpy.frombuffer(view[BINARY_HEADER.size:platforms_end], dtype='<i4').tolist()
+    platforms = list(zip(body[0::4], body[1::4], body[2::4], body[3::4]))
+    body = numpy.frombuffer(view[platforms_end:platforms_end + (header[7] * 12)], dtype='<i4').tolist()
+    spawns = [(SPAWN_KINDS[kind], x, y) for kind, x, y in zip(body[0::3], body[1::3], body[2::3])]
+
+    view.release()
+    mapped.close()
+    infile.close()
+    return size, platforms, spawns
+
+
+# Returns the contents of a binary mapfile, recompiling it first if it is missing or was compiled from different versions of its sources
+# If no mode is given the mode the file was last compiled in is kept, otherwise the file is also recompiled when the mode differs
+def load_binary(path, mode=None):
+    source_hash = hash_sources(path)
+    header = read_binary_header(path)
+    if mode is None:
+        mode = 'hull' if header is None else header[0]
+    if header is None or header[0] != mode or header[1] != source_hash:
+        size, platforms = compile_image(get_image_path(path), mode)
+        spawns = read_spawns(path)
+        write_binary(path, source_hash, mode, size, platforms, spawns)
+        return size, platforms, spawns
+    return read_binary(path)
@@ -0,0 +1,44 @@
+import animation
+import pool
+
+
+# A one-shot animation played at a fixed position, like the dust of a jump or an enemy's death
+class Particle:
+    def __init__(self):
+        self.animation = animation.Animation(None, 60)
+        self.position = (0, 0)
+
+    def get_frame(self):
+        return self.animation.get_frame()
+
+    def is_finished(self):
+        return self.animation.finished
+
+
+# Every live particle in the level, recycled from a fixed-size pool so that spawning one doesn't allocate
+class ParticleSystem:
+    LIMIT = 64
+
+    def __init__(self, limit=LIMIT, overflow=pool.DROP_OLDEST):
+        self.pool = pool.Pool(Particle, limit, overflow)
+
+    # Starts playing an animation at a position. Returns the particle, or None if the pool refused it
+    def spawn(self, name, fps, position, flip_h=False):
+        new_particle = self.pool.acquire()
+        if new_particle is not None:
+            new_particle.animation.restart(name, fps)
+            new_particle.animation.flip_h = flip_h
+            new_particle.position = position
+        return new_particle
+
+    # Advances every particle and recycles the ones whose animation finished
+    def update(self, delta):
+        for live_particle in self.pool:
+            live_particle.animation.update(delta)
+        self.pool.collect(Particle.is_finished)
+
+    def clear(self):
+        self.pool.clear()
+
+    def __iter__(self):
+        return iter(self.pool)
@@ -3,12 +3,11 @@ import shared
 
 
 # The pause menu state class
+# The menu is static apart from the highlighted button, so after the first frame only the boxes of buttons that were highlighted or unhighlighted are redrawn
 class Pause:
     SCREEN_CENTER = (shared.DISPLAY_WIDTH / 2, shared.DISPLAY_HEIGHT / 2)
 
-    def __init__(self, screen_size):
-        self.screen_scale = (screen_size[0] / shared.DISPLAY_WIDTH, screen_size[1] / shared.DISPLAY_HEIGHT)
-
+    def __init__(self):
         self.background = pygame.Surface((shared.DISPLAY_WIDTH, shared.DISPLAY_HEIGHT))
 
         self.fade = pygame.Surface((shared.DISPLAY_WIDTH, shared.DISPLAY_HEIGHT))
@@ -32,22 +31,30 @@ class Pause:
 
         self.is_active = False
         self.request_quit = False
+        self.dirty_rects = None
 
+    # The paused state is captured with the fade already applied, so each frame only needs one blit for both
     def set_active(self, current_state):
         pygame.draw.rect(self.background, shared.Color.BLACK, (0, 0, shared.DISPLAY_WIDTH, shared.DISPLAY_HEIGHT), False)
         current_state.render(self.background)
+        self.background.blit(self.fade, (0, 0))
         self.is_active = True
+        self.dirty_rects = None
 
     def handle_input(self, event):
         if event.type == pygame.KEYDOWN and event.key == pygame.K_q:
             self.is_active = False
         elif event.type == pygame.MOUSEMOTION:
-            self.mouse_pos = (event.pos[0] / self.screen_scale[0], event.pos[1] / self.screen_scale[1])
+            self.mouse_pos = event.pos
+            last_state = self.state
             self.state = -1
             for i in range(0, len(self.buttons)):
                 if shared.point_in_rect(self.mouse_pos, self.buttons[i].box):
                     self.state = i
-                    return
+                    break
+            if self.state != last_state:
+                self.add_dirty_button(last_state)
+                self.add_dirty_button(self.state)
         elif event.type == pygame.MOUSEBUTTONDOWN:
             if event.button != pygame.BUTTON_LEFT:
                 return
@@ -59,12 +66,24 @@ class Pause:
             elif menu_value == 'Exit':
                 self.request_quit = True
 
+    def add_dirty_button(self, index):
+        if index != -1 and self.dirty_rects is not None:
+            self.dirty_rects.append(self.buttons[index].box)
+
+    # Returns the rects that changed since the last call, or None if everything has to be redrawn
+    def get_dirty_rects(self):
+        dirty_rects = self.dirty_rects
+        self.dirty_rects = []
+        return dirty_rects
+
+    def set_interpolation(self, alpha):
+        pass
+
     def update(self, delta):
         pass
 
     def render(self, display):
         display.blit(self.background, (0, 0))
-        display.blit(self.fade, (0, 0))
 
         pygame.draw.rect(display, shared.Color.WHITE, self.pos + self.size)
         display.blit(self.title_text, self.title_pos)
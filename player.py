@@ -1,10 +1,14 @@
 import shared
 import animation
+import collision
+import projectile
 import sound
 
 
 # Class for the player character
 class Player:
+    # Every animation the player draws, so that levels can prefetch them
+    ANIMATIONS = ['player_run', 'player_jump', 'player_hurt', 'player_liftoff']
     SPEED = 2
     GRAVITY = 0.1
     MAX_FALL_SPEED = 3
@@ -13,11 +17,14 @@ class Player:
     COYOTE_TIME_DURATION = 4
     SHOT_DELAY = 7
     INVULN_DURATION = 10
+    # The furthest the player can move along either axis in one step of delta 1, whether running, knocked back, jumping or falling
+    MAX_STEP_SPEED = 3
 
     def __init__(self):
         self.position = shared.Vector.ZERO()
         self.velocity = shared.Vector.ZERO()
         self.movement = shared.Vector.ZERO()
+        self.previous_position = None
 
         self.invuln_timer = 0
         self.knockback_on = False
@@ -37,15 +44,24 @@ class Player:
 
         self.shoot_timer = 0
 
-        self.particles = []
+    # Called by the level before each step so that rendering can interpolate between steps
+    def store_previous_position(self):
+        if self.previous_position is None:
+            self.previous_position = shared.Vector(self.position.x, self.position.y)
+        else:
+            self.previous_position.set_to(self.position)
+
+    # Returns everything about the player that carries over from one step to the next, for comparing runs
+    def get_state(self):
+        return self.position.as_tuple() + self.velocity.as_tuple() + (self.direction, self.grounded, self.jump_input_timer, self.coyote_timer, self.shoot_timer, self.invuln_timer, self.knockback_on)
 
     def get_hitbox(self):
-        return self.position.sum_with(self.hitbox_offset).as_tuple() + self.hitbox_size
+        return self.position.sum_tuple(self.hitbox_offset) + self.hitbox_size
 
     def take_damage(self, hurtbox, damage):
         hurtbox_center_x = hurtbox[0] + (hurtbox[2] / 2)
         hitbox_center_x = self.get_hitbox()[0] + (self.get_hitbox()[2] / 2)
-        self.velocity = shared.Vector(3, -2)
+        self.velocity.set(3, -2)
         if hurtbox_center_x >= hitbox_center_x:
             self.velocity.x = -3
         self.knockback_on = True
@@ -62,15 +78,16 @@ class Player:
             self.hurt_animation.flip_h = True
         self.direction = direction
 
-    def jump(self):
+    # Jumps if the player is on the ground, or only just left it, and kicks up a liftoff particle into the given particle system
+    def jump(self, particles):
         if self.grounded or self.coyote_timer > 0:
             self.velocity.y = -Player.JUMP_IMPULSE
             self.grounded = False
             self.coyote_timer = 0
-            self.particles.append((animation.Animation('player_liftoff', 11), self.position.as_tuple()))
+            particles.spawn('player_liftoff', 11, self.position.as_tuple())
             sound.play('player_jump')
 
-    def update(self, delta, platforms, hurtboxes):
+    def update(self, delta, collision_world, colliders, particles):
         if self.invuln_timer == 0 and self.direction != 0:
             self.knockback_on = False
 
@@ -80,15 +97,15 @@ class Player:
         if self.velocity.y > Player.MAX_FALL_SPEED:
             self.velocity.y = Player.MAX_FALL_SPEED
 
-        self.movement = self.velocity.multiply_by(delta)
-        self.position = self.position.sum_with(self.movement)
+        self.movement.set_to(self.velocity).iscale(delta)
+        self.position.iadd(self.movement)
 
-        self.check_collisions(platforms)
+        self.check_collisions(collision_world, colliders)
         if self.grounded:
             self.coyote_timer = Player.COYOTE_TIME_DURATION
         if self.jump_input_timer > 0 and self.grounded:
             self.jump_input_timer = 0
-            self.jump()
+            self.jump(particles)
         self.jump_input_timer -= delta
         if self.jump_input_timer < 0:
             self.jump_input_timer = 0
@@ -111,12 +128,14 @@ class Player:
         else:
             self.run_animation.update(delta)
 
-    def check_collisions(self, colliders):
+    # Collides against the static rects of the collision world near the player's movement, followed by any dynamic colliders
+    def check_collisions(self, collision_world, colliders):
         self.grounded = False
+        colliders = collision_world.query(collision.swept_rect(self.get_hitbox(), self.movement)) + colliders
         for collider in colliders:
             if shared.is_rect_collision(self.get_hitbox(), collider):
                 self.knockback_on = False
-                self.position = self.position.minus(self.movement)
+                self.position.isub(self.movement)
                 x_caused = False
                 y_caused = False
 
@@ -149,73 +168,21 @@ class Player:
     def get_frame_rect(self):
         return self.position.as_tuple() + self.get_frame().get_size()
 
-    # get_particles() and get_bullets() hand-off generated child objects to the Level class so that the generated objects will be updated in the scope of Level.update()
-    def get_particles(self):
-        return_list = []
-        while len(self.particles) != 0:
-            return_list.append(self.particles.pop(0))
-        return return_list
-
-    def shoot(self):
+    # Fires a bullet into the given projectile system if the shot delay has passed
+    def shoot(self, projectiles):
         if self.shoot_timer > 0:
-            return None
+            return
 
-        new_bullet = Bullet()
+        bullet_size = projectile.Bullet.HITBOX_SIZE
         hitbox = self.get_hitbox()
-        new_bullet.position = shared.Vector(hitbox[0] + (hitbox[2] / 2) - (new_bullet.hitbox_size[0] / 2), hitbox[1] + (hitbox[3] / 2) - (new_bullet.hitbox_size[1] / 2))
+        position = [hitbox[0] + (hitbox[2] / 2) - (bullet_size[0] / 2), hitbox[1] + (hitbox[3] / 2) - (bullet_size[1] / 2)]
         if self.run_animation.flip_h:
-            new_bullet.position.x -= 15
-            new_bullet.velocity = shared.Vector(-Bullet.SPEED, 0)
+            position[0] -= 15
+            velocity = (-projectile.Bullet.SPEED, 0)
         else:
-            new_bullet.position.x += 15
-            new_bullet.velocity = shared.Vector(Bullet.SPEED, 0)
+            position[0] += 15
+            velocity = (projectile.Bullet.SPEED, 0)
+        projectiles.spawn(projectile.BULLET, position, velocity)
         self.shoot_timer = Player.SHOT_DELAY
 
         sound.play('player_shoot')
-
-        return new_bullet
-
-
-class Bullet:
-    DAMAGE = 1
-    SPEED = 7
-    TIME_TO_LIVE = 180
-
-    def __init__(self):
-        self.position = shared.Vector.ZERO()
-        self.velocity = shared.Vector.ZERO()
-        self.hitbox_size = (10, 6)
-        self.ttl = Bullet.TIME_TO_LIVE
-        self.delete_me = False
-
-    def get_hitbox(self):
-        return self.position.as_tuple() + self.hitbox_size
-
-    def update(self, delta):
-        self.ttl -= delta
-        if self.ttl <= 0:
-            self.delete_me = True
-
-        movement = self.velocity.multiply_by(delta)
-        self.position = self.position.sum_with(movement)
-
-    # Checks for collisions and requests to delete itself if a collision occurred
-    # If the collision is with an enemy, the enemy is returned so that damage can be applied
-    # Assumes each enemy has a get_hitbox() function
-    def check_collisions(self, static_colliders, enemy_colliders):
-        hitbox = self.get_hitbox()
-        for enemy in enemy_colliders:
-            if shared.is_rect_collision(hitbox, enemy.get_hitbox()):
-                self.delete_me = True
-                return enemy
-        for collider in static_colliders:
-            if shared.is_rect_collision(hitbox, collider):
-                self.delete_me = True
-                return None
-        return None
-
-    def get_frame(self):
-        return animation.frame_data['bullet'][0]
-
-    def get_frame_rect(self):
-        return self.position.as_tuple() + self.get_frame().get_size()
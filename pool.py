@@ -0,0 +1,69 @@
+import collections
+
+
+# What a pool does when something is spawned while it's already at its limit
+# DROP_OLDEST recycles the longest-lived object for the new one, REFUSE doesn't spawn the new one at all
+DROP_OLDEST = 'drop_oldest'
+REFUSE = 'refuse'
+OVERFLOW_POLICIES = [DROP_OLDEST, REFUSE]
+
+
+# Usage numbers of a pool, shown in the debug overlay
+class PoolStats:
+    def __init__(self, limit):
+        self.limit = limit
+        self.live = 0
+        self.peak = 0
+        self.dropped = 0
+        self.refused = 0
+
+    def set_live(self, live):
+        self.live = live
+        self.peak = max(self.peak, live)
+
+    def __str__(self):
+        return '{}/{} peak {} dropped {} refused {}'.format(self.live, self.limit, self.peak, self.dropped, self.refused)
+
+
+# A fixed number of objects created up front and handed out again and again, so that spawning never allocates
+# Objects are handed out by acquire(), which the caller then re-initializes, and are taken back by collect()
+class Pool:
+    def __init__(self, factory, limit, overflow=DROP_OLDEST):
+        assert overflow in OVERFLOW_POLICIES, 'Unknown pool overflow policy ' + str(overflow)
+        self.overflow = overflow
+        self.free = [factory() for i in range(0, limit)]
+        self.live = collections.deque()
+        self.stats = PoolStats(limit)
+
+    # Returns an object to re-initialize, or None if the pool is full and refuses to spawn more
+    def acquire(self):
+        if len(self.free) != 0:
+            pooled_object = self.free.pop()
+        elif self.overflow == DROP_OLDEST and len(self.live) != 0:
+            pooled_object = self.live.popleft()
+            self.stats.dropped += 1
+        else:
+            self.stats.refused += 1
+            return None
+        self.live.append(pooled_object)
+        self.stats.set_live(len(self.live))
+        return pooled_object
+
+    # Returns every live object the given function says is dead to the pool, keeping the rest in the order they were acquired
+    # The live deque is compacted in place by rotating through it once, so collecting doesn't create a new container every tick
+    def collect(self, is_dead):
+        for i in range(0, len(self.live)):
+            pooled_object = self.live.popleft()
+            if is_dead(pooled_object):
+                self.free.append(pooled_object)
+            else:
+                self.live.append(pooled_object)
+        self.stats.set_live(len(self.live))
+
+    def clear(self):
+        self.free.extend(self.live)
+        self.live.clear()
+        self.stats.set_live(0)
+
+    def __iter__(self):
+        return iter(self.live)
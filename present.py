@@ -0,0 +1,126 @@
+import pygame
+import math
+import sys
+import shared
+
+
+# Presentation backends decide how the 640x360 display buffer the game renders into ends up in the window
+# Each backend owns the display buffer and window surface, and splits presenting into a scale and a flip step so that they can be timed separately
+# Both steps can be given a rect of the display buffer, in which case only that part of it is scaled and updated in the window
+BACKENDS = ['software', 'integer', 'scaled']
+
+
+# The original path: a software nearest-neighbour stretch of the whole display buffer to the window size
+class SoftwarePresenter:
+    def __init__(self, window_size, vsync=False):
+        self.name = 'software'
+        self.window_size = window_size
+        self.screen = pygame.display.set_mode(window_size, 0, 32)
+        self.display = pygame.Surface((shared.DISPLAY_WIDTH, shared.DISPLAY_HEIGHT)).convert()
+        self.scale_factor = (window_size[0] / shared.DISPLAY_WIDTH, window_size[1] / shared.DISPLAY_HEIGHT)
+        self.offset = (0, 0)
+
+    # At fractional scale factors the edges of a partially scaled rect can come out a pixel off from a full scale, until the next full frame
+    def scale(self, rect=None):
+        if rect is None:
+            pygame.transform.scale(self.display, self.window_size, self.screen)
+        else:
+            window_rect = self.display_to_window_rect(rect)
+            pygame.transform.scale(self.display.subsurface(rect), window_rect.size, self.screen.subsurface(window_rect))
+
+    def flip(self, rect=None):
+        if rect is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self.display_to_window_rect(rect))
+
+    # Converts a position in window pixels to display buffer pixels
+    def window_to_display(self, pos):
+        return ((pos[0] - self.offset[0]) / self.scale_factor[0], (pos[1] - self.offset[1]) / self.scale_factor[1])
+
+    # Returns the window pixels covered by a rect of display buffer pixels, clipped to the window
+    def display_to_window_rect(self, rect):
+        left = math.floor(rect[0] * self.scale_factor[0]) + self.offset[0]
+        top = math.floor(rect[1] * self.scale_factor[1]) + self.offset[1]
+        right = math.ceil((rect[0] + rect[2]) * self.scale_factor[0]) + self.offset[0]
+        bottom = math.ceil((rect[1] + rect[3]) * self.scale_factor[1]) + self.offset[1]
+        return pygame.Rect(left, top, right - left, bottom - top).clip(self.screen.get_rect())
+
+
+# Scales by the largest whole factor that fits the window and letterboxes the rest, so every display pixel becomes the same size square
+# The scaled image is written straight into a subsurface of the window, and at a factor of 1 the display buffer is that subsurface, so nothing is scaled or copied at all
+class IntegerPresenter(SoftwarePresenter):
+    def __init__(self, window_size, vsync=False):
+        self.name = 'integer'
+        self.window_size = window_size
+        self.screen = pygame.display.set_mode(window_size, 0, 32)
+        self.screen.fill(shared.Color.BLACK)
+
+        factor = max(1, min(window_size[0] // shared.DISPLAY_WIDTH, window_size[1] // shared.DISPLAY_HEIGHT))
+        self.scaled_size = (shared.DISPLAY_WIDTH * factor, shared.DISPLAY_HEIGHT * factor)
+        self.scale_factor = (factor, factor)
+        self.offset = (max(0, (window_size[0] - self.scaled_size[0]) // 2), max(0, (window_size[1] - self.scaled_size[1]) // 2))
+
+        # Windows smaller than the display buffer are cropped
+        target_size = (min(self.scaled_size[0], window_size[0]), min(self.scaled_size[1], window_size[1]))
+        self.target = self.screen.subsurface(self.offset + target_size)
+        if factor == 1:
+            self.display = self.target
+        else:
+            self.display = pygame.Surface((shared.DISPLAY_WIDTH, shared.DISPLAY_HEIGHT)).convert()
+
+    def scale(self, rect=None):
+        if self.display is self.target:
+            return
+        if rect is not None:
+            factor = self.scale_factor[0]
+            target_rect = pygame.Rect(rect[0] * factor, rect[1] * factor, rect[2] * factor, rect[3] * factor)
+            # Rects reaching into the cropped part of a window smaller than the display buffer are scaled whole instead
+            if self.target.get_rect().contains(target_rect):
+                pygame.transform.scale(self.display.subsurface(rect), target_rect.size, self.target.subsurface(target_rect))
+                return
+        pygame.transform.scale(self.display, self.scaled_size, self.target)
+
+
+# Hands scaling to SDL's renderer through pygame.SCALED, which can do it on the GPU and can wait for vsync
+# The window surface is the display buffer itself, so the game renders straight into it
+# SDL also converts mouse positions to display buffer pixels itself, so no conversion is needed here
+class ScaledPresenter:
+    def __init__(self, window_size, vsync=False):
+        self.name = 'scaled'
+        self.window_size = window_size
+        self.screen = pygame.display.set_mode((shared.DISPLAY_WIDTH, shared.DISPLAY_HEIGHT), pygame.SCALED | pygame.RESIZABLE, vsync=int(vsync))
+        self.display = self.screen
+        try:
+            from pygame._sdl2 import video
+            video.Window.from_display_module().size = window_size
+        except (ImportError, AttributeError, pygame.error):
+            pass
+
+    def scale(self, rect=None):
+        pass
+
+    def flip(self, rect=None):
+        if rect is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rect)
+
+    def window_to_display(self, pos):
+        return pos
+
+
+# Creates the presenter for a backend name
+# Falls back to the software backend if the requested one can't be created, e.g. SCALED without a hardware renderer
+def create(name, window_size, vsync=False):
+    if name == 'software':
+        return SoftwarePresenter(window_size, vsync)
+    elif name == 'integer':
+        return IntegerPresenter(window_size, vsync)
+    elif name == 'scaled':
+        try:
+            return ScaledPresenter(window_size, vsync)
+        except pygame.error as error:
+            print('could not create scaled presenter (' + str(error) + '), falling back to software', file=sys.stderr)
+            return SoftwarePresenter(window_size, vsync)
+    raise ValueError('Unknown presentation backend ' + name)
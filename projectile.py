@@ -0,0 +1,260 @@
+import numpy
+import animation
+import pool
+import renderqueue
+import timing
+
+
+# Projectile kinds
+BULLET = 0
+TOMATO_HEAD = 1
+
+
+# Fired by the player. Flies straight and damages enemies and enemy projectiles
+class Bullet:
+    DAMAGE = 1
+    SPEED = 7
+    TIME_TO_LIVE = 180
+    GRAVITY = 0
+    HITBOX_SIZE = (10, 6)
+    ANIMATION = 'bullet'
+    POOL_NAME = 'bullet'
+    POOL_LIMIT = 64
+
+
+# Lobbed by tomatoes. Falls with gravity and damages the player
+class TomatoHead:
+    SPEED = 2
+    TIME_TO_LIVE = numpy.inf
+    GRAVITY = 0.1
+    HITBOX_SIZE = (13, 17)
+    ANIMATION = 'tomato_projectile'
+    POOL_NAME = 'tomato_head'
+    POOL_LIMIT = 32
+
+
+KINDS = [Bullet, TomatoHead]
+
+
+# Returns an (N, M) array telling whether each of the N rects in rects_a overlaps each of the M rects in rects_b
+# Same test as shared.is_rect_collision, but for whole arrays of (x, y, width, height) rows at once
+def rect_overlaps(rects_a, rects_b):
+    a = rects_a[:, numpy.newaxis, :]
+    b = rects_b[numpy.newaxis, :, :]
+    return ~((a[..., 0] + a[..., 2] <= b[..., 0]) | (b[..., 0] + b[..., 2] <= a[..., 0]) | (a[..., 1] + a[..., 3] <= b[..., 1]) | (b[..., 1] + b[..., 3] <= a[..., 1]))
+
+
+# Stores every live projectile in parallel arrays so that they can be moved, collided and expired in batches instead of one object at a time
+# Only the first self.count rows of each array are live. Removing a projectile moves the last live row into its place
+# The arrays are a fixed-size pool: each kind may only have its limit of projectiles alive at once, and spawning one more follows the overflow policy
+class ProjectileSystem:
+    # How wide a horizontal gap between projectiles, in collision cells, splits them into separately queried clusters
+    CLUSTER_GAP_CELLS = 4
+
+    def __init__(self, limits=None, overflow=pool.DROP_OLDEST):
+        assert overflow in pool.OVERFLOW_POLICIES, 'Unknown pool overflow policy ' + str(overflow)
+        if limits is None:
+            limits = [kind_data.POOL_LIMIT for kind_data in KINDS]
+        self.limits = limits
+        self.overflow = overflow
+        self.stats = [pool.PoolStats(limit) for limit in limits]
+        self.kind_counts = numpy.zeros(len(KINDS), dtype=int)
+        self.next_serial = 0
+        self.count = 0
+        self.allocate(sum(limits))
+
+    def allocate(self, capacity):
+        self.capacity = capacity
+        self.positions = numpy.zeros((capacity, 2))
+        self.previous_positions = numpy.zeros((capacity, 2))
+        self.velocities = numpy.zeros((capacity, 2))
+        self.sizes = numpy.zeros((capacity, 2))
+        self.gravities = numpy.zeros(capacity)
+        self.ttls = numpy.zeros(capacity)
+        self.kinds = numpy.zeros(capacity, dtype=numpy.int8)
+        self.flips = numpy.zeros(capacity, dtype=bool)
+        # Spawn order, used to find the oldest projectile of a kind
+        self.serials = numpy.zeros(capacity, dtype=numpy.int64)
+
+    # Returns the live rows of every array as bytes, for comparing runs
+    def get_state(self):
+        return b''.join([array[:self.count].tobytes() for array in self.get_arrays()])
+
+    def get_arrays(self):
+        return [self.positions, self.previous_positions, self.velocities, self.sizes, self.gravities, self.ttls, self.kinds, self.flips, self.serials]
+
+    def clear(self):
+        self.count = 0
+        self.kind_counts[:] = 0
+        for kind_stats in self.stats:
+            kind_stats.set_live(0)
+
+    # Spawns a projectile and returns its index, or -1 if its kind is at its limit and the overflow policy refuses it
+    def spawn(self, kind, position, velocity, flip_h=False):
+        if self.kind_counts[kind] >= self.limits[kind]:
+            if self.overflow == pool.REFUSE or self.limits[kind] == 0:
+                self.stats[kind].refused += 1
+                return -1
+            self.remove_oldest(kind)
+            self.stats[kind].dropped += 1
+
+        index = self.count
+        kind_data = KINDS[kind]
+        self.positions[index] = position
+        self.previous_positions[index] = position
+        self.velocities[index] = velocity
+        self.sizes[index] = kind_data.HITBOX_SIZE
+        self.gravities[index] = kind_data.GRAVITY
+        self.ttls[index] = kind_data.TIME_TO_LIVE
+        self.kinds[index] = kind
+        self.flips[index] = flip_h
+        self.serials[index] = self.next_serial
+        self.next_serial += 1
+        self.count += 1
+        self.kind_counts[kind] += 1
+        self.stats[kind].set_live(int(self.kind_counts[kind]))
+        return index
+
+    def remove_oldest(self, kind):
+        kind_indices = numpy.flatnonzero(self.get_kind_mask(kind))
+        dead = numpy.zeros(self.count, dtype=bool)
+        dead[kind_indices[self.serials[kind_indices].argmin()]] = True
+        self.remove(dead)
+
+    # Removes every projectile flagged in the dead mask
+    # This is a batched swap-remove: the holes left below the new count are filled with the live rows above it, so only as many rows move as were removed
+    def remove(self, dead):
+        dead = dead[:self.count]
+        self.kind_counts -= numpy.bincount(self.kinds[:self.count][dead], minlength=len(KINDS))
+        for kind in range(0, len(KINDS)):
+            self.stats[kind].set_live(int(self.kind_counts[kind]))
+        new_count = self.count - int(numpy.count_nonzero(dead))
+        holes = numpy.flatnonzero(dead[:new_count])
+        movers = new_count + numpy.flatnonzero(~dead[new_count:])
+        for array in self.get_arrays():
+            array[holes] = array[movers]
+        self.count = new_count
+
+    # Returns the live hitboxes as an (N, 4) array of (x, y, width, height) rows
+    def get_hitboxes(self):
+        return numpy.concatenate((self.positions[:self.count], self.sizes[:self.count]), axis=1)
+
+    def get_kind_mask(self, kind):
+        return self.kinds[:self.count] == kind
+
+    # Returns the hitboxes of every live projectile of a kind as a list of tuples
+    def get_kind_hitboxes(self, kind):
+        return [tuple(hitbox) for hitbox in self.get_hitboxes()[self.get_kind_mask(kind)].tolist()]
+
+    # Moves every projectile and counts down its time to live
+    # Returns a mask of the projectiles whose time ran out
+    def integrate(self, delta):
+        count = self.count
+        self.previous_positions[:count] = self.positions[:count]
+        self.velocities[:count, 1] += self.gravities[:count] * delta
+        self.positions[:count] += self.velocities[:count] * delta
+        self.ttls[:count] -= delta
+        return self.ttls[:count] <= 0
+
+    # Returns a mask of the projectiles overlapping any of the static rects in the collision world
+    # Projectiles are split into clusters wherever there's a horizontal gap of more than CLUSTER_GAP_CELLS collision cells between them,
+    # and each cluster queries the collision world once with its own bounds. Projectiles far apart on a wide level then don't make
+    # a query cover every cell between them, while the usual crowd of projectiles around the player still costs a single query
+    def collide_static(self, hitboxes, collision_world):
+        hits = numpy.zeros(len(hitboxes), dtype=bool)
+        if len(hitboxes) == 0:
+            return hits
+        order = numpy.argsort(hitboxes[:, 0], kind='stable')
+        starts = hitboxes[order, 0]
+        ends = numpy.maximum.accumulate(starts + hitboxes[order, 2])
+        splits = numpy.flatnonzero(starts[1:] - ends[:-1] > ProjectileSystem.CLUSTER_GAP_CELLS * collision_world.cell_size) + 1
+        for cluster in numpy.split(order, splits):
+            cluster_hitboxes = hitboxes[cluster]
+            bounds_min = cluster_hitboxes[:, :2].min(axis=0)
+            bounds_max = (cluster_hitboxes[:, :2] + cluster_hitboxes[:, 2:]).max(axis=0)
+            nearby_rects = collision_world.query(tuple(bounds_min) + tuple(bounds_max - bounds_min))
+            if len(nearby_rects) != 0:
+                hits[cluster] = rect_overlaps(cluster_hitboxes, numpy.array(nearby_rects, dtype=float)).any(axis=1)
+        return hits
+
+    # Runs one step of every projectile against the level
+    # Bullets are removed when they hit an enemy, an enemy projectile or a platform, and the enemy or projectile they hit takes damage
+    # Tomato heads are removed when they hit a platform or the player, and the player takes damage
+    # Projectiles are only tested against the enemies, projectiles and player the broadphase pairs them with
+    def update(self, delta, collision_world, enemies, player, broadphase):
+        if self.count == 0:
+            return
+
+        # Moving every projectile is counted as part of the bullet phase
+        timing.frame_timer.begin('bullets')
+        dead = self.integrate(delta)
+        hitboxes = self.get_hitboxes()
+        is_bullet = self.get_kind_mask(BULLET)
+        is_tomato_head = self.get_kind_mask(TOMATO_HEAD)
+
+        bullet_indices = numpy.flatnonzero(is_bullet)
+        if len(bullet_indices) != 0:
+            bullet_hitboxes = hitboxes[bullet_indices]
+            hit_anything = numpy.zeros(len(bullet_indices), dtype=bool)
+
+            # Each bullet hits the first enemy it overlaps
+            if len(enemies) != 0:
+                enemy_hits = broadphase.find_first_hits('bullet_enemy', bullet_hitboxes, numpy.array([enemy_obj.get_hitbox() for enemy_obj in enemies], dtype=float))
+                hit_enemy = enemy_hits != -1
+                for enemy_index in enemy_hits[hit_enemy]:
+                    enemies[enemy_index].take_damage()
+                hit_anything |= hit_enemy
+
+            # Bullets that didn't hit an enemy destroy the first enemy projectile they overlap instead
+            tomato_head_indices = numpy.flatnonzero(is_tomato_head)
+            if len(tomato_head_indices) != 0:
+                missed_bullets = numpy.flatnonzero(~hit_anything)
+                projectile_hits = broadphase.find_first_hits('bullet_projectile', bullet_hitboxes[missed_bullets], hitboxes[tomato_head_indices])
+                hit_projectile = projectile_hits != -1
+                dead[tomato_head_indices[projectile_hits[hit_projectile]]] = True
+                hit_anything[missed_bullets[hit_projectile]] = True
+
+            hit_anything |= self.collide_static(bullet_hitboxes, collision_world)
+            dead[bullet_indices[hit_anything]] = True
+        timing.frame_timer.end('bullets')
+
+        timing.frame_timer.begin('projectiles')
+        tomato_head_indices = numpy.flatnonzero(is_tomato_head & ~dead)
+        if len(tomato_head_indices) != 0:
+            tomato_head_hitboxes = hitboxes[tomato_head_indices]
+            hit_platform = self.collide_static(tomato_head_hitboxes, collision_world)
+            dead[tomato_head_indices[hit_platform]] = True
+
+            hit_player = numpy.zeros(len(tomato_head_indices), dtype=bool)
+            hit_player[broadphase.find_pairs('projectile_player', tomato_head_hitboxes, numpy.array([player.get_hitbox()], dtype=float))[0]] = True
+            hit_player &= ~hit_platform
+            for index in tomato_head_indices[hit_player]:
+                player.take_damage(tuple(hitboxes[index]), 0)
+            dead[tomato_head_indices[hit_player]] = True
+
+        if dead.any():
+            self.remove(dead)
+        timing.frame_timer.end('projectiles')
+
+    # Returns the frames projectiles are drawn with, indexed by kind * 2 + flip
+    # Kinds without any live projectiles are left as None, so that their animations aren't loaded just to draw nothing
+    def get_frame_table(self):
+        frames = []
+        for kind in range(0, len(KINDS)):
+            if self.kind_counts[kind] == 0:
+                frames += [None, None]
+            else:
+                frames += [animation.frame_data[KINDS[kind].ANIMATION][0], animation.flipped_frame_data[KINDS[kind].ANIMATION][0]]
+        return frames
+
+    # Submits every projectile to a render queue in one batch, offset by the given camera offset
+    # Positions are interpolated between the previous step and the current one by the given factor
+    def submit(self, render_queue, camera_offset, interpolation=1.0):
+        if self.count == 0:
+            return
+        previous_positions = self.previous_positions[:self.count]
+        positions = previous_positions + ((self.positions[:self.count] - previous_positions) * interpolation)
+        frames = self.get_frame_table()
+        frame_sizes = numpy.array([(0, 0) if frame is None else frame.get_size() for frame in frames], dtype=float)
+        frame_indices = (self.kinds[:self.count].astype(int) * 2) + self.flips[:self.count]
+        render_queue.submit_batch(renderqueue.PROJECTILES, [frames[index] for index in frame_indices.tolist()], positions - numpy.array(camera_offset, dtype=float), frame_sizes[frame_indices])
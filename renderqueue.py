@@ -0,0 +1,82 @@
+import numpy
+import itertools
+
+
+# The layers sprites are drawn in, back to front
+# Sprites on the same layer are drawn in the order they were submitted
+BACKGROUND = 0
+PLAYER = 1
+ENEMIES = 2
+PROJECTILES = 3
+PARTICLES = 4
+
+
+# Drawing numbers of the last flushed frame, shown in the debug overlay
+class RenderStats:
+    def __init__(self):
+        self.submitted = 0
+        self.drawn = 0
+        self.culled = 0
+        self.draw_calls = 0
+
+    def __str__(self):
+        return 'drawn {} culled {} draw calls {}'.format(self.drawn, self.culled, self.draw_calls)
+
+
+# Returns the (x, y) rows of a list of 2-tuples as an (N, 2) array, which is a lot faster than numpy.array() on a list of tuples
+def to_pair_array(pairs):
+    return numpy.fromiter(itertools.chain.from_iterable(pairs), dtype=float, count=len(pairs) * 2).reshape(-1, 2)
+
+
+# Collects everything drawn during a frame, and draws it all at once when the frame is flushed
+# Sprites are submitted with a layer, a surface and a screen position. Flushing culls every sprite against the screen in one pass,
+# sorts what's left by layer and draws it with a single Surface.blits() call, instead of paying for a Python level blit and bounds test per sprite
+# Systems that already keep their positions in arrays, like projectiles, can submit all of their sprites as one batch
+class RenderQueue:
+    def __init__(self):
+        self.stats = RenderStats()
+        self.clear()
+
+    def clear(self):
+        self.items = []
+        # Each batch is a (layers, surfaces, positions, sizes) group, with the sprites submitted one at a time turned into batches as needed
+        # so that sprites on the same layer keep the order they were submitted in
+        self.batches = []
+
+    def submit(self, layer, surface, position):
+        self.items.append((layer, surface, position))
+
+    # Submits many sprites on one layer at once. Positions and sizes are (N, 2) arrays
+    def submit_batch(self, layer, surfaces, positions, sizes):
+        self.close_items()
+        self.batches.append((numpy.full(len(surfaces), layer), surfaces, positions, sizes))
+
+    def close_items(self):
+        if len(self.items) == 0:
+            return
+        layers, surfaces, positions = zip(*self.items)
+        self.batches.append((numpy.array(layers), list(surfaces), to_pair_array(positions), to_pair_array([surface.get_size() for surface in surfaces])))
+        self.items = []
+
+    # Draws every submitted sprite overlapping the target surface and empties the queue
+    def flush(self, target):
+        self.close_items()
+        self.stats.drawn = 0
+        self.stats.draw_calls = 0
+        if len(self.batches) == 0:
+            self.stats.submitted = 0
+        else:
+            layers = numpy.concatenate([batch[0] for batch in self.batches])
+            surfaces = list(itertools.chain.from_iterable([batch[1] for batch in self.batches]))
+            positions = numpy.concatenate([batch[2] for batch in self.batches])
+            ends = positions + numpy.concatenate([batch[3] for batch in self.batches])
+            self.stats.submitted = len(surfaces)
+
+            on_screen = (ends[:, 0] > 0) & (ends[:, 1] > 0) & (positions[:, 0] < target.get_width()) & (positions[:, 1] < target.get_height())
+            visible = numpy.flatnonzero(on_screen)
+            order = visible[numpy.argsort(layers[visible], kind='stable')]
+            target.blits(zip([surfaces[index] for index in order.tolist()], positions[order].tolist()), False)
+            self.stats.drawn = len(order)
+            self.stats.draw_calls = 1
+        self.stats.culled = self.stats.submitted - self.stats.drawn
+        self.clear()
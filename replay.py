@@ -0,0 +1,98 @@
+import numpy
+import os
+import struct
+import input
+
+
+# Input recordings, for reproducing a run tick for tick
+# A recording holds the state of every action at the start of each simulation step of the level, so replaying it at the same tick rate
+# steps the level through exactly the same inputs however fast or slow the frames are, and should end in exactly the same state
+#
+# Recording file layout:
+# header: magic, format version, tick rate, sha1 of the level state when recording stopped (zeros if it never stopped cleanly), map path length
+# then the map path the recording was made on, as UTF-8
+# body: one little-endian uint16 per tick, holding the is_pressed, is_just_pressed and is_just_released flags of the actions, 4 bits each
+# The body is written as the game runs, so the number of ticks is only known from the size of the file
+REPLAY_MAGIC = b'VRPL'
+REPLAY_VERSION = 1
+REPLAY_HEADER = struct.Struct('<4sII20sH')
+HASH_OFFSET = struct.calcsize('<4sII')
+ACTION_COUNT = 4
+NO_HASH = bytes(20)
+
+
+# Packs the current state of every action into the bits of one tick
+def pack_input_state():
+    bits = 0
+    for action in range(0, ACTION_COUNT):
+        bits |= input.is_pressed[action] << action
+        bits |= input.is_just_pressed[action] << (action + ACTION_COUNT)
+        bits |= input.is_just_released[action] << (action + (ACTION_COUNT * 2))
+    return bits
+
+
+def unpack_input_state(bits):
+    input.is_pressed = [bool(bits & (1 << action)) for action in range(0, ACTION_COUNT)]
+    input.is_just_pressed = [bool(bits & (1 << (action + ACTION_COUNT))) for action in range(0, ACTION_COUNT)]
+    input.is_just_released = [bool(bits & (1 << (action + (ACTION_COUNT * 2)))) for action in range(0, ACTION_COUNT)]
+
+
+# Writes the input of every tick to a recording file
+# Ticks are buffered and written in blocks, and the final state hash is filled into the header once the recording is closed
+class Recorder:
+    FLUSH_TICKS = 600
+
+    def __init__(self, path, map_path, tick_rate):
+        directory = os.path.dirname(path)
+        if directory != '':
+            os.makedirs(directory, exist_ok=True)
+        self.outfile = open(path, 'wb')
+        encoded_map_path = map_path.encode()
+        self.outfile.write(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, tick_rate, NO_HASH, len(encoded_map_path)))
+        self.outfile.write(encoded_map_path)
+        self.ticks = []
+        self.tick_count = 0
+
+    # Called at the start of every level step, after the step's input events were handled
+    def begin_tick(self):
+        self.ticks.append(pack_input_state())
+        self.tick_count += 1
+        if len(self.ticks) >= Recorder.FLUSH_TICKS:
+            self.flush()
+
+    def flush(self):
+        self.outfile.write(numpy.array(self.ticks, dtype='<u2').tobytes())
+        self.ticks = []
+
+    def close(self, state_hash):
+        self.flush()
+        self.outfile.seek(HASH_OFFSET)
+        self.outfile.write(state_hash)
+        self.outfile.close()
+
+
+# Feeds the input module from a recording instead of the pygame event queue
+# Every level step overwrites the action states with the recorded ones, so key presses made while a replay runs have no effect on it
+class Replay:
+    def __init__(self, path):
+        infile = open(path, 'rb')
+        magic, version, self.tick_rate, self.state_hash, map_path_length = REPLAY_HEADER.unpack(infile.read(REPLAY_HEADER.size))
+        if magic != REPLAY_MAGIC or version != REPLAY_VERSION:
+            raise ValueError(path + ' is not a recording this version can replay')
+        self.map_path = infile.read(map_path_length).decode()
+        self.ticks = numpy.frombuffer(infile.read(), dtype='<u2').tolist()
+        infile.close()
+        self.tick = 0
+
+    def has_state_hash(self):
+        return self.state_hash != NO_HASH
+
+    def is_finished(self):
+        return self.tick >= len(self.ticks)
+
+    def begin_tick(self):
+        if self.is_finished():
+            input.reset_all()
+            return
+        unpack_input_state(self.ticks[self.tick])
+        self.tick += 1
@@ -1,4 +1,5 @@
 import math
+import hashlib
 
 
 DISPLAY_WIDTH = 640
@@ -13,7 +14,11 @@ class Color:
     RED = (255, 0, 0)
 
 
+# The methods returning a Vector create a new one. The i-prefixed methods change the vector in place and return it, and the
+# *_tuple methods return plain tuples, so that code run every step for every entity doesn't have to create a Vector per operation
 class Vector:
+    __slots__ = ('x', 'y')
+
     def __init__(self, x, y):
         self.x = x
         self.y = y
@@ -46,6 +51,41 @@ class Vector:
     def multiply_by(self, other):
         return Vector(self.x * other, self.y * other)
 
+    def set(self, x, y):
+        self.x = x
+        self.y = y
+        return self
+
+    def set_to(self, other):
+        self.x = other.x
+        self.y = other.y
+        return self
+
+    def iadd(self, other):
+        self.x += other.x
+        self.y += other.y
+        return self
+
+    def isub(self, other):
+        self.x -= other.x
+        self.y -= other.y
+        return self
+
+    def iscale(self, factor):
+        self.x *= factor
+        self.y *= factor
+        return self
+
+    def sum_tuple(self, other):
+        return (self.x + other.x, self.y + other.y)
+
+    def offset_tuple(self, x, y):
+        return (self.x + x, self.y + y)
+
+    # Returns the point the given fraction of the way from this vector to the other one
+    def lerp_tuple(self, other, t):
+        return (self.x + ((other.x - self.x) * t), self.y + ((other.y - self.y) * t))
+
     def distance_from(self, other):
         return math.sqrt(((self.x - other.x) ** 2) + ((self.y - other.y) ** 2))
 
@@ -59,3 +99,10 @@ def is_rect_collision(rect_a, rect_b):
 
 def point_in_rect(point, rect):
     return point[0] >= rect[0] and point[0] <= rect[0] + rect[2] and point[1] >= rect[1] and point[1] <= rect[1] + rect[3]
+
+
+def hash_file(path):
+    source = open(path, 'rb')
+    digest = hashlib.sha1(source.read()).digest()
+    source.close()
+    return digest
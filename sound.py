@@ -1,16 +1,160 @@
 import pygame
+import timing
 
 sfx = {}
 
+# Every sound, with the category of channels it plays on, how many copies of it may play at once, and its priority
+# When a category has no free channel, a new sound takes over the channel of a playing sound with a lower or equal priority, if there is one
+SOUNDS = {
+    'player_jump': {'path': './res/sfx/player_jump.wav', 'category': 'player', 'max_voices': 2, 'priority': 2},
+    'player_shoot': {'path': './res/sfx/player_shoot.wav', 'category': 'player', 'max_voices': 3, 'priority': 1}
+}
 
-def load_all():
-    global sfx
+# How many mixer channels are reserved for each category of sound. Categories don't share channels,
+# so a burst of one kind of sound can never cut off the sounds of another
+# Only categories that have sounds get channels, so giving a sound a new category means adding the category here too
+CATEGORY_CHANNELS = {
+    'player': 6
+}
 
-    sfx = {
-        'player_jump': pygame.mixer.Sound('./res/sfx/player_jump.wav'),
-        'player_shoot': pygame.mixer.Sound('./res/sfx/player_shoot.wav')
-    }
+# Mixer output settings. The buffer is how many samples the mixer mixes ahead, which is most of the delay between playing a sound and hearing it
+# pygame's default of 512 samples is about 12ms at 44.1kHz. Smaller buffers cut the delay but take more CPU, and crackle if the mixer can't keep up
+FREQUENCY = 44100
+SAMPLE_SIZE = -16
+OUTPUT_CHANNELS = 2
+BUFFER_SIZE = 256
+
+
+# Playback numbers, shown in the debug overlay
+# Restarted voices were a sound over its voice limit starting its own oldest copy over, stolen voices were a different sound cut off to make room
+# for a new one, and dropped voices are new sounds that weren't played at all
+# The buffer time is the length of the buffer that was asked for, at the frequency the mixer opened with. pygame doesn't report the buffer size
+# SDL actually opened, nor the delay of the audio device after it, so this is a lower bound on the playback delay rather than a measurement of it
+class MixerStats:
+    def __init__(self):
+        self.buffer_ms = 0
+        self.voices = 0
+        self.channel_count = 0
+        self.played = 0
+        self.restarted = 0
+        self.stolen = 0
+        self.dropped = 0
+
+    def __str__(self):
+        return 'voices {}/{} played {} restarted {} stolen {} dropped {} buffer {:.1f}ms'.format(self.voices, self.channel_count, self.played, self.restarted, self.stolen, self.dropped, self.buffer_ms)
+
+
+# Plays sounds on channels it manages itself instead of leaving pygame to pick one
+# Every channel is reserved, so pygame never plays anything on them on its own, and each category of sound gets its own group of them
+# A sound that already plays as many times as it may at once restarts its oldest copy, so rapid fire sounds never take over their whole group
+class Mixer:
+    def __init__(self):
+        self.stats = MixerStats()
+        self.channels = {}
+        # The (name, priority, play order) of the sound last played on each channel, in the same order as the channels
+        self.voices = {}
+        self.play_count = 0
+
+    # Sets up the channel groups. The mixer must already be initialized
+    def init(self, buffer_size):
+        assert set([settings['category'] for settings in SOUNDS.values()]) == set(CATEGORY_CHANNELS.keys())
+        channel_count = sum(CATEGORY_CHANNELS.values())
+        pygame.mixer.set_num_channels(channel_count)
+        pygame.mixer.set_reserved(channel_count)
+
+        first_channel = 0
+        for category, count in CATEGORY_CHANNELS.items():
+            self.channels[category] = [pygame.mixer.Channel(index) for index in range(first_channel, first_channel + count)]
+            self.voices[category] = [None] * count
+            first_channel += count
+
+        frequency = pygame.mixer.get_init()[0]
+        self.stats.channel_count = channel_count
+        self.stats.buffer_ms = 1000 * buffer_size / frequency
+
+    def play(self, name):
+        settings = SOUNDS[name]
+        category = settings['category']
+        channels = self.channels[category]
+        voices = self.voices[category]
+
+        index = self.find_channel(name, settings, channels, voices)
+        if index is None:
+            self.stats.dropped += 1
+            return
+        if channels[index].get_busy():
+            if voices[index][0] == name:
+                self.stats.restarted += 1
+            else:
+                self.stats.stolen += 1
+
+        self.play_count += 1
+        channels[index].play(sfx[name])
+        voices[index] = (name, settings['priority'], self.play_count)
+        self.stats.played += 1
+
+    # Returns the index of the channel a sound should play on, or None if it shouldn't play at all
+    def find_channel(self, name, settings, channels, voices):
+        playing = [index for index in range(0, len(channels)) if channels[index].get_busy()]
+
+        # Over its voice limit, the oldest copy of the same sound is restarted
+        copies = [index for index in playing if voices[index][0] == name]
+        if len(copies) >= settings['max_voices']:
+            return min(copies, key=lambda index: voices[index][2])
+
+        for index in range(0, len(channels)):
+            if not channels[index].get_busy():
+                return index
+
+        # Otherwise the lowest priority sound goes, the oldest first, as long as it doesn't matter more than the new one
+        index = min(playing, key=lambda index: (voices[index][1], voices[index][2]))
+        if voices[index][1] > settings['priority']:
+            return None
+        return index
+
+    def get_voice_count(self):
+        return sum([channel.get_busy() for channels in self.channels.values() for channel in channels])
+
+    def __str__(self):
+        self.stats.voices = self.get_voice_count()
+        return str(self.stats)
+
+
+mixer = Mixer()
+
+
+# Sets the mixer output up. Must be called before pygame.init(), which initializes the mixer with these settings
+def pre_init(buffer_size=BUFFER_SIZE):
+    pygame.mixer.pre_init(FREQUENCY, SAMPLE_SIZE, OUTPUT_CHANNELS, buffer_size)
+
+
+# Initializes the mixer if pygame.init() didn't, and reserves the channel groups
+def init(buffer_size=BUFFER_SIZE):
+    if pygame.mixer.get_init() is None:
+        pygame.mixer.init(FREQUENCY, SAMPLE_SIZE, OUTPUT_CHANNELS, buffer_size)
+    mixer.init(buffer_size)
+    timing.frame_timer.set_counter('mixer', mixer)
+
+
+# Returns the file a sound is loaded from
+def get_path(name):
+    return SOUNDS[name]['path']
+
+
+# Reads and decodes a sound. Runs on a loader thread
+def decode(name):
+    return name, pygame.mixer.Sound(get_path(name))
+
+
+def finalize(decoded):
+    sfx[decoded[0]] = decoded[1]
+
+
+# Queues every sound on a background loader
+def queue_all(asset_loader):
+    for name in SOUNDS.keys():
+        asset_loader.add(decode, finalize, name)
 
 
 def play(name):
-    sfx[name].play()
+    mixer.play(name)
@@ -0,0 +1,83 @@
+import pygame
+import shared
+import renderqueue
+
+
+# The parts of a level that never move, pre-rendered into one surface per loaded level chunk
+# Each chunk holds its slice of the level background, plus the platform debug geometry when that overlay is turned on
+# Rendering only blits the few chunks overlapping the camera instead of redrawing the whole level every frame
+# Chunks are added and removed as the level streams them in and out, so only the ones near the camera take up memory
+class StaticLayer:
+    def __init__(self):
+        self.size = (0, 0)
+        self.chunk_width = 0
+        self.show_platforms = True
+        # Maps the index of each loaded chunk to its background slice and the platform rects overlapping it, and to its baked surface
+        self.sources = {}
+        self.chunks = {}
+
+    # Removes every chunk, for a level of the given size split into chunks of the given width
+    def reset(self, size, chunk_width):
+        self.size = size
+        self.chunk_width = chunk_width
+        self.sources = {}
+        self.chunks = {}
+
+    def add_chunk(self, index, background, platforms):
+        self.sources[index] = (background, platforms)
+        self.chunks[index] = self.bake_chunk(index)
+
+    def remove_chunk(self, index):
+        del self.sources[index]
+        del self.chunks[index]
+
+    def set_show_platforms(self, show_platforms):
+        if show_platforms != self.show_platforms:
+            self.show_platforms = show_platforms
+            self.invalidate()
+
+    def get_chunk_rect(self, index):
+        x = index * self.chunk_width
+        return (x, 0, min(self.chunk_width, self.size[0] - x), self.size[1])
+
+    # Returns the range of chunk indices overlapping a rect, clamped to the level
+    def get_chunk_range(self, rect):
+        min_index = max(0, int(rect[0] // self.chunk_width))
+        max_index = min(int((self.size[0] - 1) // self.chunk_width), int((rect[0] + rect[2] - 1) // self.chunk_width))
+        return min_index, max_index
+
+    # Re-bakes the loaded chunks overlapping the given rect, or every loaded chunk if no rect is given
+    # Must be called after the background or platforms change, e.g. when the editor moves a platform
+    def invalidate(self, rect=None):
+        if rect is None:
+            rect = (0, 0) + tuple(self.size)
+        min_index, max_index = self.get_chunk_range(rect)
+        for index in range(min_index, max_index + 1):
+            if index in self.sources:
+                self.chunks[index] = self.bake_chunk(index)
+
+    def bake_chunk(self, index):
+        background, platforms = self.sources[index]
+        chunk_rect = self.get_chunk_rect(index)
+        chunk_surface = pygame.Surface(chunk_rect[2:]).convert()
+        chunk_surface.fill(shared.Color.BLACK)
+        chunk_surface.blit(background, (0, 0))
+
+        if self.show_platforms:
+            for platform in platforms:
+                pygame.draw.rect(chunk_surface, shared.Color.RED, (platform[0] - chunk_rect[0], platform[1] - chunk_rect[1]) + tuple(platform[2:]), False)
+
+        return chunk_surface
+
+    def get_bytes(self):
+        return sum([chunk.get_width() * chunk.get_height() * chunk.get_bytesize() for chunk in self.chunks.values()])
+
+    # Submits the loaded chunks overlapping the camera to a render queue
+    def submit(self, render_queue, camera_offset):
+        if self.chunk_width == 0:
+            return
+        min_index, max_index = self.get_chunk_range(camera_offset.as_tuple() + (shared.DISPLAY_WIDTH, shared.DISPLAY_HEIGHT))
+        for index in range(min_index, max_index + 1):
+            chunk = self.chunks.get(index)
+            if chunk is not None:
+                render_queue.submit(renderqueue.BACKGROUND, chunk, (index * self.chunk_width - camera_offset.x, -camera_offset.y))
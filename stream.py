@@ -0,0 +1,240 @@
+import pygame
+import numpy
+import concurrent.futures
+import hashlib
+import os
+import struct
+import threading
+import zlib
+import shared
+import mapfile
+
+
+# Levels are split into columns of fixed-width chunks, each holding its slice of the background and the platforms overlapping it
+# Only the chunks around the camera are kept in memory, so a level's memory use and load time don't grow with its width
+#
+# Chunk file layout:
+# header: magic, format version, sha1 of the map it was split from, map width, map height, chunk width, chunk count, platform count, spawn count
+# spawns: one (kind, x, y) group of int32s per spawn, like binary mapfiles
+# index: one (offset, platform count, pixel byte count) entry per chunk
+# chunks: one (platform id, x, y, width, height) group of int32s per platform, followed by the zlib compressed RGB pixels of the background slice
+# Platform ids are the platform's index in the whole map, which keeps collision queries returning platforms in the same order however chunks are loaded
+CHUNK_WIDTH = 512
+CHUNKS_DIR = './cache/maps/'
+CHUNKS_MAGIC = b'VCHK'
+CHUNKS_VERSION = 1
+CHUNKS_HEADER = struct.Struct('<4sI20siiiIII')
+CHUNK_INDEX_ENTRY = struct.Struct('<QII')
+
+
+def get_chunks_path(path):
+    return CHUNKS_DIR + os.path.basename(path) + '.chunks'
+
+
+# Hashes the contents of a map and the image its background is made from, for maps that only exist in memory and have no sources to hash
+def hash_map(size, platforms, spawns, image_path):
+    source_hash = hashlib.sha1(numpy.array(size, dtype='<i4').tobytes())
+    source_hash.update(numpy.array(platforms, dtype='<i4').tobytes())
+    source_hash.update(numpy.array([(mapfile.SPAWN_KINDS.index(spawn[0]), spawn[1], spawn[2]) for spawn in spawns], dtype='<i4').tobytes())
+    if image_path is not None:
+        source_hash.update(shared.hash_file(image_path))
+    return source_hash.digest()
+
+
+# Returns the platforms of a map with the walls around the edges of the level added after them
+def add_walls(size, platforms):
+    width, height = size
+    return list(platforms) + [(0, 0, 1, height), (width - 1, 0, 1, height), (0, 0, width, 1), (0, height - 1, width, 1)]
+
+
+def get_chunk_count(width, chunk_width):
+    return (width + chunk_width - 1) // chunk_width
+
+
+def get_chunk_rect(index, size, chunk_width):
+    x = index * chunk_width
+    return (x, 0, min(chunk_width, size[0] - x), size[1])
+
+
+# Returns, for each chunk, the (platform id, rect) pairs of every platform overlapping it
+def split_platforms(platforms, size, chunk_width):
+    chunk_platforms = [[] for i in range(0, get_chunk_count(size[0], chunk_width))]
+    for platform_id in range(0, len(platforms)):
+        platform = platforms[platform_id]
+        first_chunk = max(0, platform[0] // chunk_width)
+        last_chunk = min(len(chunk_platforms) - 1, (platform[0] + platform[2] - 1) // chunk_width)
+        for index in range(first_chunk, last_chunk + 1):
+            chunk_platforms[index].append((platform_id, platform))
+    return chunk_platforms
+
+
+# Splits a map into chunks and writes them to a chunk file
+# The platforms must already include the walls. make_background(index, rect) returns the background slice of each chunk,
+# so the chunks are built one column at a time and the map's whole background never has to be in memory at once
+def write_chunks(path, source_hash, size, platforms, spawns, make_background, chunk_width=CHUNK_WIDTH):
+    chunk_platforms = split_platforms(platforms, size, chunk_width)
+    spawn_body = numpy.array([(mapfile.SPAWN_KINDS.index(spawn[0]), spawn[1], spawn[2]) for spawn in spawns], dtype='<i4')
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    outfile = open(path, 'wb')
+    outfile.write(CHUNKS_HEADER.pack(CHUNKS_MAGIC, CHUNKS_VERSION, source_hash, size[0], size[1], chunk_width, len(chunk_platforms), len(platforms), len(spawns)))
+    outfile.write(spawn_body.tobytes())
+
+    # The index is written once every chunk's offset is known
+    index_offset = outfile.tell()
+    outfile.write(bytes(CHUNK_INDEX_ENTRY.size * len(chunk_platforms)))
+    index = []
+    for chunk_index in range(0, len(chunk_platforms)):
+        platform_body = numpy.array([(platform_id,) + tuple(platform) for platform_id, platform in chunk_platforms[chunk_index]], dtype='<i4')
+        pixels = zlib.compress(pygame.image.tobytes(make_background(chunk_index, get_chunk_rect(chunk_index, size, chunk_width)), 'RGB'))
+        index.append(CHUNK_INDEX_ENTRY.pack(outfile.tell(), len(chunk_platforms[chunk_index]), len(pixels)))
+        outfile.write(platform_body.tobytes())
+        outfile.write(pixels)
+    outfile.seek(index_offset)
+    outfile.write(b''.join(index))
+    outfile.close()
+
+
+# Returns the hash of the map a chunk file was split from, or None if the file is missing or isn't a chunk file this version can read
+def read_chunks_hash(path):
+    if not os.path.exists(path) or os.path.getsize(path) < CHUNKS_HEADER.size:
+        return None
+    infile = open(path, 'rb')
+    header = CHUNKS_HEADER.unpack(infile.read(CHUNKS_HEADER.size))
+    infile.close()
+    if header[0] != CHUNKS_MAGIC or header[1] != CHUNKS_VERSION:
+        return None
+    return header[2]
+
+
+# A chunk file opened for streaming
+# Opening it only reads the header, the spawns and the chunk index. Chunks are read one at a time with read_chunk(),
+# which doesn't need the display and may be called from a loader thread
+class ChunkFile:
+    def __init__(self, path):
+        self.infile = open(path, 'rb')
+        self.lock = threading.Lock()
+        header = CHUNKS_HEADER.unpack(self.infile.read(CHUNKS_HEADER.size))
+        self.size = (header[3], header[4])
+        self.chunk_width = header[5]
+        self.chunk_count = header[6]
+        self.platform_count = header[7]
+
+        spawn_body = numpy.frombuffer(self.infile.read(header[8] * 12), dtype='<i4').reshape(-1, 3).tolist()
+        self.spawns = [(mapfile.SPAWN_KINDS[kind], x, y) for kind, x, y in spawn_body]
+        self.index = [CHUNK_INDEX_ENTRY.unpack(self.infile.read(CHUNK_INDEX_ENTRY.size)) for i in range(0, self.chunk_count)]
+
+    # Returns the (platform id, rect) pairs and the background slice of a chunk
+    def read_chunk(self, index):
+        offset, platform_count, pixel_count = self.index[index]
+        with self.lock:
+            self.infile.seek(offset)
+            data = self.infile.read((platform_count * 20) + pixel_count)
+        platform_body = numpy.frombuffer(data[:platform_count * 20], dtype='<i4').reshape(-1, 5).tolist()
+        platforms = [(body[0], tuple(body[1:])) for body in platform_body]
+        rect = get_chunk_rect(index, self.size, self.chunk_width)
+        background = pygame.image.frombytes(zlib.decompress(data[platform_count * 20:]), rect[2:], 'RGB')
+        return platforms, background
+
+    def close(self):
+        self.infile.close()
+
+
+# The same as a chunk file, but for a map that is already in memory, e.g. one generated by a benchmark
+class MemoryChunks:
+    def __init__(self, size, platforms, spawns, background, chunk_width=CHUNK_WIDTH):
+        self.size = size
+        self.chunk_width = chunk_width
+        self.chunk_count = get_chunk_count(size[0], chunk_width)
+        self.platform_count = len(platforms)
+        self.spawns = spawns
+        self.background = background
+        self.chunk_platforms = split_platforms(platforms, size, chunk_width)
+
+    def read_chunk(self, index):
+        return self.chunk_platforms[index], self.background.subsurface(get_chunk_rect(index, self.size, self.chunk_width))
+
+    def close(self):
+        pass
+
+
+# Streaming numbers, shown in the debug overlay
+class StreamStats:
+    def __init__(self, chunk_count):
+        self.chunk_count = chunk_count
+        self.resident = 0
+        self.peak_resident = 0
+        self.pending = 0
+        self.loads = 0
+        self.sync_loads = 0
+        self.unloads = 0
+
+    def __str__(self):
+        return '{}/{} peak {} pending {} loads {} sync {} unloads {}'.format(self.resident, self.chunk_count, self.peak_resident, self.pending, self.loads, self.sync_loads, self.unloads)
+
+
+# Keeps the chunks of a level around a range of x positions loaded
+# Chunks a little outside of the range are read ahead of time on a worker thread, chunks inside of it that still aren't loaded are read right away,
+# and chunks far enough outside of it are unloaded. Loaded chunks are handed to on_load(index, platforms, background) and unloaded ones to on_unload(index, platforms)
+class ChunkStreamer:
+    # How far outside of the needed range chunks are read ahead, and how much further they must be before they're unloaded
+    PRELOAD_MARGIN = 512
+    UNLOAD_MARGIN = 1024
+
+    def __init__(self, source, on_load, on_unload):
+        self.source = source
+        self.on_load = on_load
+        self.on_unload = on_unload
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.resident = {}
+        self.pending = {}
+        self.stats = StreamStats(source.chunk_count)
+
+    def get_chunk_range(self, min_x, max_x):
+        first_chunk = max(0, int(min_x // self.source.chunk_width))
+        last_chunk = min(self.source.chunk_count - 1, int(max_x // self.source.chunk_width))
+        return first_chunk, last_chunk
+
+    def update(self, min_x, max_x):
+        keep_first, keep_last = self.get_chunk_range(min_x - ChunkStreamer.UNLOAD_MARGIN, max_x + ChunkStreamer.UNLOAD_MARGIN)
+        for index in [index for index in self.resident.keys() if index < keep_first or index > keep_last]:
+            self.unload(index)
+
+        # Reads that finished in the background are handed over first, so that chunks needed right away don't get read twice
+        for index in [index for index, future in self.pending.items() if future.done()]:
+            self.finish_load(index)
+
+        first_chunk, last_chunk = self.get_chunk_range(min_x - ChunkStreamer.PRELOAD_MARGIN, max_x + ChunkStreamer.PRELOAD_MARGIN)
+        for index in range(first_chunk, last_chunk + 1):
+            if index not in self.resident and index not in self.pending:
+                self.pending[index] = self.executor.submit(self.source.read_chunk, index)
+
+        first_chunk, last_chunk = self.get_chunk_range(min_x, max_x)
+        for index in range(first_chunk, last_chunk + 1):
+            if index not in self.resident:
+                self.stats.sync_loads += 1
+                self.finish_load(index)
+        self.stats.pending = len(self.pending)
+
+    def finish_load(self, index):
+        platforms, background = self.pending.pop(index).result()
+        self.resident[index] = platforms
+        self.on_load(index, platforms, background)
+        self.stats.loads += 1
+        self.stats.resident = len(self.resident)
+        self.stats.peak_resident = max(self.stats.peak_resident, self.stats.resident)
+
+    def unload(self, index):
+        self.on_unload(index, self.resident.pop(index))
+        self.stats.unloads += 1
+        self.stats.resident = len(self.resident)
+
+    # Unloads every chunk and stops streaming
+    def shutdown(self):
+        for index in list(self.resident.keys()):
+            self.unload(index)
+        for future in self.pending.values():
+            future.cancel()
+        self.pending = {}
+        self.executor.shutdown(wait=True)
+        self.source.close()
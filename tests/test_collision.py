@@ -0,0 +1,49 @@
+import numpy
+import collision
+import projectile
+import shared
+
+
+# A hitbox with fractional edges ending inside a cell must still find the rects in that cell
+def test_fractional_rect_ending_past_cell_border():
+    world = collision.CollisionWorld()
+    world.add((64, 64, 32, 8))
+    assert world.query((60, 50, 4.5, 20)) == [(64, 64, 32, 8)]
+    assert world.collides((60, 50, 4.5, 20))
+
+
+# Rects are half-open, so one ending exactly on a cell border doesn't reach into the next cell
+def test_rect_ending_on_cell_border():
+    world = collision.CollisionWorld()
+    world.add((64, 64, 32, 8))
+    assert world.get_cell_range((0, 0, 64, 64)) == (0, 0, 0, 0)
+    assert world.query((0, 0, 64, 64)) == []
+    assert world.query((60, 50, 4, 14)) == []
+
+
+def test_query_matches_brute_force():
+    rects = [(0, 576, 640, 32), (64, 64, 32, 8), (127.5, 10, 0.5, 54), (200, 0, 1, 128)]
+    world = collision.CollisionWorld()
+    world.add_all(rects)
+    for x in [-0.5, 0, 59.5, 63.5, 64, 126.75, 199.25]:
+        for y in [-0.5, 0, 49.5, 63.5, 544.5, 545.5]:
+            query = (x, y, 4.5, 31.5)
+            assert world.query(query) == [rect for rect in rects if shared.is_rect_collision(query, rect)]
+
+
+def test_remove_fractional_rect():
+    world = collision.CollisionWorld()
+    rect_id = 7
+    world.add((63.5, 63.5, 0.75, 0.75), rect_id)
+    world.remove(rect_id)
+    assert world.cells == {}
+
+
+# Projectiles at opposite ends of a wide level are only tested against the rects in their own cells
+def test_projectiles_collide_with_nearby_rects_only():
+    world = collision.CollisionWorld()
+    rects = [(0, 576, 64000, 32), (100, 100, 16, 16), (63000, 100, 16, 16)]
+    world.add_all(rects)
+    hitboxes = numpy.array([(104, 104, 4, 4), (500, 104, 4, 4), (62990, 104, 12, 4), (30000, 574, 4, 4)], dtype=float)
+    hits = projectile.ProjectileSystem().collide_static(hitboxes, world)
+    assert hits.tolist() == [any(shared.is_rect_collision(hitbox, rect) for rect in rects) for hitbox in hitboxes.tolist()]
@@ -0,0 +1,36 @@
+import pytest
+import bench
+import input
+import level
+import main
+
+
+@pytest.fixture(scope='module')
+def game():
+    bench.use_headless_drivers()
+    game = main.Game()
+    input.reset_to_defaults()
+    game.wait_for_loading()
+    return game
+
+
+# The player must be able to walk away from its spawn on every shipped map
+@pytest.mark.parametrize('path', ['map/map.bin', 'tiled/level.tmx'])
+def test_player_can_walk_from_spawn(game, path):
+    result = bench.run_walk_check(path)
+    assert result['can_walk'], result
+
+
+# Once a map's chunk file is up to date, opening the map reads only the chunk file and never the map's platforms
+@pytest.mark.parametrize('path', ['map/map.bin', 'tiled/level.tmx'])
+def test_open_up_to_date_level_skips_mapfile(game, monkeypatch, path):
+    size, platforms, spawns = level.read_mapfile(path)
+    level.open_level(path).close()
+
+    def read_mapfile(path):
+        raise AssertionError('read ' + path + ' although its chunk file is up to date')
+    monkeypatch.setattr(level, 'read_mapfile', read_mapfile)
+    chunks = level.open_level(path)
+    chunks.close()
+    assert chunks.size == tuple(size)
+    assert chunks.spawns == spawns
@@ -0,0 +1,24 @@
+import random
+import timing
+
+
+# Histogram percentiles are within one bucket of the exact ones, and samples past the last bucket still report the real maximum
+def test_histogram_matches_sorted_percentiles():
+    rng = random.Random(1)
+    samples = [rng.expovariate(1 / 0.02) for i in range(0, 5000)] + [0.3, 0.4]
+    histogram = timing.Histogram(0.0001, 2500)
+    for sample in samples:
+        histogram.add(sample)
+
+    samples.sort()
+    assert histogram.count == len(samples)
+    assert histogram.max == samples[-1]
+    for percentile in [0, 50, 95, 99]:
+        exact = timing.get_sorted_percentile(samples, percentile)
+        if exact < 0.25:
+            assert exact <= histogram.get_percentile(percentile) <= exact + 0.0001
+    assert histogram.get_percentile(100) == samples[-1]
+
+
+def test_empty_histogram():
+    assert timing.Histogram(0.0001, 10).get_percentile(50) == 0
@@ -0,0 +1,190 @@
+import time
+import csv
+import math
+import collections
+
+
+# Every phase the game times, in the order they are shown in the overlay and written to the CSV
+# The first group are the phases of Game.loop, the second are the parts of Level.update
+PHASES = ['frame', 'input', 'update', 'render', 'scale', 'flip', 'player', 'enemies', 'bullets', 'projectiles', 'particles', 'chunks']
+
+
+# Returns the given percentile of a sorted list of samples
+def get_sorted_percentile(samples, percentile):
+    if len(samples) == 0:
+        return 0
+    return samples[max(0, math.ceil(len(samples) * percentile / 100) - 1)]
+
+
+# Counts samples in fixed-width buckets, so a distribution over a whole session takes the same memory however long the session runs
+# A percentile is read back as the upper edge of the bucket it falls in, so it is at most one bucket width above the real value.
+# Samples past the last bucket are counted in an overflow bucket, whose percentiles are the largest sample seen
+class Histogram:
+    def __init__(self, bucket_width, bucket_count):
+        self.bucket_width = bucket_width
+        self.counts = [0] * (bucket_count + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, sample):
+        self.counts[min(len(self.counts) - 1, int(sample / self.bucket_width))] += 1
+        self.count += 1
+        self.total += sample
+        self.max = max(self.max, sample)
+
+    # Ranks samples the same way as get_sorted_percentile()
+    def get_percentile(self, percentile):
+        if self.count == 0:
+            return 0
+        rank = max(1, math.ceil(self.count * percentile / 100))
+        seen = 0
+        for index in range(0, len(self.counts) - 1):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self.max, (index + 1) * self.bucket_width)
+        return self.max
+
+
+# Collects how long each phase of a frame took
+# Keeps a rolling window of recent frames for the debug overlay, and can stream every frame to a CSV file
+class FrameTimer:
+    WINDOW_SIZE = 120
+
+    def __init__(self):
+        self.starts = {}
+        self.current = {}
+        self.samples = {}
+        for phase in PHASES:
+            self.samples[phase] = collections.deque(maxlen=FrameTimer.WINDOW_SIZE)
+        self.counters = {}
+        self.frame = 0
+        self.csv_file = None
+        self.csv_writer = None
+
+    def begin(self, phase):
+        self.starts[phase] = time.perf_counter()
+
+    # A phase may be timed more than once per frame, in which case the times are added up
+    def end(self, phase):
+        elapsed = time.perf_counter() - self.starts[phase]
+        self.current[phase] = self.current.get(phase, 0) + elapsed
+
+    # Counters are values other than times that are worth watching in the overlay, e.g. how many collision pairs were tested
+    # Only the latest value of each is kept
+    def set_counter(self, name, value):
+        self.counters[name] = value
+
+    # Stores the times collected since the last call as one frame
+    def end_frame(self):
+        for phase in PHASES:
+            self.samples[phase].append(self.current.get(phase, 0))
+        if self.csv_writer is not None:
+            self.csv_writer.writerow([self.frame] + ['{:.4f}'.format(self.current.get(phase, 0) * 1000) for phase in PHASES])
+        self.current = {}
+        self.frame += 1
+
+    # Returns the rolling average of a phase in milliseconds
+    def get_average(self, phase):
+        samples = self.samples[phase]
+        if len(samples) == 0:
+            return 0
+        return 1000 * sum(samples) / len(samples)
+
+    # Returns the given percentile of a phase's rolling window in milliseconds
+    def get_percentile(self, phase, percentile):
+        return 1000 * get_sorted_percentile(sorted(self.samples[phase]), percentile)
+
+    def open_csv(self, path):
+        self.close_csv()
+        self.csv_file = open(path, 'w', newline='')
+        self.csv_writer = csv.writer(self.csv_file)
+        self.csv_writer.writerow(['frame'] + [phase + '_ms' for phase in PHASES])
+
+    def close_csv(self):
+        if self.csv_file is not None:
+            self.csv_file.close()
+        self.csv_file = None
+        self.csv_writer = None
+
+
+# Input to photon latency: how long it takes from an input event to the first flipped frame that shows its effect
+# Events are stamped when the game loop drains them from the event queue. pygame doesn't say when an event was queued,
+# so the time an event waited in the queue before that isn't included
+# An event's effect is on screen once a simulation step has run after it was handled and the frame rendered after that step is flipped,
+# so a stamp is carried across frames that don't step at all
+# The overlay shows a rolling window of recent latencies, and the report at exit every latency since the game started,
+# which is kept as a histogram of 0.1ms buckets up to 250ms
+class InputLatency:
+    WINDOW_SIZE = 240
+    BUCKET_WIDTH = 0.0001
+    BUCKET_COUNT = 2500
+
+    def __init__(self):
+        self.waiting = []
+        self.stepped = []
+        self.samples = collections.deque(maxlen=InputLatency.WINDOW_SIZE)
+        self.histogram = Histogram(InputLatency.BUCKET_WIDTH, InputLatency.BUCKET_COUNT)
+
+    def stamp(self):
+        self.waiting.append(time.perf_counter())
+
+    # Called after a frame ran at least one simulation step
+    def on_step(self):
+        self.stepped += self.waiting
+        self.waiting = []
+
+    # Called once a frame is flipped
+    def on_flip(self):
+        if len(self.stepped) == 0:
+            return
+        flip_time = time.perf_counter()
+        for stamp in self.stepped:
+            self.samples.append(flip_time - stamp)
+            self.histogram.add(flip_time - stamp)
+        self.stepped = []
+
+    # Called when a frame was skipped because nothing on screen changed, in which case the stepped events had no visible effect to measure
+    def discard(self):
+        self.stepped = []
+
+    # Returns the average and percentiles of a list of latencies in milliseconds
+    def get_distribution(self, samples):
+        samples = sorted(samples)
+        if len(samples) == 0:
+            return {'count': 0}
+        return {
+            'count': len(samples),
+            'avg_ms': 1000 * sum(samples) / len(samples),
+            'p50_ms': 1000 * get_sorted_percentile(samples, 50),
+            'p95_ms': 1000 * get_sorted_percentile(samples, 95),
+            'p99_ms': 1000 * get_sorted_percentile(samples, 99),
+            'max_ms': 1000 * samples[-1]
+        }
+
+    # Returns a summary of every latency measured since the game started
+    def get_report(self):
+        histogram = self.histogram
+        if histogram.count == 0:
+            return 'no input events reached the screen'
+        distribution = {
+            'count': histogram.count,
+            'avg_ms': 1000 * histogram.total / histogram.count,
+            'p50_ms': 1000 * histogram.get_percentile(50),
+            'p95_ms': 1000 * histogram.get_percentile(95),
+            'p99_ms': 1000 * histogram.get_percentile(99),
+            'max_ms': 1000 * histogram.max
+        }
+        return '{count} events, avg {avg_ms:.1f}ms p50 {p50_ms:.1f}ms p95 {p95_ms:.1f}ms p99 {p99_ms:.1f}ms max {max_ms:.1f}ms'.format(**distribution)
+
+    # The overlay shows the rolling window
+    def __str__(self):
+        distribution = self.get_distribution(self.samples)
+        if distribution['count'] == 0:
+            return '-'
+        return 'avg {avg_ms:.1f}ms p50 {p50_ms:.1f}ms p99 {p99_ms:.1f}ms'.format(**distribution)
+
+
+# The timer shared by the game loop and the states it runs
+frame_timer = FrameTimer()
+input_latency = InputLatency()
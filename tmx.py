@@ -0,0 +1,194 @@
+import xml.etree.ElementTree
+import hashlib
+import numpy
+import os
+import sys
+import shared
+import mapfile
+
+
+# Loader for maps made in the Tiled editor, e.g. tiled/level.tmx
+# Tile layers are read from their CSV data. Every tile of a tile layer is solid, unless its tileset gives it a solid=false property,
+# and the solid tiles are merged into as few platform rects as possible
+# The chars layer places things instead of terrain, with each of its tiles turned into a spawn of the kind the tile stands for
+# Object layers can add spawns too, with objects whose type is a spawn kind, and extra platforms, with rect objects of type solid
+# Parsing the XML is slow next to reading a compiled mapfile, so the result is cached in the binary mapfile format
+# and only recompiled when the map or one of its tilesets changes
+COMPILED_DIR = './cache/maps/'
+COMPILE_MODE = 'tmx'
+CHARS_LAYER = 'chars'
+
+# The spawn kind of each tile of the chars tileset by tile id, for tiles that don't have a kind property of their own
+CHAR_KINDS = ['player', 'onion']
+
+# The highest bits of a tile gid hold its flip flags, which don't matter for collision or spawns
+GID_MASK = 0x0FFFFFFF
+
+
+def get_compiled_path(path):
+    return COMPILED_DIR + os.path.splitext(os.path.basename(path))[0] + '.bin'
+
+
+# Returns a dict of the name to value properties of an element. Bool properties are converted, everything else is kept as a string
+def read_properties(element):
+    properties = {}
+    properties_element = element.find('properties')
+    if properties_element is None:
+        return properties
+    for property_element in properties_element.findall('property'):
+        value = property_element.get('value', property_element.text)
+        if property_element.get('type') == 'bool':
+            value = value == 'true'
+        properties[property_element.get('name')] = value
+    return properties
+
+
+# Reads a tileset, either embedded in the map or from the TSX file its source attribute points to
+# Returns its first gid, its name and a dict of tile id to tile properties for every tile that has any
+def read_tileset(tileset_element, map_dir):
+    firstgid = int(tileset_element.get('firstgid'))
+    source = tileset_element.get('source')
+    if source is not None:
+        tileset_element = xml.etree.ElementTree.parse(os.path.join(map_dir, source)).getroot()
+
+    tile_properties = {}
+    for tile_element in tileset_element.findall('tile'):
+        properties = read_properties(tile_element)
+        # Tiled 1.9 renamed a tile's type to its class
+        tile_type = tile_element.get('type', tile_element.get('class'))
+        if tile_type is not None:
+            properties.setdefault('kind', tile_type)
+        tile_properties[int(tile_element.get('id'))] = properties
+    return firstgid, tileset_element.get('name'), tile_properties
+
+
+# Returns the tileset a gid belongs to and the id of the tile within it. Tilesets must be sorted by first gid
+def find_tile(tilesets, gid):
+    for tileset in reversed(tilesets):
+        if gid >= tileset[0]:
+            return tileset, gid - tileset[0]
+    raise ValueError('Tile gid ' + str(gid) + ' is not in any tileset')
+
+
+# Returns the gids of a tile layer as an array indexed by [y][x], with 0 for empty tiles
+def read_layer_data(layer_element):
+    data_element = layer_element.find('data')
+    if data_element.get('encoding') != 'csv':
+        raise ValueError('Tile layer ' + str(layer_element.get('name')) + ' is not CSV encoded')
+    width = int(layer_element.get('width'))
+    height = int(layer_element.get('height'))
+    gids = numpy.array([int(value) for value in data_element.text.replace('\n', '').split(',') if value != ''], dtype=numpy.uint32)
+    return (gids & GID_MASK).reshape(height, width)
+
+
+def get_char_kind(tileset, tile_id):
+    kind = tileset[2].get(tile_id, {}).get('kind')
+    if kind is None:
+        kind = CHAR_KINDS[tile_id]
+    assert kind in mapfile.SPAWN_KINDS, 'Unknown spawn kind ' + kind
+    return kind
+
+
+def read_chars_layer(tilesets, gids, tile_size):
+    spawns = []
+    tile_ys, tile_xs = numpy.nonzero(gids)
+    for tile_x, tile_y in zip(tile_xs.tolist(), tile_ys.tolist()):
+        tileset, tile_id = find_tile(tilesets, int(gids[tile_y][tile_x]))
+        spawns.append((get_char_kind(tileset, tile_id), tile_x * tile_size[0], tile_y * tile_size[1]))
+    return spawns
+
+
+# Returns a bool array indexed by [y][x] of which tiles of a tile layer are solid
+def read_solid_tiles(tilesets, gids):
+    solid = gids != 0
+    for gid in numpy.unique(gids[solid]).tolist():
+        tileset, tile_id = find_tile(tilesets, gid)
+        if not tileset[2].get(tile_id, {}).get('solid', True):
+            solid[gids == gid] = False
+    return solid
+
+
+# Returns the platforms and spawns placed by the objects of an object layer
+def read_object_layer(tilesets, objectgroup_element):
+    platforms = []
+    spawns = []
+    for object_element in objectgroup_element.findall('object'):
+        x = int(float(object_element.get('x')))
+        y = int(float(object_element.get('y')))
+        width = int(float(object_element.get('width', 0)))
+        height = int(float(object_element.get('height', 0)))
+        object_type = object_element.get('type', object_element.get('class'))
+        gid = int(object_element.get('gid', 0)) & GID_MASK
+        if gid != 0:
+            # Tile objects are positioned by their bottom left corner
+            y -= height
+            if object_type is None:
+                object_type = get_char_kind(*find_tile(tilesets, gid))
+
+        if object_type == 'solid':
+            platforms.append((x, y, width, height))
+        elif object_type in mapfile.SPAWN_KINDS:
+            spawns.append((object_type, x, y))
+    return platforms, spawns
+
+
+# Parses a TMX map and its tilesets
+# Returns the map size, the platform rects and the (kind, x, y) spawns, like the other mapfile readers
+def compile_tmx(path):
+    map_element = xml.etree.ElementTree.parse(path).getroot()
+    if map_element.get('orientation') != 'orthogonal' or map_element.get('infinite') == '1':
+        raise ValueError(path + ' is not a finite orthogonal map')
+    tile_size = (int(map_element.get('tilewidth')), int(map_element.get('tileheight')))
+    map_tiles = (int(map_element.get('width')), int(map_element.get('height')))
+
+    map_dir = os.path.dirname(path)
+    tilesets = sorted([read_tileset(tileset_element, map_dir) for tileset_element in map_element.findall('tileset')], key=lambda tileset: tileset[0])
+
+    solid = numpy.zeros((map_tiles[1], map_tiles[0]), dtype=bool)
+    platforms = []
+    spawns = []
+    for layer_element in map_element:
+        if layer_element.tag == 'layer':
+            gids = read_layer_data(layer_element)
+            if layer_element.get('name') == CHARS_LAYER:
+                spawns += read_chars_layer(tilesets, gids, tile_size)
+            else:
+                solid |= read_solid_tiles(tilesets, gids)
+        elif layer_element.tag == 'objectgroup':
+            object_platforms, object_spawns = read_object_layer(tilesets, layer_element)
+            platforms += object_platforms
+            spawns += object_spawns
+
+    tile_rects = mapfile.merge_rects(solid)
+    platforms = [(x * tile_size[0], y * tile_size[1], width * tile_size[0], height * tile_size[1]) for x, y, width, height in tile_rects] + platforms
+    print('compiled ' + path + ' into ' + str(len(platforms)) + ' platforms from ' + str(int(solid.sum())) + ' solid tiles', file=sys.stderr)
+
+    return (map_tiles[0] * tile_size[0], map_tiles[1] * tile_size[1]), platforms, spawns
+
+
+# Hashes the map and every external tileset it uses, so that editing any of them triggers a rebuild
+def hash_sources(path):
+    source_hash = hashlib.sha1(shared.hash_file(path))
+    map_dir = os.path.dirname(path)
+    for tileset_element in xml.etree.ElementTree.parse(path).getroot().findall('tileset'):
+        source = tileset_element.get('source')
+        if source is not None:
+            source_hash.update(shared.hash_file(os.path.join(map_dir, source)))
+    return source_hash.digest()
+
+
+# Compiles a TMX map and caches the result, whether or not the cached copy is up to date
+def compile_file(path):
+    size, platforms, spawns = compile_tmx(path)
+    os.makedirs(COMPILED_DIR, exist_ok=True)
+    mapfile.write_binary(get_compiled_path(path), hash_sources(path), COMPILE_MODE, size, platforms, spawns)
+    return size, platforms, spawns
+
+
+# Returns the map size, platforms and spawns of a TMX map, from the compiled cache when it was built from the current sources
+# Doesn't need the display, so it can run on a loader thread
+def load(path):
+    header = mapfile.read_binary_header(get_compiled_path(path))
+    if header is None or header[0] != COMPILE_MODE or header[1] != hash_sources(path):
+        return compile_file(path)
+    return mapfile.read_binary(get_compiled_path(path))